@@ -2,6 +2,11 @@
 
 """ Adjusts yahoo price data.
 
+    With --append, existing output files are appended with dates after
+    their last date, if the adjusted close of that date is unchanged;
+    otherwise (eg, the projected data has been rewritten upon a split or
+    dividend) they are rewritten.
+
     Example usage:
       ./adjust_yahoo.py --yahoo_dir=./yahoo
                         --output_dir=./adjusted
@@ -15,16 +20,52 @@ def adjust(raw, ratios):
   for i in range(len(raw)):
     raw[i] *= adjcloses[i] / closes[i]
 
-def output(base_dir, label, ticker, dates, values):
+LABELS = ['open', 'high', 'low', 'close', 'volume', 'volumed']
+
+# Outputs values from index start, appending to existing file if start > 0.
+def output(base_dir, label, ticker, dates, values, start=0):
   output_dir = '%s/%s' % (base_dir, label)
   if not os.path.isdir(output_dir):
     os.mkdir(output_dir)
-  with open('%s/%s' % (output_dir, ticker), 'w') as fp:
-    for i in range(len(dates)):
+  with open('%s/%s' % (output_dir, ticker), 'w' if start == 0 else 'a') as fp:
+    for i in range(start, len(dates)):
       print >> fp, '%s\t%f' % (dates[i], values[i])
 
+# Returns index of the first date to append to existing output files of
+# ticker, or 0 if they should be rewritten.
+def getAppendStart(base_dir, ticker, dates, adjcloses):
+  last_lines = []
+  for label in LABELS:
+    output_file = '%s/%s/%s' % (base_dir, label, ticker)
+    if not os.path.isfile(output_file):
+      return 0
+    last_lines.append(util.readLastLine(output_file))
+  if None in last_lines:
+    return 0
+  last_dates = set([line.split('\t')[0] for line in last_lines])
+  if len(last_dates) != 1:
+    return 0
+  last_date = last_dates.pop()
+  if last_date not in dates:
+    return 0
+  index = dates.index(last_date)
+  close = last_lines[LABELS.index('close')].split('\t')[1]
+  if close != '%f' % adjcloses[index]:
+    return 0
+  return index + 1
+
+# Writes series (in the order of LABELS) of ticker to base_dir.
+def writeAdjusted(base_dir, ticker, dates, series, append):
+  start = 0
+  if append:
+    start = getAppendStart(base_dir, ticker, dates,
+                           series[LABELS.index('close')])
+  for i in range(len(LABELS)):
+    output(base_dir, LABELS[i], ticker, dates, series[i], start)
+
 def adjustYahoo(args):
-  tickers = sorted(os.listdir(args.yahoo_dir))
+  tickers = util.filterTickers(sorted(os.listdir(args.yahoo_dir)),
+                               args.changed_ticker_file)
   for ticker in tickers:
     dates, opens, highs, lows, closes, adjcloses, volumes = util.readYahoo(
         '%s/%s' % (args.yahoo_dir, ticker), 'date,open,high,low,close,adjclose,volume')
@@ -33,17 +74,20 @@ def adjustYahoo(args):
     adjhighs = [highs[i]*ratios[i] for i in range(len(dates))]
     adjlows = [lows[i]*ratios[i] for i in range(len(dates))]
     volumed = [volumes[i]*adjcloses[i] for i in range(len(dates))]
-    output(args.output_dir, 'open', ticker, dates, adjopens)
-    output(args.output_dir, 'high', ticker, dates, adjhighs)
-    output(args.output_dir, 'low', ticker, dates, adjlows)
-    output(args.output_dir, 'close', ticker, dates, adjcloses)
-    output(args.output_dir, 'volume', ticker, dates, volumes)
-    output(args.output_dir, 'volumed', ticker, dates, volumed)
+    writeAdjusted(args.output_dir, ticker, dates,
+                  [adjopens, adjhighs, adjlows, adjcloses, volumes, volumed],
+                  args.append)
 
 def main():
   parser = argparse.ArgumentParser()
   parser.add_argument('--yahoo_dir', required=True)
   parser.add_argument('--output_dir', required=True)
+  parser.add_argument('--changed_ticker_file',
+                      help='if specified, only process tickers listed in '
+                           'this file (see run.py)')
+  parser.add_argument('--append', action='store_true',
+                      help='append new dates to existing files, see '
+                           'module doc')
   adjustYahoo(parser.parse_args())
 
 if __name__ == '__main__':
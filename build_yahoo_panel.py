@@ -0,0 +1,121 @@
+#!/usr/bin/python2.7
+
+""" Builds price-derived data of yahoo tickers in one pass.
+
+    Each raw file is read once into a (trading days x FIELDS) array, from
+    which the outputs of these scripts are derived and written in their
+    formats:
+      project_yahoo.py: --projected_dir
+      adjust_yahoo.py: --adjusted_dir
+      compute_rolling_window_feature.py --method=mean on adjusted volumed:
+          --adjusted_dir/volumed_mean_<volumed_k>
+      compute_volatility.py on adjusted close: <volatility_prefix>_<k>
+      compute_open_gain.py --fill: --gain_label_dir
+
+    Example usage:
+      ./build_yahoo_panel.py --raw_dir=./raw
+                             --trading_day_file=./trading_days
+                             --projected_dir=./projected
+                             --adjusted_dir=./adjusted
+                             --volumed_k=5
+                             --volatility_prefix=./volatility
+                             --volatility_k=24,48
+                             --gain_label_k=5
+                             --gain_label_dir=./gain_label/5
+
+    --append applies to projected and adjusted data as in project_yahoo.py
+    and adjust_yahoo.py; other outputs of processed tickers are rewritten.
+"""
+
+import adjust_yahoo
+import argparse
+import compute_open_gain
+import compute_volatility
+import logging
+import numpy
+import os
+import project_yahoo
+import util
+
+FIELDS = ['open', 'high', 'low', 'close', 'adjclose', 'volume']
+
+# Returns [dates, data, panel] of trading days in raw_file, where data is
+# returned by project_yahoo.readRawData() and panel is the float array of
+# data of dates (ascending) by FIELDS.
+def readPanel(raw_file, trading_days):
+  data = project_yahoo.readRawData(raw_file)
+  dates = [date for date in trading_days if date in data]
+  panel = numpy.array([data[date] for date in dates], dtype=float)
+  return dates, data, panel.reshape(len(dates), len(FIELDS))
+
+def buildPanel(args):
+  tickers = sorted([f[:f.rfind('.')] for f in os.listdir(args.raw_dir)
+                    if f.endswith('.csv')])
+  tickers = util.filterTickers(tickers, args.changed_ticker_file)
+  with open(args.trading_day_file, 'r') as fp:
+    trading_days = sorted(fp.read().splitlines())
+  volatility_ks = [int(k) for k in args.volatility_k.split(',')]
+  volumed_dir = '%s/volumed_mean_%d' % (args.adjusted_dir, args.volumed_k)
+  volatility_dirs = ['%s_%d' % (args.volatility_prefix, k)
+                     for k in volatility_ks]
+  util.maybeMakeDirs([args.projected_dir, args.adjusted_dir, volumed_dir,
+                      args.gain_label_dir] + volatility_dirs)
+
+  gain_stats = {'total': 0, 'nolabel': 0, 'mincap': 0, 'maxcap': 0}
+  for ticker in tickers:
+    dates, data, panel = readPanel('%s/%s.csv' % (args.raw_dir, ticker),
+                                   trading_days)
+    opens, highs, lows, closes, adjcloses, volumes = panel.T
+    project_yahoo.writeProjected('%s/%s' % (args.projected_dir, ticker),
+                                 dates, data, args.append)
+
+    ratios = adjcloses / closes
+    volumed = volumes * adjcloses
+    adjust_yahoo.writeAdjusted(
+        args.adjusted_dir, ticker, dates,
+        [opens * ratios, highs * ratios, lows * ratios, adjcloses, volumes,
+         volumed], args.append)
+
+    means = util.rollingMean(volumed, args.volumed_k)
+    with open('%s/%s' % (volumed_dir, ticker), 'w') as fp:
+      for i in range(args.volumed_k - 1, len(dates)):
+        print >> fp, '%s\t%f' % (dates[i], means[i])
+
+    for i in range(len(volatility_ks)):
+      volatilities = compute_volatility.getVolatilities(adjcloses,
+                                                        volatility_ks[i])
+      with open('%s/%s' % (volatility_dirs[i], ticker), 'w') as fp:
+        for j in range(len(dates)):
+          print >> fp, '%s\t%f' % (dates[j], volatilities[j])
+
+    # Same as compute_open_gain.py, which adjusts open prices in this order.
+    gains = compute_open_gain.getOpenGains(
+        opens * adjcloses / closes, args.gain_label_k, gain_stats)
+    compute_open_gain.writeGains('%s/%s' % (args.gain_label_dir, ticker),
+                                 dates, gains, True)
+  logging.info('gain label stats: %s' % gain_stats)
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--raw_dir', required=True)
+  parser.add_argument('--trading_day_file', required=True)
+  parser.add_argument('--projected_dir', required=True)
+  parser.add_argument('--adjusted_dir', required=True)
+  parser.add_argument('--volumed_k', type=int, required=True)
+  parser.add_argument('--volatility_prefix', required=True)
+  parser.add_argument('--volatility_k', required=True,
+                      help='comma-separated windows of volatility')
+  parser.add_argument('--gain_label_k', type=int, required=True)
+  parser.add_argument('--gain_label_dir', required=True)
+  parser.add_argument('--changed_ticker_file',
+                      help='if specified, only process tickers listed in '
+                           'this file (see run.py)')
+  parser.add_argument('--append', action='store_true',
+                      help='append new dates to existing projected and '
+                           'adjusted files, see module doc')
+  args = parser.parse_args()
+  util.configLogging()
+  buildPanel(args)
+
+if __name__ == '__main__':
+  main()
@@ -9,6 +9,7 @@
                         --max_neg=0.01
                         --min_pos=0.01
                         --feature_base_dir=./features
+                        --feature_store_dir=./feature_store
                         --feature_list=./feature_list
                         --feature_stats=./feature_stats
                         --min_date=2005-01-01
@@ -21,35 +22,48 @@
                         --meta_file=./meta
                         --weight_power=2
                         --weight_file=./weight
+                        --workers=8
+                        --data_format=npy
 
     For each ticker, gains within specified min/max date are collected, and
     classified into positive/negative according to the thresholds.
     For each dated gain, features are joined by looking back a specified max
     window and using the most recent value (or 0 if not found).
 
+    If --feature_store_dir is specified, features with a store file there
+    (see convert_feature_store.py) are read from the store instead of
+    --feature_base_dir, unless the store is out of date with the feature
+    dir.
+
     If --date_file is specified, only dates in the file (and satisfying
     min/max date thresholds) will be selcted for data collection.
 
     These files are written:
-    data_file: matrix of features delimited by space.  Features are in the
+    data_file: matrix of features delimited by space (or a .npy matrix with
+               --data_format=npy, see util.readMatrix).  Features are in the
                same order as specified by feature_list.
-    label_file: list of labels corresponding to each row in data_file.
-    rlabel_file: list of regression labels corresponding to each row in data_file.
+    label_file: list (or .npy vector) of labels corresponding to each row in
+                data_file.
+    rlabel_file: list (or .npy vector) of regression labels corresponding to
+                 each row in data_file.
     meta_file: ticker, gain date and feature count, and actual gain
                corresponding to each row in data_file.
     (optional) weight_file: weight of each data point.
 """
 
 import argparse
-import bisect
-import datetime
+import itertools
 import logging
+import multiprocessing
 import numpy
 import os
 import util
 
 DEBUG = False
 MISSING_VALUE = numpy.nan
+SHARDS_PER_WORKER = 4
+# Order of output files in a collected block.
+DATA_INDEX, LABEL_INDEX, RLABEL_INDEX, META_INDEX, WEIGHT_INDEX = range(5)
 
 def readFeatureList(feature_list_file):
   with open(feature_list_file, 'r') as fp:
@@ -69,13 +83,35 @@ def readFeatureRanges(feature_stats_file):
     feature_ranges[feature] = [perc1, perc99]
   return feature_ranges
 
-def collectData(gain_dir, date_file, max_neg, min_pos, feature_base_dir,
-                feature_list_file, feature_stats_file, min_date, max_date,
-                window, min_feature_perc, data_file, label_file, rlabel_file,
-                meta_file, weight_power, weight_file):
-  tickers = sorted(os.listdir(gain_dir))
-  feature_list = readFeatureList(feature_list_file)
-  min_feature_count = int(len(feature_list) * min_feature_perc)
+# Returns store files of features in feature_list (None for features
+# without a store file, or if feature_store_dir is not specified).  Stores
+# out of date with their feature dirs (see util.isFeatureStoreCurrent())
+# are not used.
+def findFeatureStores(feature_store_dir, feature_base_dir, feature_list):
+  store_files = [None for i in range(len(feature_list))]
+  if not feature_store_dir:
+    return store_files
+  for i in range(len(feature_list)):
+    store_file = util.getFeatureStorePath(feature_store_dir, feature_list[i])
+    if not os.path.isfile(store_file):
+      continue
+    if not util.isFeatureStoreCurrent(
+        util.FeatureStore(store_file),
+        '%s/%s' % (feature_base_dir, feature_list[i])):
+      logging.warning('feature store out of date, reading feature dir '
+                      'instead: %s' % store_file)
+      continue
+    store_files[i] = store_file
+  logging.info('reading %d of %d features from feature stores' % (
+      len([f for f in store_files if f is not None]), len(feature_list)))
+  return store_files
+
+# Opens store files returned by findFeatureStores().
+def openFeatureStores(store_files):
+  return [None if store_file is None else util.FeatureStore(store_file)
+          for store_file in store_files]
+
+def getFeatureRanges(feature_stats_file, feature_list):
   feature_ranges = readFeatureRanges(feature_stats_file)
   for feature in feature_list:
     if feature not in feature_ranges:
@@ -89,144 +125,254 @@ def collectData(gain_dir, date_file, max_neg, min_pos, feature_base_dir,
               feature.startswith('window')), (
           'no range info for feature %s' % feature)
       feature_ranges[feature] = [float('-Inf'), float('Inf')]
-    lower, upper = feature_ranges[feature]
+  # [[lower ...], [upper ...]] in the order of feature_list.
+  return (numpy.array([feature_ranges[feature][0] for feature in feature_list]),
+          numpy.array([feature_ranges[feature][1] for feature in feature_list]))
 
-  data_fp = open(data_file, 'w')
-  label_fp = open(label_file, 'w')
-  rlabel_fp = open(rlabel_file, 'w')
-  meta_fp = open(meta_file, 'w')
-  weight_fp = None
-  if weight_file:
-    weight_fp = open(weight_file, 'w')
-
-  skip_stats = {'feature_file': 0,
-                'index': 0,
-                'min_date': 0,
-                'max_date': 0,
-                'filter_date': 0,
-                'neg_pos': 0,
-                'window': 0,
-                'min_perc': 0,
-                '1_perc': 0,
-                '99_perc': 0}
+# Reads [days, values] arrays of all features for ticker.
+# Missing feature files are treated as empty.
+def readFeatureItems(ticker, feature_base_dir, feature_list, feature_stores,
+                     skip_stats):
+  feature_items = []
+  for i in range(len(feature_list)):
+    if feature_stores[i] is not None:
+      if feature_stores[i].hasTicker(ticker):
+        feature_items.append(feature_stores[i].read(ticker))
+        continue
+    else:
+      feature_file = '%s/%s/%s' % (feature_base_dir, feature_list[i], ticker)
+      if os.path.isfile(feature_file):
+        keys, values = util.readKeyListValueList(feature_file)
+        feature_items.append([util.ymdsToDays(keys),
+                              numpy.array(values, dtype=numpy.float64)])
+        continue
+    skip_stats['feature_file'] += 1
+    feature_items.append([numpy.zeros(0, dtype=numpy.int32),
+                          numpy.zeros(0, dtype=numpy.float64)])
+  return feature_items
+
+# Selects gains within [min_date, max_date] and dates (if not None).
+# Returns [dates, gains] arrays.
+def selectGains(gain_file, min_date, max_date, dates, skip_stats):
+  keys, values = util.readKeyListValueList(gain_file)
+  gain_dates = numpy.array(keys, dtype=str)
+  gains = numpy.array(values, dtype=numpy.float64)
+  mask = gain_dates >= min_date
+  skip_stats['min_date'] += numpy.sum(~mask)
+  max_mask = gain_dates <= max_date
+  skip_stats['max_date'] += numpy.sum(mask & ~max_mask)
+  mask &= max_mask
+  if dates is not None:
+    date_mask = numpy.in1d(gain_dates, dates)
+    skip_stats['filter_date'] += numpy.sum(mask & ~date_mask)
+    mask &= date_mask
+  return gain_dates[mask], gains[mask]
+
+def joinFeatures(gain_days, feature_items, lowers, uppers, window, skip_stats):
+  """ As-of joins features onto gain dates.  For each dated feature, the most
+      recent value on or before each gain date is used if it is within
+      window days; undated features (eg sector) are used as is.  Values out
+      of [lower, upper] are dropped.
+      Returns a matrix of features (MISSING_VALUE if not joined) and the
+      count of joined features per gain date.
+  """
+  n = gain_days.shape[0]
+  features = numpy.empty((n, len(feature_items)))
+  features.fill(MISSING_VALUE)
+  feature_count = numpy.zeros(n, dtype=numpy.int64)
+  for i in range(len(feature_items)):
+    days, values = feature_items[i]
+    if days.shape[0] == 1 and days[0] == util.UNDATED_DAY:
+      # undated feature, eg sector
+      feature = numpy.repeat(values[0], n)
+      mask = numpy.ones(n, dtype=bool)
+    else:
+      # dated feature, eg pgain
+      index = numpy.searchsorted(days, gain_days, side='right') - 1
+      mask = index >= 0
+      skip_stats['index'] += numpy.sum(~mask)
+      index[~mask] = 0
+      if days.shape[0] == 0:
+        continue
+      window_mask = gain_days - days[index] > window
+      skip_stats['window'] += numpy.sum(mask & window_mask)
+      mask &= ~window_mask
+      feature = values[index]
+    lower_mask = feature < lowers[i]
+    skip_stats['1_perc'] += numpy.sum(mask & lower_mask)
+    mask &= ~lower_mask
+    upper_mask = feature > uppers[i]
+    skip_stats['99_perc'] += numpy.sum(mask & upper_mask)
+    mask &= ~upper_mask
+    features[mask, i] = feature[mask]
+    feature_count += mask
+  return features, feature_count
+
+SKIP_STATS_KEYS = ['feature_file', 'index', 'min_date', 'max_date',
+                   'filter_date', 'neg_pos', 'window', 'min_perc',
+                   '1_perc', '99_perc']
+
+# Per-process collection context, set by initContext().  With --workers,
+# each worker process sets up its own (eg, opens its own feature stores).
+CONTEXT = dict()
+
+def initContext(context):
+  CONTEXT.clear()
+  CONTEXT.update(context)
+  CONTEXT['feature_stores'] = openFeatureStores(
+      context['feature_store_files'])
+
+def collectTicker(ticker, skip_stats):
+  """ Collects rows for ticker.  Returns [features, labels, gains, meta,
+      weights] of collected rows, where meta is a list of lines.
+  """
+  c = CONTEXT
+  gain_file = '%s/%s' % (c['gain_dir'], ticker)
+  gain_dates, gains = selectGains(gain_file, c['min_date'], c['max_date'],
+                                  c['dates'], skip_stats)
+  max_neg, min_pos = c['max_neg'], c['min_pos']
+
+  # Do not skip gains between max_neg and min_pos since they need to be
+  # part of testing data.  Instead output negative label and postpone
+  # filtering to filter_metadata (remove negative labels for training and
+  # not for testing).
+  skip_stats['neg_pos'] += numpy.sum((max_neg < gains) & (gains < min_pos))
+  labels = numpy.where(gains <= max_neg, 0.0,
+                       numpy.where(gains >= min_pos, 1.0, -1.0))
+  weights = numpy.where(gains <= max_neg, max_neg - gains,
+                        numpy.where(gains >= min_pos, gains - min_pos, 0.0))
+  weights **= c['weight_power']
+
+  feature_items = readFeatureItems(ticker, c['feature_base_dir'],
+                                   c['feature_list'], c['feature_stores'],
+                                   skip_stats)
+  features, feature_count = joinFeatures(
+      util.ymdsToDays(gain_dates), feature_items, c['lowers'], c['uppers'],
+      c['window'], skip_stats)
+
+  mask = feature_count >= c['min_feature_count']
+  skip_stats['min_perc'] += numpy.sum(~mask)
+
+  if DEBUG:
+    for i in range(len(gain_dates)):
+      print 'gain: %f (%s)' % (gains[i], gain_dates[i])
+      print 'features: %s' % features[i]
+
+  meta = ['%s\t%s\t%d\t%f' % (ticker, gain_dates[i], feature_count[i], gains[i])
+          for i in numpy.nonzero(mask)[0]]
+  return [features[mask], labels[mask], gains[mask], meta, weights[mask]]
+
+def formatText(matrix):
+  if len(matrix.shape) == 1:
+    return ''.join(['%f\n' % value for value in matrix])
+  return ''.join(['%s\n' % ' '.join(['%f' % value for value in row])
+                  for row in matrix])
+
+def collectShard(tickers):
+  """ Collects rows for a contiguous shard of tickers.  Returns a block of
+      data, label, rlabel, meta and weight file contents, and skip_stats.
+      Contents are text, except for data/label/rlabel/weight with npy
+      data_format which are arrays.
+  """
+  skip_stats = dict([[key, 0] for key in SKIP_STATS_KEYS])
+  items = [[], [], [], [], []]
+  for ticker in tickers:
+    ticker_items = collectTicker(ticker, skip_stats)
+    for i in range(len(items)):
+      items[i].append(ticker_items[i])
+  block = []
+  for i in range(len(items)):
+    if i == META_INDEX:
+      block.append(''.join(['%s\n' % line
+                            for lines in items[i] for line in lines]))
+      continue
+    if i == DATA_INDEX:
+      matrix = numpy.vstack(items[i])
+    else:
+      matrix = numpy.concatenate(items[i])
+    if CONTEXT['data_format'] == 'text':
+      block.append(formatText(matrix))
+    else:
+      block.append(matrix.astype(CONTEXT['data_dtype']))
+  return block, skip_stats
+
+def getShards(tickers, workers):
+  # Use more shards than workers for better balancing.
+  shard_size = max(1, len(tickers) / (workers * SHARDS_PER_WORKER))
+  return [tickers[i:i+shard_size]
+          for i in range(0, len(tickers), shard_size)]
+
+def collectData(gain_dir, date_file, max_neg, min_pos, feature_base_dir,
+                feature_list_file, feature_stats_file, min_date, max_date,
+                window, min_feature_perc, data_file, label_file, rlabel_file,
+                meta_file, weight_power, weight_file, feature_store_dir=None,
+                workers=1, data_format='text', data_dtype=util.DATA_DTYPE):
+  tickers = sorted(os.listdir(gain_dir))
+  if DEBUG:
+    tickers = tickers[:1]
+  feature_list = readFeatureList(feature_list_file)
+  lowers, uppers = getFeatureRanges(feature_stats_file, feature_list)
 
   dates = None
   if date_file:
     with open(date_file, 'r') as fp:
-      dates = set(fp.read().splitlines())
+      dates = numpy.array(sorted(set(fp.read().splitlines())), dtype=str)
 
-  for ticker in tickers:
-    gain_file = '%s/%s' % (gain_dir, ticker)
-    gains = util.readKeyValueList(gain_file)
+  context = {
+      'gain_dir': gain_dir,
+      'dates': dates,
+      'max_neg': max_neg,
+      'min_pos': min_pos,
+      'feature_base_dir': feature_base_dir,
+      'feature_store_files': findFeatureStores(
+          feature_store_dir, feature_base_dir, feature_list),
+      'feature_list': feature_list,
+      'lowers': lowers,
+      'uppers': uppers,
+      'min_date': min_date,
+      'max_date': max_date,
+      'window': window,
+      'min_feature_count': int(len(feature_list) * min_feature_perc),
+      'weight_power': weight_power,
+      'data_format': data_format,
+      'data_dtype': data_dtype,
+  }
 
-    feature_items = [[] for i in range(len(feature_list))]
-    for i in range(len(feature_list)):
-      feature_file = '%s/%s/%s' % (feature_base_dir, feature_list[i], ticker)
-      if not os.path.isfile(feature_file):
-        skip_stats['feature_file'] += 1
-        continue
-      keys, values = util.readKeyListValueList(feature_file)
-      for j in range(len(keys)):
-        if keys[j] == '*':
-          continue
-        ymd = keys[j].split('-')
-        if len(ymd) == 3:
-          continue
-        # Change yyyy-mm to yyyy-mm-01
-        assert len(ymd) == 2
-        keys[j] += '-01'
-      feature_items[i] = [keys, values]
-
-    for gain_date, gain in gains:
-      if gain_date < min_date:
-        skip_stats['min_date'] += 1
-        continue
-      if gain_date > max_date:
-        skip_stats['max_date'] += 1
-        continue
-      if dates is not None and gain_date not in dates:
-        skip_stats['filter_date'] += 1
-        continue
+  # Output files in the order of a collected block.
+  if data_format == 'text':
+    fps = [open(data_file, 'w'), open(label_file, 'w'), open(rlabel_file, 'w')]
+  else:
+    assert data_format == 'npy', 'unknown data format: %s' % data_format
+    fps = [util.NpyWriter(data_file, len(feature_list), data_dtype),
+           util.NpyWriter(label_file, None, data_dtype),
+           util.NpyWriter(rlabel_file, None, data_dtype)]
+  fps.append(open(meta_file, 'w'))
+  if weight_file:
+    if data_format == 'text':
+      fps.append(open(weight_file, 'w'))
+    else:
+      fps.append(util.NpyWriter(weight_file, None, data_dtype))
+  skip_stats = dict([[key, 0] for key in SKIP_STATS_KEYS])
 
-      if max_neg < gain and gain < min_pos:
-        skip_stats['neg_pos'] += 1
-        # Do not skip these they need to be part of testing data.
-        # Instead output negative label and postpone filtering to filter_metadata
-        # (remove negative labels for training and not for testing).
-        #continue
-
-      if DEBUG:
-        print 'gain: %f (%s)' % (gain, gain_date)
-
-      if gain <= max_neg:
-        weight = max_neg - gain
-        label = 0.0
-      elif gain >= min_pos:
-        weight = gain - min_pos
-        label = 1.0
-      else:
-        weight = 0.0
-        label = -1.0
-      weight = weight**weight_power
-
-      features = [MISSING_VALUE for i in range(len(feature_list))]
-      feature_count = 0
-      for i in range(len(feature_list)):
-        keys, values = feature_items[i]
-        if len(keys) == 1 and keys[0] == '*':
-          # undated feature, eg sector
-          index = 0
-        else:
-          # dated feature, eg pgain
-          index = bisect.bisect_right(keys, gain_date) - 1
-          if index < 0:
-            skip_stats['index'] += 1
-            continue
-
-          gain_date_obj = datetime.datetime.strptime(gain_date, '%Y-%m-%d')
-          feature_date_obj = datetime.datetime.strptime(keys[index],
-                                                        '%Y-%m-%d')
-          delta = (gain_date_obj - feature_date_obj).days
-          if delta > window:
-            skip_stats['window'] += 1
-            continue
-
-        feature = values[index]
-        lower, upper = feature_ranges[feature_list[i]]
-        if feature < lower:
-          skip_stats['1_perc'] += 1
-          continue
-        if feature > upper:
-          skip_stats['99_perc'] += 1
-          continue
-
-        if DEBUG:
-          print 'feature %s: (%s, %f)' % (
-              feature_list[i], keys[index], feature)
-
-        features[i] = feature
-        feature_count += 1
-
-      if feature_count < min_feature_count:
-        skip_stats['min_perc'] += 1
-        continue
+  pool = None
+  if workers > 1:
+    pool = multiprocessing.Pool(workers, initContext, [context])
+    blocks = pool.imap(collectShard, getShards(tickers, workers))
+  else:
+    initContext(context)
+    blocks = itertools.imap(collectShard, [[ticker] for ticker in tickers])
+  # Blocks come back in ticker order, so output is the same as serial.
+  for block, shard_skip_stats in blocks:
+    for i in range(len(fps)):
+      fps[i].write(block[i])
+    for key, value in shard_skip_stats.iteritems():
+      skip_stats[key] += value
+  if pool is not None:
+    pool.close()
+    pool.join()
 
-      print >> data_fp, ' '.join(['%f' % feature for feature in features])
-      print >> label_fp, '%f' % label
-      print >> rlabel_fp, '%f' % gain
-      print >> meta_fp, '%s\t%s\t%d\t%f' % (
-          ticker, gain_date, feature_count, gain)
-      if weight_fp:
-        print >> weight_fp, '%f' % weight
-
-    if DEBUG: break
-
-  data_fp.close()
-  label_fp.close()
-  rlabel_fp.close()
-  meta_fp.close()
-  if weight_fp:
-    weight_fp.close()
+  for fp in fps:
+    fp.close()
   logging.info('skip_stats: %s' % skip_stats)
 
 def main():
@@ -236,6 +382,9 @@ def main():
   parser.add_argument('--max_neg', type=float, default=0.01)
   parser.add_argument('--min_pos', type=float, default=0.01)
   parser.add_argument('--feature_base_dir', required=True)
+  parser.add_argument('--feature_store_dir',
+                      help='if specified, features are read from feature '
+                           'stores in this dir when available')
   parser.add_argument('--feature_list', required=True)
   parser.add_argument('--feature_stats', required=True,
                       help='feature stats file with 1/99 percentiles '
@@ -256,6 +405,14 @@ def main():
                       help='if specified, will assign a weight to each '
                            'training sample with its distance to the '
                            'pos/neg threshold')
+  parser.add_argument('--data_format', default='text',
+                      choices=util.DATA_FORMATS,
+                      help='format of data/label/rlabel/weight files')
+  parser.add_argument('--data_dtype', default=util.DATA_DTYPE,
+                      help='dtype of data/label/rlabel/weight for npy format')
+  parser.add_argument('--workers', type=int, default=1,
+                      help='number of processes to collect data with; '
+                           'output is the same regardless')
   args = parser.parse_args()
   assert args.max_neg <= args.min_pos, 'max_neg > min_pos: %f vs %f' % (
       args.max_neg, args.min_pos)
@@ -264,7 +421,8 @@ def main():
               args.feature_base_dir, args.feature_list, args.feature_stats,
               args.min_date, args.max_date, args.window, args.min_feature_perc,
               args.data_file, args.label_file, args.rlabel_file, args.meta_file,
-              args.weight_power, args.weight_file)
+              args.weight_power, args.weight_file, args.feature_store_dir,
+              args.workers, args.data_format, args.data_dtype)
 
 if __name__ == '__main__':
   main()
@@ -13,31 +13,59 @@
 """
 
 import argparse
+import numpy
 import os
 import util
 
-def computeBasicFeature(processed_dir, ticker_file, dimension, header,
-                        feature_dir, info_file=None):
+def computeBasicFeatures(processed_dir, ticker_file, features):
+  """ Computes features in one pass over ticker dimension files, each
+      feature being [dimension, header, feature_dir, info_file] where
+      info_file is optional.
+  """
   tickers = util.readTickers(ticker_file)
-  feature_info = []  # [[yyyy, feature] ...]
+  dimensions = sorted(set([feature[0] for feature in features]))
+  # Per feature, [[years, values] ...] of tickers for feature info.
+  feature_infos = [[] for feature in features]
   for ticker in tickers:
-    dimension_file = '%s/%s/%s.tsv' % (processed_dir, ticker, dimension)
-    dfeatures = util.readSf1Column(dimension_file, header)
-    if dfeatures is None:
-      continue
-    with open('%s/%s' % (feature_dir, ticker), 'w') as fp:
-      for date, feature in dfeatures:
-        year = util.ymdToY(date)
-        if feature is None:
-          feature_info.append((year, None))
+    for dimension in dimensions:
+      table = util.readSf1Table(
+          '%s/%s/%s.tsv' % (processed_dir, ticker, dimension))
+      if table is None:
+        continue
+      dates, indicators, values = table
+      years = [util.ymdToY(date) for date in dates]
+      for i in range(len(features)):
+        feature_dimension, header, feature_dir, info_file = features[i]
+        if feature_dimension != dimension:
           continue
-        print >> fp, '%s\t%f' % (date, feature)
-        feature_info.append((year, feature))
-  if info_file is not None:
+        if header in indicators:
+          column = values[:, indicators.index(header)]
+        else:
+          column = numpy.empty(len(dates))
+          column.fill(numpy.nan)
+        with open('%s/%s' % (feature_dir, ticker), 'w') as fp:
+          for j in range(len(dates)):
+            if not numpy.isnan(column[j]):
+              print >> fp, '%s\t%f' % (dates[j], column[j])
+        feature_infos[i].append([years, column])
+  for i in range(len(features)):
+    dimension, header, feature_dir, info_file = features[i]
+    if info_file is None:
+      continue
+    feature_info = []  # [[yyyy, feature] ...]
+    for years, column in feature_infos[i]:
+      for j in range(len(years)):
+        feature = None if numpy.isnan(column[j]) else float(column[j])
+        feature_info.append((years[j], feature))
     util.writeFeatureInfo(
         [processed_dir, ticker_file, dimension, header, feature_dir],
         feature_info, info_file)
 
+def computeBasicFeature(processed_dir, ticker_file, dimension, header,
+                        feature_dir, info_file=None):
+  computeBasicFeatures(processed_dir, ticker_file,
+                       [[dimension, header, feature_dir, info_file]])
+
 def main():
   parser = argparse.ArgumentParser()
   parser.add_argument('--processed_dir', required=True)
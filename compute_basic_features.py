@@ -3,6 +3,7 @@
 # Adapted from qd/scripts/basic_features.py
 
 import argparse
+import compute_basic_feature
 import os
 import util
 
@@ -100,6 +101,18 @@ ITEMS = [
 #    ['WORKINGCAPITAL', ['ARQ']],
 ]
 
+# Returns [[indicator, dimension, feature] ...] of ITEMS, with MRx
+# dimensions (see util.getMrx()) if use_mrx.
+def getFeatures(use_mrx):
+  features = []
+  for indicator, dimensions in ITEMS:
+    for dimension in dimensions:
+      if use_mrx:
+        dimension = util.getMrx(dimension)
+      features.append([indicator, dimension,
+                       '%s-%s' % (indicator, dimension)])
+  return features
+
 def shouldRun(feature_dir, info_file):
   """ Returns whether feature computation should run on the specified dir.
       It should run if: no info file is present, indicating either there
@@ -116,8 +129,6 @@ def shouldRun(feature_dir, info_file):
 
 def main():
   parser = argparse.ArgumentParser()
-  parser.add_argument('--computer',
-      default='/Users/lnyang/lab/qd2/qd2/compute_basic_feature.py')
   parser.add_argument('--processed_dir', required=True,
                       help='dir of processed sf1 data')
   parser.add_argument('--ticker_file', required=True)
@@ -126,20 +137,16 @@ def main():
   parser.add_argument('--use_mrx', action='store_true')
   args = parser.parse_args()
 
-  for indicator, dimensions in ITEMS:
-    for dimension in dimensions:
-      if args.use_mrx:
-        dimension = util.getMrx(dimension)
-      folder = '%s-%s' % (indicator, dimension)
-      feature_dir = '%s/%s' % (args.feature_base_dir, folder)
-      info_file = '%s/%s' % (args.info_dir, folder)
-      if not shouldRun(feature_dir, info_file):
-        continue
-      cmd = ('%s --processed_dir=%s --ticker_file=%s --dimension=%s '
-             '--header=%s --feature_dir=%s --info_file=%s' % (
-             args.computer, args.processed_dir, args.ticker_file, dimension,
-             indicator, feature_dir, info_file))
-      util.run(cmd)
+  # All features are computed in one pass, see compute_basic_feature.py.
+  features = []  # [[dimension, header, feature_dir, info_file] ...]
+  for indicator, dimension, folder in getFeatures(args.use_mrx):
+    feature_dir = '%s/%s' % (args.feature_base_dir, folder)
+    info_file = '%s/%s' % (args.info_dir, folder)
+    if not shouldRun(feature_dir, info_file):
+      continue
+    features.append([dimension, indicator, feature_dir, info_file])
+  compute_basic_feature.computeBasicFeatures(
+      args.processed_dir, args.ticker_file, features)
 
 if __name__ == '__main__':
   main()
@@ -7,14 +7,41 @@
                                   --equation="{TAXRATE-ART} = ({EBT-ART} - {NETINC-ART}) / {NETINC-ART}"
                                   --ticker_file=./tickers
                                   --info_base_dir=./info
+
+    The formula is parsed once into a function over numpy arrays of symbol
+    values (see compileFormula()), which is evaluated on all dates of a
+    ticker at once.  Supported are numbers, symbols, + - * / ** and
+    parentheses.  Dates where any symbol is missing, any division is by
+    zero (including 0 to a negative power), or the result is not finite
+    (eg, overflow), are missing in output.  If a symbol is missing for a
+    ticker, its existing target file is removed, so that it is not read by
+    later equations.
+
+    Values are carried between equations at full precision, so targets of
+    equations using earlier targets may differ in the last printed digit
+    from reading them back from '%f'-formatted files.
 """
 
 import argparse
+import ast
 import logging
+import numpy
 import os
 import re
 import util
 
+SYMBOL_PATTERN = re.compile(r'\{([^{}]*)\}')
+# Symbols are renamed to valid python names for parsing.
+SYMBOL_NAME = 's%d'
+
+OPERATORS = {
+    ast.Add: numpy.add,
+    ast.Sub: numpy.subtract,
+    ast.Mult: numpy.multiply,
+    ast.Div: numpy.divide,
+    ast.Pow: numpy.power,
+}
+
 def findSymbols(equation):
   target, formula = equation.split('=')
   target = target.strip()
@@ -22,76 +49,155 @@ def findSymbols(equation):
       'bad equation: %s' % equation)
   target = target[1:-1]
   formula = formula.strip()
-
-  symbols = set()
-  index = 0
-  while index < len(formula):
-    p = formula.find('{', index)
-    if p < 0:
-      break
-    q = formula.find('}', p)
-    assert q > p, 'bad equation: %s' % equation
-    symbols.add(formula[p+1:q])
-    index = q + 1
-  assert len(symbols) > 0, 'bad equation: %s'
+  symbols = []
+  for symbol in SYMBOL_PATTERN.findall(formula):
+    if symbol not in symbols:
+      symbols.append(symbol)
+  assert len(symbols) > 0, 'bad equation: %s' % equation
   return target, symbols, formula
 
-def computeCustomFeature(feature_dir, equation, ticker_file, info_dir):
-  target, symbols, formula = findSymbols(equation)
+def compileNode(node, formula):
+  """ Returns function(values, zero) computing node, where values are arrays
+      of symbols, and zero is a bool array updated in place for dates with
+      division by zero.
+  """
+  if isinstance(node, ast.Num):
+    value = float(node.n)
+    return lambda values, zero: value
+  if isinstance(node, ast.Name):
+    assert re.match('^s[0-9]+$', node.id), (
+        'unknown name %s in formula: %s' % (node.id, formula))
+    index = int(node.id[1:])
+    return lambda values, zero: values[index]
+  if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+    operand = compileNode(node.operand, formula)
+    return lambda values, zero: -operand(values, zero)
+  if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.UAdd):
+    return compileNode(node.operand, formula)
+  if isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+    left = compileNode(node.left, formula)
+    right = compileNode(node.right, formula)
+    op = OPERATORS[type(node.op)]
+    if isinstance(node.op, ast.Div):
+      def divide(values, zero):
+        numerator = left(values, zero)
+        denominator = right(values, zero)
+        zero |= denominator == 0
+        return numpy.divide(numerator, denominator)
+      return divide
+    if isinstance(node.op, ast.Pow):
+      def power(values, zero):
+        base = left(values, zero)
+        exponent = right(values, zero)
+        zero |= (base == 0) & (exponent < 0)
+        return numpy.power(base, exponent)
+      return power
+    return lambda values, zero: op(left(values, zero), right(values, zero))
+  assert False, 'unsupported expression in formula: %s' % formula
+
+def compileFormula(formula, symbols):
+  """ Returns function(values) computing formula on values (list of arrays
+      in the order of symbols), which returns the result array and a bool
+      array of dates with division by zero.
+  """
+  expression = SYMBOL_PATTERN.sub(
+      lambda m: SYMBOL_NAME % symbols.index(m.group(1)), formula)
+  function = compileNode(ast.parse(expression, mode='eval').body, formula)
+  def evaluate(values):
+    size = len(values[0])
+    zero = numpy.zeros(size, dtype=bool)
+    with numpy.errstate(divide='ignore', invalid='ignore', over='ignore'):
+      result = function(values, zero) + numpy.zeros(size)
+    return result, zero
+  return evaluate
+
+# Returns feature values of symbols for ticker, as {symbol: {date: value}}
+# or None if the feature file does not exist.  Values are cached in data.
+def getSymbolData(feature_dir, ticker, symbols, data):
   for symbol in symbols:
-    assert os.path.isdir('%s/%s' % (feature_dir, symbol)), (
-        'nonexistent symbol: %s' % symbol)
-  target_dir = '%s/%s' % (feature_dir, target)
-  if not os.path.isdir(target_dir):
-    os.mkdir(target_dir)
-  pattern = re.compile("|".join([re.escape('{%s}' % symbol) for symbol in symbols]))
+    if symbol not in data:
+      feature_file = '%s/%s/%s' % (feature_dir, symbol, ticker)
+      data[symbol] = None
+      if os.path.isfile(feature_file):
+        data[symbol] = util.readKeyValueDict(feature_file)
+  return [data[symbol] for symbol in symbols]
+
+def computeCustomFeatures(feature_dir, equations, ticker_file, info_dir):
+  """ Computes equations in one pass over tickers, sharing loaded symbol
+      data between equations.  Later equations may use targets of earlier
+      ones.
+  """
+  items = []  # [[equation, target, symbols, evaluate] ...]
+  for equation in equations:
+    target, symbols, formula = findSymbols(equation)
+    for symbol in symbols:
+      assert os.path.isdir('%s/%s' % (feature_dir, symbol)), (
+          'nonexistent symbol: %s' % symbol)
+    target_dir = '%s/%s' % (feature_dir, target)
+    if not os.path.isdir(target_dir):
+      os.mkdir(target_dir)
+    items.append([equation, target, symbols,
+                  compileFormula(formula, symbols)])
 
   tickers = util.readTickers(ticker_file)
-  feature_info = []  # [[yyyy, feature] ...]
-  stats = {'missing_symbol': 0, 'missing_date': 0, 'divide_by_zero': 0}
+  # Per equation, [[years, values] ...] of tickers for feature info.
+  feature_infos = [[] for item in items]
+  stats = [{'missing_symbol': 0, 'missing_date': 0, 'divide_by_zero': 0,
+            'non_finite': 0} for item in items]
   for ticker in tickers:
-    missing_symbol = False
-    for symbol in symbols:
-      if not os.path.isfile('%s/%s/%s' % (feature_dir, symbol, ticker)):
-        missing_symbol = True
-        break
-    if missing_symbol:
-      stats['missing_symbol'] += 1
-      continue
-    data = {symbol: util.readKeyValueDict('%s/%s/%s' % (feature_dir, symbol, ticker))
-            for symbol in symbols}
-    dates = None
-    for symbol, dfeatures in data.iteritems():
-      if dates is None:
-        dates = set(dfeatures.keys())
-      else:
-        dates |= set(dfeatures.keys())
-    with open('%s/%s' % (target_dir, ticker), 'w') as fp:
-      for date in sorted(dates):
-        year = util.ymdToY(date)
-        missing_date = False
-        for symbol in symbols:
-          if date not in data[symbol]:
-            missing_date = True
-            break
-        if missing_date:
-          stats['missing_date'] += 1
-          feature_info.append((year, None))
-          continue
-        replace = {re.escape('{%s}' % symbol): '%f' % data[symbol][date] for symbol in symbols}
-        rformula = pattern.sub(lambda m: replace[re.escape(m.group(0))], formula)
-        try:
-          feature = eval(rformula)
-        except ZeroDivisionError:
-          stats['divide_by_zero'] += 1
-          feature_info.append((year, None))
-          continue
-        print >> fp, '%s\t%f' % (date, feature)
-        feature_info.append((year, feature))
-  util.writeFeatureInfo(
-      [feature_dir, equation, ticker_file],
-      feature_info, '%s/%s' % (info_dir, target))
-  logging.info('stats: %s' % stats)
+    data = dict()  # symbol => {date: value}
+    for i in range(len(items)):
+      equation, target, symbols, evaluate = items[i]
+      symbol_data = getSymbolData(feature_dir, ticker, symbols, data)
+      if None in symbol_data:
+        stats[i]['missing_symbol'] += 1
+        # Remove output of an earlier run, which is out of date.
+        target_file = '%s/%s/%s' % (feature_dir, target, ticker)
+        if os.path.isfile(target_file):
+          os.remove(target_file)
+        data[target] = None
+        continue
+      dates = set()
+      for dfeatures in symbol_data:
+        dates.update(dfeatures.iterkeys())
+      dates = sorted(dates)
+      missing = numpy.zeros(len(dates), dtype=bool)
+      values = []
+      for dfeatures in symbol_data:
+        missing |= numpy.array([date not in dfeatures for date in dates],
+                               dtype=bool)
+        values.append(numpy.array([dfeatures.get(date, numpy.nan)
+                                   for date in dates]))
+      result, zero = evaluate(values)
+      zero &= ~missing
+      non_finite = ~numpy.isfinite(result) & ~missing & ~zero
+      result[missing | zero | non_finite] = numpy.nan
+      stats[i]['missing_date'] += int(missing.sum())
+      stats[i]['divide_by_zero'] += int(zero.sum())
+      stats[i]['non_finite'] += int(non_finite.sum())
+      with open('%s/%s/%s' % (feature_dir, target, ticker), 'w') as fp:
+        for j in range(len(dates)):
+          if not numpy.isnan(result[j]):
+            print >> fp, '%s\t%f' % (dates[j], result[j])
+      years = [util.ymdToY(date) for date in dates]
+      feature_infos[i].append([years, result])
+      data[target] = {dates[j]: result[j] for j in range(len(dates))
+                      if not numpy.isnan(result[j])}
+
+  for i in range(len(items)):
+    equation, target, symbols, evaluate = items[i]
+    feature_info = []  # [[yyyy, feature] ...]
+    for years, result in feature_infos[i]:
+      for j in range(len(years)):
+        feature = None if numpy.isnan(result[j]) else float(result[j])
+        feature_info.append((years[j], feature))
+    util.writeFeatureInfo(
+        [feature_dir, equation, ticker_file],
+        feature_info, '%s/%s' % (info_dir, target))
+    logging.info('stats of %s: %s' % (target, stats[i]))
+
+def computeCustomFeature(feature_dir, equation, ticker_file, info_dir):
+  computeCustomFeatures(feature_dir, [equation], ticker_file, info_dir)
 
 def main():
   parser = argparse.ArgumentParser()
@@ -100,9 +206,9 @@ def main():
   parser.add_argument('--ticker_file', required=True)
   parser.add_argument('--info_base_dir', required=True)
   args = parser.parse_args()
+  util.configLogging()
   computeCustomFeature(args.feature_base_dir, args.equation, args.ticker_file,
                        args.info_base_dir)
 
 if __name__ == '__main__':
   main()
-
@@ -1,6 +1,7 @@
 #!/usr/bin/python2.7
 
 import argparse
+import compute_custom_feature
 import os
 import util
 
@@ -24,9 +25,16 @@ ITEMS = [
     ['ASSETS_EQUITY-ARQ', '{ASSETS-ARQ}/{EQUITY-ARQ}'],
 #    ['QUICKRATIO-ARQ', '({ASSETSC-ARQ} - {INVENTORY-ARQ}) / {LIABILITIESC-ARQ}'],
     ['CASHNEQ_ASSETS-ARQ', '{CASHNEQ-ARQ}/{ASSETS-ARQ}'],
-    [''],
 ]
 
+# Returns [[target, formula] ...] of ITEMS, for MRx (see util.getMrx()) if
+# use_mrx.
+def getItems(use_mrx):
+  if not use_mrx:
+    return ITEMS
+  return [[util.getMrx(target), util.getMrx(formula)]
+          for target, formula in ITEMS]
+
 def shouldRun(feature_base_dir, info_dir, target):
   """ Returns whether feature computation should run on the specified dir.
       It should run if: no info file is present, indicating either there
@@ -44,25 +52,21 @@ def shouldRun(feature_base_dir, info_dir, target):
 
 def main():
   parser = argparse.ArgumentParser()
-  parser.add_argument('--computer',
-      default='/Users/lnyang/lab/qd2/qd2/compute_custom_feature.py')
   parser.add_argument('--ticker_file', required=True)
   parser.add_argument('--feature_base_dir', required=True)
   parser.add_argument('--info_dir', required=True)
   parser.add_argument('--use_mrx', action='store_true')
   args = parser.parse_args()
+  util.configLogging()
 
-  for target, formula in ITEMS:
-    if args.use_mrx:
-      target = util.getMrx(target)
-      formula = util.getMrx(formula)
+  # All equations are computed in one pass, see compute_custom_feature.py.
+  equations = []
+  for target, formula in getItems(args.use_mrx):
     if not shouldRun(args.feature_base_dir, args.info_dir, target):
       continue
-    cmd = ('%s --feature_base_dir=%s --ticker_file=%s --info_base_dir=%s '
-           '--equation="{%s} = %s"' % (
-           args.computer, args.feature_base_dir, args.ticker_file,
-           args.info_dir, target, formula))
-    util.run(cmd)
+    equations.append('{%s} = %s' % (target, formula))
+  compute_custom_feature.computeCustomFeatures(
+      args.feature_base_dir, equations, args.ticker_file, args.info_dir)
 
 if __name__ == '__main__':
   main()
@@ -11,7 +11,7 @@
 
 import argparse
 import logging
-import os
+import numpy
 import util
 
 # ym => [ymd, gain]
@@ -25,21 +25,19 @@ def getGainDict(gain_file):
   return gain_dict
 
 def computeEgain(gain_dir, market_file, egain_dir):
-  tickers = sorted(os.listdir(gain_dir))
+  dates, tickers, gains = util.readPanel(gain_dir, 'float64')
   market_dict = getGainDict(market_file)
-
-  missing = 0
-  for ticker in tickers:
-    gain_file = '%s/%s' % (gain_dir, ticker)
-    ticker_dict = getGainDict(gain_file)
-    with open('%s/%s' % (egain_dir, ticker), 'w') as fp:
-      for ym in sorted(ticker_dict.keys()):
-        if ym in market_dict:
-          date, ticker_gain = ticker_dict[ym]
-          tmp, market_gain = market_dict[ym]
-          print >> fp, '%s\t%f' % (date, ticker_gain - market_gain)
-        else:
-          missing += 1
+  # Market gain of the month of each date, NaN if missing.
+  market_gains = numpy.array(
+      [market_dict.get(util.ymdToYm(date), [None, numpy.nan])[1]
+       for date in dates], dtype=float)
+  egains = gains - market_gains[:, None]
+  present = ~numpy.isnan(gains)
+  missing = int((present & numpy.isnan(market_gains)[:, None]).sum())
+  for j in range(len(tickers)):
+    with open('%s/%s' % (egain_dir, tickers[j]), 'w') as fp:
+      for i in numpy.nonzero(~numpy.isnan(egains[:, j]))[0]:
+        print >> fp, '%s\t%f' % (dates[i], egains[i, j])
   logging.info('%d missing dates from market' % missing)
 
 def main():
@@ -22,9 +22,15 @@
 
     --group_map_file, if specified, is assumed to contain mapping between
     ticker and group names, eg: <ticker>\t<sector>.
+
+    Values are read as a panel (see util.readPanel()) and looked up as of
+    each month into a dense month x ticker matrix, and percentiles are
+    computed on each month (row) at once with numpy.  Ties are ranked in
+    ticker order.
 """
 
 import argparse
+import numpy
 import os
 import util
 
@@ -42,86 +48,65 @@ def readGroups(group_map_file):
       groups[group].append(ticker)
   return groups
 
-def computePercFeature(input_dir, tickers, rank, output_dir):
-  # ticker => [[date, value] ...]
-  # where date is the first yyyy-mm after data is published.
-  # Dates are deduped (any yyyy-mm with more than one values available,
-  # the latest one wins).
-  data = dict()
-  for ticker in tickers:
-    dvalues = util.readKeyValueList('%s/%s' % (input_dir, ticker))
-    udvalues = []
-    for i in range(len(dvalues)):
-      date = util.getNextYm(util.ymdToYm(dvalues[i][0]))
-      if len(udvalues) > 0 and udvalues[-1][0] == date:
-        udvalues[-1][1] = dvalues[i][1]
-      else:
-        if len(udvalues) > 0:
-          assert udvalues[-1][0] < date
-        udvalues.append([date, dvalues[i][1]])
-    data[ticker] = udvalues
-
-  min_date = '9999-99'
-  max_date = '0000-00'
-  for dvalues in data.itervalues():
-    if len(dvalues) == 0:
-      continue
-    min_date = min(min_date, dvalues[0][0])
-    max_date = max(max_date, dvalues[-1][0])
-
-  percs = dict()  # date => [[ticker, value] ...]
-  date = min_date
-  while date <= max_date:
-    percs[date] = []
-    date = util.getNextYm(date)
-  for ticker, dvalues in data.iteritems():
-    for i in range(len(dvalues)):
-      date, value = dvalues[i]
-      if i < len(dvalues) - 1:
-        # Populate value up to next date (not inclusive).
-        next = dvalues[i+1][0]
-      else:
-        # Populate value up to max date (inclusive).
-        next = util.getNextYm(max_date)
-      while date < next:
-        percs[date].append([ticker, value])
-        date = util.getNextYm(date)
-
-  # Calculate percentiles.
-  for date, tvalues in percs.iteritems():
-    assert len(tvalues) > 0
-    # Use 0.5 if there is a single element.
-    if len(tvalues) == 1:
-      tvalues[0][1] = 0.5
+def ymToIndex(ym):
+  y, m = ym.split('-')
+  return int(y) * 12 + int(m) - 1
+
+def indexToYm(index):
+  return '%04d-%02d' % (index / 12, index % 12 + 1)
+
+def computePercFeature(input_dir, groups, rank, output_dir):
+  """ Computes percentiles within each group (list of tickers) of groups.
+  """
+  dates, tickers, values = util.readPanel(input_dir, 'float64')
+  if len(dates) == 0:
+    return
+  # Values are available from the month after publication, and the value
+  # of a ticker on a month is its latest one available then.
+  date_months = numpy.array([ymToIndex(util.getNextYm(util.ymdToYm(date)))
+                             for date in dates])
+  present = ~numpy.isnan(values)
+  has_data = present.any(axis=0)
+  first_months = date_months[numpy.argmax(present, axis=0)]
+  last_months = date_months[values.shape[0] - 1
+                            - numpy.argmax(present[::-1], axis=0)]
+  min_month = first_months[has_data].min()
+  max_month = last_months[has_data].max()
+  months = numpy.arange(min_month, max_month + 1)
+  matrix = util.asOfRows(date_months, values, months)
+
+  columns = dict([[tickers[j], j] for j in range(len(tickers))
+                  if has_data[j]])
+  percs = numpy.empty(matrix.shape)
+  percs.fill(numpy.nan)
+  outputs = []  # columns of tickers in groups
+  for group in groups:
+    indices = numpy.array([columns[ticker] for ticker in group
+                           if ticker in columns], dtype=int)
+    if len(indices) == 0:
       continue
-    if rank:
-      tvalues.sort(key=lambda item: item[1])
-      for i in range(len(tvalues)):
-        tvalues[i][1] = float(i)/len(tvalues)
-    else:
-      values = [item[1] for item in tvalues]
-      maxv = max(values)
-      minv = min(values)
-      span = maxv - minv
-      for i in range(len(tvalues)):
-        if span < EPS:
-          tvalues[i][1] = 0.5
-        else:
-          tvalues[i][1] = (tvalues[i][1] - minv) / span
-
-  # Write output.
-  data = dict()  # ticker => [[date, perc] ...]
-  for date, tpercs in percs.iteritems():
-    for ticker, perc in tpercs:
-      if ticker not in data:
-        data[ticker] = [[date, perc]]
-      else:
-        data[ticker].append([date, perc])
-  for ticker, dpercs in data.iteritems():
-    dpercs.sort(key=lambda item: item[0])
-    with open('%s/%s' % (output_dir, ticker), 'w') as fp:
-      for date, perc in dpercs:
-        print >> fp, '%s\t%f' % (date, perc)
+    outputs.extend(indices)
+    # Values are populated up to the max date of the group (inclusive).
+    first = first_months[indices].min() - min_month
+    last = last_months[indices].max() - min_month + 1
+    percs[first:last, indices] = util.crossSectionalPercs(
+        matrix[first:last, indices], rank, EPS)
+
+  months = [indexToYm(month) for month in months]
+  for j in sorted(outputs):
+    with open('%s/%s' % (output_dir, tickers[j]), 'w') as fp:
+      for i in numpy.nonzero(~numpy.isnan(percs[:, j]))[0]:
+        print >> fp, '%s\t%f' % (months[i], percs[i, j])
+
+# Computes percentiles within groups of group_map_file, or all tickers of
+# input_dir if group_map_file is not set.
+def computeHoriPercFeature(input_dir, group_map_file, rank, output_dir):
+  if group_map_file:
+    groups = [sorted(tickers)
+              for tickers in readGroups(group_map_file).itervalues()]
+  else:
+    groups = [sorted(os.listdir(input_dir))]
+  computePercFeature(input_dir, groups, rank, output_dir)
 
 def main():
   parser = argparse.ArgumentParser()
@@ -130,16 +115,8 @@ def main():
   parser.add_argument('--rank', action='store_true')
   parser.add_argument('--output_dir', required=True)
   args = parser.parse_args()
-
-  if args.group_map_file:
-    groups = readGroups(args.group_map_file)
-    for tickers in groups.itervalues():
-      computePercFeature(args.input_dir, tickers, args.rank, args.output_dir)
-    return
-
-  tickers = os.listdir(args.input_dir)
-  computePercFeature(args.input_dir, tickers, args.rank, args.output_dir)
+  computeHoriPercFeature(args.input_dir, args.group_map_file, args.rank,
+                         args.output_dir)
 
 if __name__ == '__main__':
   main()
-
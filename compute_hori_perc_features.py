@@ -1,6 +1,7 @@
 #!/usr/bin/python2.7
 
 import argparse
+import compute_hori_perc_feature
 import os
 import util
 
@@ -134,10 +135,18 @@ SF1_ITEMS = [
 #    'WORKINGCAPITAL-ARQ',
 ]
 
+# Returns [[input feature, output feature] ...] of SF1_ITEMS, for MRx (see
+# util.getMrx()) if use_mrx.
+def getFeatures(suffix, use_mrx):
+  features = []
+  for feature in SF1_ITEMS:
+    if use_mrx:
+      feature = util.getMrx(feature)
+    features.append([feature, '%s%s' % (feature, suffix)])
+  return features
+
 def main():
   parser = argparse.ArgumentParser()
-  parser.add_argument('--computer',
-      default='/Users/lnyang/lab/qd2/qd2/compute_hori_perc_feature.py')
   parser.add_argument('--feature_base_dir', required=True)
   parser.add_argument('--suffix', required=True)
   parser.add_argument('--group_map_file')
@@ -145,24 +154,15 @@ def main():
   parser.add_argument('--use_mrx', action='store_true')
   args = parser.parse_args()
 
-  group_map_arg = ''
-  if args.group_map_file:
-    group_map_arg = '--group_map_file=%s' % args.group_map_file
-  rank_arg = ''
-  if args.rank:
-    rank_arg = '--rank'
-
-  for feature in SF1_ITEMS:
-    if args.use_mrx:
-      feature = util.getMrx(feature)
+  # All features are computed in this process, see
+  # compute_hori_perc_feature.py.
+  for feature, output in getFeatures(args.suffix, args.use_mrx):
     input_dir = '%s/%s' % (args.feature_base_dir, feature)
-    output_dir = '%s/%s%s' % (args.feature_base_dir, feature, args.suffix)
+    output_dir = '%s/%s' % (args.feature_base_dir, output)
     if not os.path.isdir(output_dir):
       os.mkdir(output_dir)
-    cmd = '%s --input_dir=%s --output_dir=%s %s %s' % (
-        args.computer, input_dir, output_dir,
-        group_map_arg, rank_arg)
-    util.run(cmd)
+    compute_hori_perc_feature.computeHoriPercFeature(
+        input_dir, args.group_map_file, args.rank, output_dir)
 
 if __name__ == '__main__':
   main()
@@ -18,6 +18,7 @@
 
 import argparse
 import logging
+import numpy
 import os
 import util
 
@@ -26,6 +27,35 @@ EPS = 0.01
 MIN_GAIN = -1.0
 MAX_GAIN = 10.0
 
+# Returns gain of each date computed from adjopens, or NaN if the gain is
+# unknown yet, and updates stats.
+def getOpenGains(adjopens, k, stats):
+  adjopens = numpy.asarray(adjopens, dtype=float)
+  size = adjopens.shape[0]
+  gains = numpy.empty(size)
+  gains.fill(numpy.nan)
+  count = max(0, size - k - 1)  # dates with sell date q = i + 1 + k
+  buys = adjopens[1:count+1]
+  sells = adjopens[k+1:k+1+count]
+  gains[:count] = (sells - buys) / (buys + EPS)
+  stats['total'] += size
+  stats['nolabel'] += size - count
+  stats['mincap'] += int((gains[:count] < MIN_GAIN).sum())
+  stats['maxcap'] += int((gains[:count] > MAX_GAIN).sum())
+  gains[:count] = numpy.clip(gains[:count], MIN_GAIN, MAX_GAIN)
+  return gains
+
+# Writes gains to gain_file, with unknown gains as 0 if fill is True.
+def writeGains(gain_file, dates, gains, fill):
+  with open(gain_file, 'w') as fp:
+    for i in range(len(dates)):
+      gain = gains[i]
+      if numpy.isnan(gain):
+        if not fill:
+          continue
+        gain = 0.0
+      print >> fp, '%s\t%f' % (dates[i], gain)
+
 def computeOpenGain(args):
   tickers = sorted(os.listdir(args.yahoo_dir))
   stats = {
@@ -38,31 +68,10 @@ def computeOpenGain(args):
   for ticker in tickers:
     dates, opens, closes, adjcloses = util.readYahoo(
         '%s/%s' % (args.yahoo_dir, ticker), 'date,open,close,adjclose')
-    with open('%s/%s' % (args.gain_dir, ticker), 'w') as fp:
-      for i in range(len(dates)):
-        stats['total'] += 1
-        p = i + 1  # buy
-        q = p + args.k  # sell
-        gain = None
-        if q >= len(dates):
-          stats['nolabel'] += 1
-          if not args.fill:
-            continue
-          else:
-            gain = 0.0
-        if gain is not None:  # fill
-          print >> fp, '%s\t%f' % (dates[i], gain)
-          continue
-        adjopen1 = opens[p] * adjcloses[p] / closes[p]
-        adjopen2 = opens[q] * adjcloses[q] / closes[q]
-        gain = (adjopen2 - adjopen1) / (adjopen1 + EPS)
-        if gain < MIN_GAIN:
-          stats['mincap'] += 1
-          gain = MIN_GAIN
-        if gain > MAX_GAIN:
-          stats['maxcap'] += 1
-          gain = MAX_GAIN
-        print >> fp, '%s\t%f' % (dates[i], gain)
+    adjopens = [opens[i] * adjcloses[i] / closes[i]
+                for i in range(len(dates))]
+    gains = getOpenGains(adjopens, args.k, stats)
+    writeGains('%s/%s' % (args.gain_dir, ticker), dates, gains, args.fill)
   logging.info('output: stats: %s' % stats)
 
 def main():
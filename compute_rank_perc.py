@@ -6,48 +6,42 @@
       ./compute_rank_perc.py
           --input_dir=./volatility
           --output_dir=./volatility_perc
+          --average_ties
+
+    Percentile is 0-based rank divided by the number of tickers on the date.
+    Ties are ranked in ticker order, or get the average of their ranks if
+    --average_ties is set.
+
+    --input_dir and --output_dir can be repeated to process several inputs
+    (paired in order) in one process.  Each input is read as a panel (see
+    util.readPanel()) and ranked on all dates at once.
 """
 
 import argparse
-import os
+import numpy
 import util
 
-def computePerc(input_dir, output_dir):
-  tickers = sorted(os.listdir(input_dir))
-  dvalues = dict()  # date => [[ticker, value] ...]
-  for ticker in tickers:
-    data = util.readKeyValueList('%s/%s' % (input_dir, ticker))
-    for date, value in data:
-      if date not in dvalues:
-        dvalues[date] = [[ticker, value]]
-      else:
-        dvalues[date].append([ticker, value])
-  # Convert raw value to perc.
-  for tvalues in dvalues.itervalues():
-    tvalues.sort(key=lambda item: item[1])
-    for i in range(len(tvalues)):
-      tvalues[i][1] = float(i)/len(tvalues)
-  tvalues = dict()  # ticker => [[date, perc] ...]
-  for date, tpercs in dvalues.iteritems():
-    for ticker, perc in tpercs:
-      if ticker not in tvalues:
-        tvalues[ticker] = [[date, perc]]
-      else:
-        tvalues[ticker].append([date, perc])
-  # Write output.
-  for ticker, values in tvalues.iteritems():
-    values.sort(key=lambda value: value[0])
-    with open('%s/%s' % (output_dir, ticker), 'w') as fp:
-      for date, perc in values:
-        print >> fp, '%s\t%f' % (date, perc)
+def computePerc(input_dir, output_dir, average_ties=False):
+  dates, tickers, values = util.readPanel(input_dir, 'float64')
+  present = ~numpy.isnan(values)
+  ranks = util.crossSectionalRanks(values, average_ties)
+  with numpy.errstate(invalid='ignore'):
+    percs = ranks / present.sum(axis=1)[:, None]
+  for j in numpy.nonzero(present.any(axis=0))[0]:
+    with open('%s/%s' % (output_dir, tickers[j]), 'w') as fp:
+      for i in numpy.nonzero(present[:, j])[0]:
+        print >> fp, '%s\t%f' % (dates[i], percs[i, j])
 
 def main():
   parser = argparse.ArgumentParser()
-  parser.add_argument('--input_dir', required=True)
-  parser.add_argument('--output_dir', required=True)
+  parser.add_argument('--input_dir', action='append', required=True)
+  parser.add_argument('--output_dir', action='append', required=True)
+  parser.add_argument('--average_ties', action='store_true')
   args = parser.parse_args()
-  computePerc(args.input_dir, args.output_dir)
+  assert len(args.input_dir) == len(args.output_dir), (
+      '--input_dir and --output_dir must be paired')
+  for i in range(len(args.input_dir)):
+    computePerc(args.input_dir[i], args.output_dir[i], args.average_ties)
 
 if __name__ == '__main__':
   main()
-
@@ -6,29 +6,38 @@
           --window=5
           --method=mean
           --output_dir=./volumed_mean_5
+
+    Methods are computed over the trailing window of each date (see rolling
+    stats in util.py); dates before the first full window are skipped.
+    ewm is the exponentially weighted mean with span of --window.
 """
 
 import argparse
 import os
 import util
 
-SUPPORTED_METHODS = ['mean']
+METHODS = {
+    'mean': util.rollingMean,
+    'std': util.rollingStd,
+    'median': util.rollingMedian,
+    'zscore': util.rollingZscore,
+    'ewm': util.rollingEwm,
+}
+SUPPORTED_METHODS = sorted(METHODS.keys())
 
 def computeRollingWindowFeature(args):
   assert args.window > 0
+  method = METHODS[args.method]
   tickers = sorted(os.listdir(args.input_dir))
   for ticker in tickers:
-    dvalues = util.readKeyValueList('%s/%s' % (args.input_dir, ticker))
-    dates = [dvalue[0] for dvalue in dvalues]
-    values = [dvalue[1] for dvalue in dvalues]
+    dates, values = util.readKeyListValueList(
+        '%s/%s' % (args.input_dir, ticker))
     for i in range(len(dates)-1):
       assert dates[i] < dates[i+1]
+    features = method(values, args.window)
     with open('%s/%s' % (args.output_dir, ticker), 'w') as fp:
       for i in range(args.window-1, len(dates)):
-        wvalues = values[i-args.window+1:i+1]
-        if args.method == 'mean':
-          f = sum(wvalues)/args.window
-        print >> fp, '%s\t%f' % (dates[i], f)
+        print >> fp, '%s\t%f' % (dates[i], features[i])
 
 def main():
   parser = argparse.ArgumentParser()
@@ -40,4 +49,3 @@ def main():
 
 if __name__ == '__main__':
   main()
-
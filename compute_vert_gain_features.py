@@ -132,6 +132,18 @@ SF1_ITEMS = [
 ]
 SF1_WINDOWS = '4,8,16'
 
+# Returns names of output features of feature over windows.
+def getTargets(feature, windows):
+  return ['%s_vg-%d' % (feature, int(window))
+          for window in windows.split(',')]
+
+# Returns names of all output features.
+def getAllTargets():
+  targets = []
+  for feature in SF1_ITEMS:
+    targets += getTargets(feature, SF1_WINDOWS)
+  return targets
+
 def shouldRun(output_dir, info_dir, feature, windows):
   """ Returns whether feature computation should run on the specified dir.
       It should run if: no info file is present, indicating either there
@@ -139,10 +151,8 @@ def shouldRun(output_dir, info_dir, feature, windows):
 
       Output feature dir is prepared upon output.
   """
-  windows = [int(w) for w in windows.split(',')]
   missing_info = False
-  for window in windows:
-    target_file = '%s_vg-%d' % (feature, window)
+  for target_file in getTargets(feature, windows):
     if not os.path.isfile('%s/%s' % (info_dir, target_file)):
       missing_info = True
       target_dir = '%s/%s' % (output_dir, target_file)
@@ -135,6 +135,20 @@ SF1_WINDOWS = '0,1,2,3,4,8,16'
 PRICE_ITEMS = ['adjprice']
 PRICE_WINDOWS = '0,1,2,3,6,9,12,15,18,21,24,27,30,33,36,39,42,45,48'
 
+# Returns names of output features of feature over windows.
+def getTargets(feature, windows):
+  return ['%s_vp-%d' % (feature, int(window))
+          for window in windows.split(',')]
+
+# Returns names of all output features.
+def getAllTargets():
+  targets = []
+  for feature in SF1_ITEMS:
+    targets += getTargets(feature, SF1_WINDOWS)
+  for feature in PRICE_ITEMS:
+    targets += getTargets(feature, PRICE_WINDOWS)
+  return targets
+
 def shouldRun(output_dir, info_dir, feature, windows):
   """ Returns whether feature computation should run on the specified dir.
       It should run if: no info file is present, indicating either there
@@ -142,10 +156,8 @@ def shouldRun(output_dir, info_dir, feature, windows):
 
       Output feature dir is prepared upon output.
   """
-  windows = [int(w) for w in windows.split(',')]
   missing_info = False
-  for window in windows:
-    target_file = '%s_vp-%d' % (feature, window)
+  for target_file in getTargets(feature, windows):
     if not os.path.isfile('%s/%s' % (info_dir, target_file)):
       missing_info = True
       target_dir = '%s/%s' % (output_dir, target_file)
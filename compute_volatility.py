@@ -9,41 +9,44 @@
 """
 
 import argparse
-import math
+import numpy
 import os
 import util
 
 EPS = 0.01  # to prevent divide-by-zero in calculating gains
 
-def computeStd(values):
-  if len(values) == 0:
-    return 0.0
-  mean = sum(values) / len(values)
-  std = 0.0
-  for value in values:
-    std += (value - mean)**2
-  return math.sqrt(std / len(values))
+# Returns volatility of each date, which is the std of the last k gains up
+# to the date (fewer at the beginning, 0 for the first date).
+def getVolatilities(prices, k):
+  prices = numpy.asarray(prices, dtype=float)
+  if prices.shape[0] == 0:
+    return numpy.zeros(0)
+  gains = (prices[1:] - prices[:-1]) / (prices[:-1] + EPS)
+  return numpy.concatenate([[0.0], util.rollingStd(gains, k)])
 
-def computeVolatility(price_dir, k, volatility_dir):
+def computeVolatility(price_dir, k, volatility_dir, changed_ticker_file=None):
   assert k > 0
-  tickers = sorted(os.listdir(price_dir))
+  tickers = util.filterTickers(sorted(os.listdir(price_dir)),
+                               changed_ticker_file)
   for ticker in tickers:
     price_file = '%s/%s' % (price_dir, ticker)
-    dprices = util.readKeyValueList(price_file)
+    dates, prices = util.readKeyListValueList(price_file)
+    volatilities = getVolatilities(prices, k)
     with open('%s/%s' % (volatility_dir, ticker), 'w') as fp:
-      for i in range(len(dprices)):
-        prices = [dprices[j][1] for j in range(max(0,i-k), i+1)]
-        gains = [(prices[j+1] - prices[j]) / (prices[j] + EPS) for j in range(len(prices) - 1)]
-        volatility = computeStd(gains)
-        print >> fp, '%s\t%f' % (dprices[i][0], volatility)
+      for i in range(len(dates)):
+        print >> fp, '%s\t%f' % (dates[i], volatilities[i])
 
 def main():
   parser = argparse.ArgumentParser()
   parser.add_argument('--price_dir', required=True)
   parser.add_argument('--k', type=int, required=True)
   parser.add_argument('--volatility_dir', required=True)
+  parser.add_argument('--changed_ticker_file',
+                      help='if specified, only process tickers listed in '
+                           'this file (see run.py)')
   args = parser.parse_args()
-  computeVolatility(args.price_dir, args.k, args.volatility_dir)
+  computeVolatility(args.price_dir, args.k, args.volatility_dir,
+                    args.changed_ticker_file)
 
 if __name__ == '__main__':
   main()
@@ -16,59 +16,85 @@
     --do_raw: output raw sampled values
     --do_fd: output first derivatives of sampled values
     --prefix: output prefix (window_month-0, window_month-4, etc)
+    --store_dir: if set, output features as feature stores under this dir
+                 (see util.FeatureStoreWriter) instead of dirs under
+                 --feature_dir
+
+    Samples of all dates of a ticker are taken at once from a sliding
+    window view of its values (see util.slidingWindows()), and normalized
+    with numpy.
 """
 
 import argparse
+import numpy
 import os
 import util
 
-def computeWindowFeature(args):
-  assert args.do_raw or args.do_fd
-  tickers = sorted(os.listdir(args.value_dir))
-  windows = [int(window) for window in args.windows.split(',')]
+def computeWindows(values, windows, bonus, do_raw, do_fd):
+  """ Returns [raws, fds] for dates from max(windows) on, each being a 2D
+      array with one row per date and one column per window (or None if
+      not requested).
+  """
+  max_window = max(windows)
+  view = util.slidingWindows(numpy.asarray(values, dtype=float),
+                             max_window + 1)
+  # The last column of view is the current date.
+  samples = view[:, max_window - numpy.array(windows)]
+  raws, fds = None, None
+  if do_raw:
+    raws = util.normalizeRows(samples)
+  if do_fd:
+    fds = util.normalizeRows(
+        (samples[:, :-1] - samples[:, 1:]) / (samples[:, 1:] + bonus))
+  return raws, fds
+
+# Writes each column of values as feature names[j] of ticker.
+def writeTsv(feature_dir, names, ticker, dates, values):
+  for j in range(len(names)):
+    output_dir = '%s/%s' % (feature_dir, names[j])
+    if not os.path.isdir(output_dir):
+      os.mkdir(output_dir)
+    with open('%s/%s' % (output_dir, ticker), 'w') as fp:
+      fp.write(''.join(['%s\t%f\n' % (dates[i], values[i, j])
+                        for i in range(len(dates))]))
+
+def computeWindowFeature(value_dir, windows, bonus, do_raw, do_fd, prefix,
+                         feature_dir=None, store_dir=None):
+  assert do_raw or do_fd
+  assert bool(feature_dir) != bool(store_dir), (
+      'exactly one of feature_dir and store_dir must be set')
+  tickers = sorted(os.listdir(value_dir))
   assert min(windows) >= 0, 'cannot look at future values'
   assert len(windows) > 0
-  assert len(windows) > 1 or not args.do_fd
+  assert len(windows) > 1 or not do_fd
   max_window = max(windows)
 
+  raw_names = ['%s%d' % (prefix, window) for window in windows]
+  fd_names = ['%sfd-%d' % (prefix, window) for window in windows[:-1]]
+  writers = None
+  if store_dir:
+    util.maybeMakeDir(store_dir)
+    writers = dict()  # name => feature store writer
+    names = (raw_names if do_raw else []) + (fd_names if do_fd else [])
+    for name in names:
+      writers[name] = util.FeatureStoreWriter(
+          util.getFeatureStorePath(store_dir, name))
+
   for ticker in tickers:
-    raw_fps = None
-    fd_fps = None
-    if args.do_raw:
-      raw_fps = []
-      for window in windows:
-        raw_dir = '%s/%s%d' % (args.feature_dir, args.prefix, window)
-        if not os.path.isdir(raw_dir):
-          os.mkdir(raw_dir)
-        raw_fps.append(open('%s/%s' % (raw_dir, ticker), 'w'))
-    if args.do_fd:
-      fd_fps = []
-      for i in range(len(windows)-1):
-        fd_dir = '%s/%sfd-%d' % (args.feature_dir, args.prefix, windows[i])
-        if not os.path.isdir(fd_dir):
-          os.mkdir(fd_dir)
-        fd_fps.append(open('%s/%s' % (fd_dir, ticker), 'w'))
-        
-    dvalues = util.readKeyValueList('%s/%s' % (args.value_dir, ticker))
-    for i in range(max_window, len(dvalues)):
-      values = [dvalues[i-window][1] for window in windows]
-      if raw_fps:
-        raws = util.normalize(values)
-        assert len(raws) == len(raw_fps)
-        for j in range(len(raws)):
-          print >> raw_fps[j], '%s\t%f' % (dvalues[i][0], raws[j])
-      if fd_fps:
-        derivatives = [(values[j] - values[j+1]) / (values[j+1] + args.bonus) for j in range(len(windows)-1)]
-        derivatives = util.normalize(derivatives)
-        assert len(derivatives) == len(fd_fps)
-        for j in range(len(derivatives)):
-          print >> fd_fps[j], '%s\t%f' % (dvalues[i][0], derivatives[j])
-    if raw_fps:
-      for fp in raw_fps:
-        fp.close()
-    if fd_fps:
-      for fp in fd_fps:
-        fp.close()
+    dates, values = util.readKeyListValueList('%s/%s' % (value_dir, ticker))
+    dates = dates[max_window:]
+    raws, fds = computeWindows(values, windows, bonus, do_raw, do_fd)
+    for names, features in [[raw_names, raws], [fd_names, fds]]:
+      if features is None:
+        continue
+      if writers is None:
+        writeTsv(feature_dir, names, ticker, dates, features)
+        continue
+      for j in range(len(names)):
+        writers[names[j]].write(ticker, dates, features[:, j])
+  if writers is not None:
+    for writer in writers.itervalues():
+      writer.close()
 
 def main():
   parser = argparse.ArgumentParser()
@@ -77,10 +103,14 @@ def main():
   parser.add_argument('--bonus', type=float, required=True)
   parser.add_argument('--do_raw', action='store_true')
   parser.add_argument('--do_fd', action='store_true')
-  parser.add_argument('--feature_dir', required=True)
+  parser.add_argument('--feature_dir')
+  parser.add_argument('--store_dir')
   parser.add_argument('--prefix', required=True)
-  computeWindowFeature(parser.parse_args())
+  args = parser.parse_args()
+  windows = [int(window) for window in args.windows.split(',')]
+  computeWindowFeature(args.value_dir, windows, args.bonus, args.do_raw,
+                       args.do_fd, args.prefix, args.feature_dir,
+                       args.store_dir)
 
 if __name__ == '__main__':
   main()
-
@@ -1,7 +1,7 @@
 #!/usr/bin/python2.7
 
 import argparse
-import os
+import compute_window_feature
 import util
 
 ITEMS = [
@@ -13,30 +13,32 @@ ITEMS = [
     ['volume', range(66), 1.0, True, True, 'window_v_1x66-'],
 ]
 
+# Returns names of features computed for ITEMS, see
+# compute_window_feature.computeWindowFeature().
+def getFeatures():
+  features = []
+  for label, windows, bonus, do_raw, do_fd, prefix in ITEMS:
+    if do_raw:
+      features += ['%s%d' % (prefix, window) for window in windows]
+    if do_fd:
+      features += ['%sfd-%d' % (prefix, window) for window in windows[:-1]]
+  return features
+
 def main():
   parser = argparse.ArgumentParser()
-  parser.add_argument('--computer',
-      default='/Users/lnyang/lab/qd2/qd2/compute_window_feature.py')
   parser.add_argument('--adjusted_dir', required=True,
                       help='dir of adusted yahoo data')
-  parser.add_argument('--feature_base_dir', required=True)
+  parser.add_argument('--feature_base_dir')
+  parser.add_argument('--store_dir',
+                      help='if set, output feature stores to this dir '
+                           'instead of --feature_base_dir')
   args = parser.parse_args()
 
+  # All items are computed in this process, see compute_window_feature.py.
   for label, windows, bonus, do_raw, do_fd, prefix in ITEMS:
-    value_dir = '%s/%s' % (args.adjusted_dir, label)
-    windows = ','.join(['%d' % window for window in windows])
-    do_raw_arg = ''
-    if do_raw:
-      do_raw_arg = '--do_raw'
-    do_fd_arg = ''
-    if do_fd:
-      do_fd_arg = '--do_fd'
-    cmd = ('%s --value_dir=%s --windows=%s --bonus=%f'
-           ' %s %s --feature_dir=%s --prefix=%s' % (
-        args.computer, value_dir, windows, bonus, do_raw_arg, do_fd_arg,
-        args.feature_base_dir, prefix))
-    util.run(cmd)
+    compute_window_feature.computeWindowFeature(
+        '%s/%s' % (args.adjusted_dir, label), windows, bonus, do_raw, do_fd,
+        prefix, args.feature_base_dir, args.store_dir)
 
 if __name__ == '__main__':
   main()
-
@@ -22,6 +22,12 @@ MARKETS = ['R3000', 'SP500']
 TEST = False
 DRY_RUN = False
 
+# Update yahoo price data in place by appending new dates (see
+# download_yahoo.py).  For a daily update, remove DONE-download_yahoo; steps
+# reading its outputs then rerun in turn (see clearReaders() in run.py),
+# where projected and adjusted data are only appended for changed tickers.
+YAHOO_APPEND = True
+
 # For features, we look at many time windows, and we do not
 # enforce any minimum raw price.
 # Price/volume features have been disabled.
@@ -104,7 +110,6 @@ YAHOO_SF1_DIR = '%s/sf1' % RAW_YAHOO_DIR
 YAHOO_MARKET_DIR = '%s/market' % RAW_YAHOO_DIR
 
 SF1_DIR = '%s/sf1' % RUN_DIR
-SF1_RAW_DIR = '%s/raw' % SF1_DIR
 SF1_PROCESSED_DIR = '%s/processed' % SF1_DIR
 
 EOD_DIR = '%s/eod' % RUN_DIR
@@ -144,6 +149,7 @@ MARKET_PROJECTED_DIR = '%s/projected' % MARKET_DIR
 
 FEATURE_DIR = '%s/features' % RUN_DIR
 FEATURE_INFO_DIR = '%s/feature_info' % RUN_DIR
+FEATURE_STORE_DIR = '%s/feature_store' % RUN_DIR
 FEATURE_LIST_DIR = '%s/feature_lists' % RUN_DIR
 
 EOD_VOLATILITY_PREFIX = '%s/eod_volatility_' % FEATURE_DIR
@@ -0,0 +1,71 @@
+#!/usr/bin/python2.7
+
+""" Converts per-ticker feature dirs into feature stores.
+
+    Example usage:
+      ./convert_feature_store.py --feature_base_dir=./features
+                                 --feature_list=./feature_list
+                                 --store_dir=./feature_store
+
+    For each feature (all dirs under --feature_base_dir, or those listed in
+    --feature_list), all <ticker> files of <date>\t<value> lines are packed
+    into a single <feature>.fs file under --store_dir.  See
+    util.FeatureStoreWriter for the file format.
+
+    Existing stores are skipped if they are up to date with their feature
+    dirs (see util.isFeatureStoreCurrent()), and converted again otherwise
+    or with --overwrite.
+"""
+
+import argparse
+import logging
+import os
+import util
+
+def convertFeature(feature_dir, store_file, dtype):
+  # Source is taken before reading, so that changes during conversion make
+  # the store out of date.
+  source = util.getFeatureSource(feature_dir)
+  tickers = sorted(os.listdir(feature_dir))
+  writer = util.FeatureStoreWriter(store_file, dtype, source)
+  for ticker in tickers:
+    keys, values = util.readKeyListValueList('%s/%s' % (feature_dir, ticker))
+    writer.write(ticker, keys, values)
+  writer.close()
+  return len(tickers)
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--feature_base_dir', required=True)
+  parser.add_argument('--feature_list',
+                      help='if specified, only features in this file will '
+                           'be converted')
+  parser.add_argument('--store_dir', required=True)
+  parser.add_argument('--dtype', default=util.FEATURE_STORE_DTYPE,
+                      help='dtype of stored values, eg float64 or float32')
+  parser.add_argument('--overwrite', action='store_true')
+  args = parser.parse_args()
+  util.configLogging()
+
+  if args.feature_list:
+    with open(args.feature_list, 'r') as fp:
+      features = [line for line in fp.read().splitlines()
+                  if line != '' and not line.startswith('#')]
+  else:
+    features = sorted([feature for feature in os.listdir(args.feature_base_dir)
+                       if os.path.isdir('%s/%s' % (args.feature_base_dir,
+                                                   feature))])
+  util.maybeMakeDir(args.store_dir)
+  for feature in features:
+    store_file = util.getFeatureStorePath(args.store_dir, feature)
+    feature_dir = '%s/%s' % (args.feature_base_dir, feature)
+    if (os.path.isfile(store_file) and not args.overwrite
+        and util.isFeatureStoreCurrent(util.FeatureStore(store_file),
+                                       feature_dir)):
+      logging.info('skipping existing feature store: %s' % store_file)
+      continue
+    count = convertFeature(feature_dir, store_file, args.dtype)
+    logging.info('converted %s: %d tickers' % (feature, count))
+
+if __name__ == '__main__':
+  main()
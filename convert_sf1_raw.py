@@ -1,22 +1,39 @@
 #!/usr/bin/python2.7
 
 # Adapted from qd.
-""" Converts unzipped file of entire SF1 database into a set of raw files.
+""" Converts unzipped file of entire SF1 database into a set of raw files,
+    or directly into processed files (see process_sf1_raw.py).
 
     Usage:
       ./convert_sf1_raw.py --sf1_file=SF1_20150502.csv
                            --indicator_file=./indicators.txt
                            --raw_dir=./raw
+      ./convert_sf1_raw.py --sf1_file=SF1_20150502.csv
+                           --indicator_file=./indicators.txt
+                           --processed_dir=./processed
 
     It does one pass through sf1_file and separates lines of different
     tickers into different output raw files.  The raw files of each ticker
     should be small enough to be loaded into memory for further processing.
+
+    With --processed_dir, lines are buffered per ticker instead, and each
+    ticker is processed once the pass is done.  To bound memory, when more
+    than --max_buffered_lines are buffered, lines of the least recently seen
+    tickers are spilled to per-ticker files (through an LRU cache of at most
+    --max_open_files open files), which are read back for processing.  If
+    sf1_file is grouped by ticker, only completed tickers are spilled.
+    Tickers already in --processed_dir (eg, from an interrupted run) are
+    skipped unless --overwrite is set.
 """
 
 import argparse
+import collections
 import datetime
 import logging
 import os
+import process_sf1_raw
+import shutil
+import tempfile
 import util
 
 # If this is modified readIndicatorMeta() also needs to be modified!
@@ -41,6 +58,13 @@ SKIPPED_INDICATORS = {
     'NCFDIV',
 }
 
+# Max number of lines buffered in memory with --processed_dir.
+MAX_BUFFERED_LINES = 2000000
+# Max number of spill files kept open with --processed_dir.
+MAX_OPEN_FILES = 256
+# Prefix of the hidden dir of spilled lines in --processed_dir.
+SPILL_PREFIX = '.spill'
+
 def readIndicatorMeta(indicator_file):
   with open(indicator_file, 'r') as fp:
     lines = fp.read().splitlines()
@@ -90,28 +114,11 @@ def processLine(line, indicator_meta):
 
   return ticker, line
 
-def convertSf1Raw(sf1_file, indicator_file, raw_dir, max_lines=0):
-  # Since we always append to raw files (lines of a ticker may not be
-  # adjacent in sf1_file) it's only sane to run this script with an
-  # empty raw_dir.
-  assert len(os.listdir(raw_dir)) == 0, (
-      'nonempty raw dir: %s' % raw_dir)
-
-  # Read indicator metadata for sanity-checking sf1_file.
-  indicator_meta = readIndicatorMeta(indicator_file)
-
+def readSf1Lines(sf1_file, indicator_meta, stats, max_lines=0):
+  """ Yields ticker and line of output for each line of sf1_file that is not
+      skipped, and counts lines in stats.
+  """
   num_lines = 0
-  output_ticker = None
-  output_fp = None
-
-  stats = {
-    'known_skipped': 0,
-    'unknown_indicator': 0,
-    'expect_ND': 0,
-    'unknown_dimension': 0,
-    'processed': 0,
-  }
-
   with open(sf1_file, 'r') as fp:
     while True:
       line = fp.readline()
@@ -123,37 +130,180 @@ def convertSf1Raw(sf1_file, indicator_file, raw_dir, max_lines=0):
         stats[line] += 1
         continue
       stats['processed'] += 1
-      # Prepare output fp.
-      if ticker != output_ticker:
-        if output_fp is not None:
-          output_fp.close()
-        output_fp = open('%s/%s' % (raw_dir, ticker), 'a')
-        output_ticker = ticker
-      print >> output_fp, line
+      yield ticker, line
 
       num_lines += 1
       if max_lines > 0 and num_lines >= max_lines:
         break
+
+def newStats():
+  return {
+    'known_skipped': 0,
+    'unknown_indicator': 0,
+    'expect_ND': 0,
+    'unknown_dimension': 0,
+    'processed': 0,
+  }
+
+def convertSf1Raw(sf1_file, indicator_file, raw_dir, max_lines=0):
+  # Since we always append to raw files (lines of a ticker may not be
+  # adjacent in sf1_file) it's only sane to run this script with an
+  # empty raw_dir.
+  assert len(os.listdir(raw_dir)) == 0, (
+      'nonempty raw dir: %s' % raw_dir)
+
+  # Read indicator metadata for sanity-checking sf1_file.
+  indicator_meta = readIndicatorMeta(indicator_file)
+
+  output_ticker = None
+  output_fp = None
+  stats = newStats()
+
+  for ticker, line in readSf1Lines(sf1_file, indicator_meta, stats,
+                                   max_lines):
+    # Prepare output fp.
+    if ticker != output_ticker:
+      if output_fp is not None:
+        output_fp.close()
+      output_fp = open('%s/%s' % (raw_dir, ticker), 'a')
+      output_ticker = ticker
+    print >> output_fp, line
   if output_fp is not None:
     output_fp.close()
 
   logging.info('stats: %s' % stats)
 
+class SpillFiles:
+  """ Appends lines to per-ticker files under spill_dir, keeping at most
+      max_open files open (least recently used ones are closed).
+  """
+
+  def __init__(self, spill_dir, max_open=MAX_OPEN_FILES):
+    self.spill_dir = spill_dir
+    self.max_open = max_open
+    self.fps = collections.OrderedDict()  # ticker => fp, in LRU order
+    self.tickers = set()
+
+  def getPath(self, ticker):
+    return '%s/%s' % (self.spill_dir, ticker)
+
+  def write(self, ticker, lines):
+    fp = self.fps.pop(ticker, None)
+    if fp is None:
+      if len(self.fps) >= self.max_open:
+        self.fps.popitem(last=False)[1].close()
+      fp = open(self.getPath(ticker), 'a')
+      self.tickers.add(ticker)
+    self.fps[ticker] = fp
+    for line in lines:
+      print >> fp, line
+
+  def close(self):
+    for fp in self.fps.itervalues():
+      fp.close()
+    self.fps.clear()
+
+  # Returns spilled lines of ticker, and removes its file.
+  def read(self, ticker):
+    if ticker not in self.tickers:
+      return []
+    assert ticker not in self.fps
+    path = self.getPath(ticker)
+    with open(path, 'r') as fp:
+      lines = fp.read().splitlines()
+    os.remove(path)
+    return lines
+
+def convertSf1Processed(sf1_file, indicator_file, processed_dir,
+                        max_lines=0, max_buffered_lines=MAX_BUFFERED_LINES,
+                        max_open_files=MAX_OPEN_FILES, overwrite=False):
+  # Remove tmp and spill dirs left by an interrupted run, and skip tickers
+  # already processed (ticker dirs are only renamed in place once complete,
+  # see process_sf1_raw.writeTicker()) unless overwrite is set.
+  skipped = set()
+  for name in os.listdir(processed_dir):
+    path = '%s/%s' % (processed_dir, name)
+    if name.startswith(process_sf1_raw.TMP_PREFIX) or name.startswith(
+        SPILL_PREFIX):
+      shutil.rmtree(path)
+    elif not overwrite and os.path.isdir(path):
+      skipped.add(name)
+  if len(skipped) > 0:
+    logging.info('skipping %d processed tickers' % len(skipped))
+
+  indicator_meta = readIndicatorMeta(indicator_file)
+  stats = newStats()
+  # Spill dir is hidden so that it is never taken as a ticker.
+  spill_files = SpillFiles(
+      tempfile.mkdtemp(prefix=SPILL_PREFIX, dir=processed_dir),
+      max_open_files)
+  buffers = collections.OrderedDict()  # ticker => lines, in LRU order
+  num_buffered = 0
+  num_spilled = 0
+
+  try:
+    for ticker, line in readSf1Lines(sf1_file, indicator_meta, stats,
+                                     max_lines):
+      if ticker in skipped:
+        continue
+      lines = buffers.pop(ticker, None)
+      if lines is None:
+        lines = []
+      buffers[ticker] = lines
+      lines.append(line)
+      num_buffered += 1
+      while num_buffered > max_buffered_lines:
+        spill_ticker, spill_lines = buffers.popitem(last=False)
+        spill_files.write(spill_ticker, spill_lines)
+        num_buffered -= len(spill_lines)
+        num_spilled += len(spill_lines)
+    spill_files.close()
+    logging.info('spilled %d lines of %d tickers' % (
+        num_spilled, len(spill_files.tickers)))
+
+    tickers = sorted(spill_files.tickers.union(buffers.iterkeys()))
+    for ticker in tickers:
+      lines = spill_files.read(ticker) + buffers.pop(ticker, [])
+      raw_dict = dict()
+      for line in lines:
+        process_sf1_raw.addRawLine(raw_dict, line)
+      process_sf1_raw.writeTicker(raw_dict, processed_dir, ticker)
+  finally:
+    spill_files.close()
+    shutil.rmtree(spill_files.spill_dir)
+
+  logging.info('stats: %s' % stats)
+
 def main():
   parser = argparse.ArgumentParser()
   parser.add_argument('--sf1_file', required=True,
                       help='unzipped file of entire SF! database from quandl')
   parser.add_argument('--indicator_file', required=True,
                       help='file of supported indicators in SF1')
-  parser.add_argument('--raw_dir', required=True,
-                      help='output dir of raw files')
+  group = parser.add_mutually_exclusive_group(required=True)
+  group.add_argument('--raw_dir',
+                     help='output dir of raw files')
+  group.add_argument('--processed_dir',
+                     help='output dir of processed files, see module doc')
   parser.add_argument('--max_lines', type=int, default=0,
                       help='max number of lines to process from sf1_file; '
                            'only use this for debugging')
+  parser.add_argument('--max_buffered_lines', type=int,
+                      default=MAX_BUFFERED_LINES)
+  parser.add_argument('--max_open_files', type=int, default=MAX_OPEN_FILES)
+  parser.add_argument('--overwrite', action='store_true',
+                      help='with --processed_dir, overwrite existing ticker '
+                           'dirs instead of skipping them')
   args = parser.parse_args()
   util.configLogging()
-  convertSf1Raw(args.sf1_file, args.indicator_file, args.raw_dir,
-                args.max_lines)
+  if args.raw_dir:
+    convertSf1Raw(args.sf1_file, args.indicator_file, args.raw_dir,
+                  args.max_lines)
+  else:
+    convertSf1Processed(args.sf1_file, args.indicator_file,
+                        args.processed_dir, args.max_lines,
+                        args.max_buffered_lines, args.max_open_files,
+                        args.overwrite)
 
 if __name__ == '__main__':
   main()
@@ -1,36 +1,306 @@
 #!/usr/bin/python2.7
 
+""" Downloads yahoo price history of tickers into <ticker>.csv files.
+
+    Tickers are downloaded concurrently by --workers threads, each keeping
+    a persistent connection to the host.  Requests to a host are spaced to
+    at most --max_rate per second, and failures are retried with exponential
+    backoff.  Files are written to a tmp file and renamed, so a file is
+    either complete or untouched.  With --progress_file, finished tickers
+    are logged and skipped when rerun after an interruption; the file is
+    removed once a pass over all tickers completes, whether or not some
+    failed, so the next run fetches all tickers again.  Failed tickers of
+    the pass are written to --failed_file if specified.
+
+    With --append, existing files are updated by fetching only rows since
+    their last date, and new rows are merged in.  The last stored row is
+    fetched again to check that the adjclose/close ratio is unchanged;
+    otherwise (eg, split or dividend since last download) the entire
+    history of the ticker is downloaded again.
+
+    Example usage:
+      ./download_yahoo.py --ticker_file=./tickers
+                          --download_dir=./raw
+                          --progress_file=./progress
+                          --failed_file=./failed
+                          --append
+"""
+
 import argparse
+import httplib
+import logging
+import multiprocessing
+import multiprocessing.pool
 import os
+import socket
+import threading
+import time
+import urlparse
 import util
 
-WGET = '/usr/local/bin/wget'
 BASE_URL = 'http://real-chart.finance.yahoo.com/table.csv?s='
+HEADER = 'Date,Open,High,Low,Close,Volume,Adj Close'
+# Max relative difference of adjclose/close ratios considered unchanged.
+RATIO_TOLERANCE = 1e-6
+
+WORKERS = 8
+# Max requests per second to a host.
+MAX_RATE = 10.0
 RETRIES = 3
+# Seconds to wait before the first retry, doubled for each further retry.
+BACKOFF = 1.0
+# Socket timeout in seconds.
+TIMEOUT = 30
 
-def download(ticker_file, download_dir, overwrite):
-  tickers = util.readTickers(ticker_file)
-  for ticker in tickers:
-    download_file = '%s/%s.csv' % (download_dir, ticker)
-    if os.path.isfile(download_file) and not overwrite:
-      continue
-    cmd = '%s --quiet "%s%s" -O %s' % (
-        WGET, BASE_URL, ticker, download_file)
-    for i in range(RETRIES):
-      result = util.run(cmd, check=False)
-      if result == 0:
+class Fetcher:
+  """ Fetches urls over persistent connections (one per thread and host).
+      Thread-safe.
+  """
+
+  def __init__(self, max_rate=MAX_RATE, retries=RETRIES, backoff=BACKOFF,
+               timeout=TIMEOUT):
+    self.interval = 1.0 / max_rate if max_rate > 0 else 0.0
+    self.retries = retries
+    self.backoff = backoff
+    self.timeout = timeout
+    self.lock = threading.Lock()
+    self.next_times = dict()  # host => earliest time of next request
+    self.local = threading.local()
+
+  # Waits until a request to host is allowed by max_rate.
+  def wait(self, host):
+    with self.lock:
+      now = time.time()
+      next_time = max(now, self.next_times.get(host, now))
+      self.next_times[host] = next_time + self.interval
+    if next_time > now:
+      time.sleep(next_time - now)
+
+  def getConnection(self, scheme, host):
+    if not hasattr(self.local, 'connections'):
+      self.local.connections = dict()  # (scheme, host) => connection
+    key = (scheme, host)
+    if key not in self.local.connections:
+      if scheme == 'https':
+        connection = httplib.HTTPSConnection(host, timeout=self.timeout)
+      else:
+        connection = httplib.HTTPConnection(host, timeout=self.timeout)
+      self.local.connections[key] = connection
+    return self.local.connections[key]
+
+  def closeConnection(self, scheme, host):
+    connection = self.local.connections.pop((scheme, host), None)
+    if connection is not None:
+      connection.close()
+
+  def get(self, url):
+    """ Returns content of url, or None upon failure.  Network errors,
+        throttling (429) and server errors (5xx) are retried.
+    """
+    parts = urlparse.urlsplit(url)
+    path = parts.path
+    if parts.query:
+      path += '?' + parts.query
+    for i in range(self.retries):
+      if i > 0:
+        time.sleep(self.backoff * 2 ** (i - 1))
+      self.wait(parts.netloc)
+      connection = self.getConnection(parts.scheme, parts.netloc)
+      try:
+        connection.request('GET', path)
+        response = connection.getresponse()
+        content = response.read()
+      except (httplib.HTTPException, socket.error) as e:
+        logging.warning('failed to fetch %s: %s' % (url, e))
+        self.closeConnection(parts.scheme, parts.netloc)
+        continue
+      if response.status == 200:
+        return content
+      logging.warning('failed to fetch %s: status %d' % (
+          url, response.status))
+      if response.status != 429 and response.status < 500:
         break
-      if os.path.isfile(download_file):
-        os.remove(download_file)
+    return None
+
+def getUrl(base_url, ticker, start_date=None):
+  url = '%s%s' % (base_url, ticker)
+  if start_date is not None:
+    y, m, d = start_date.split('-')
+    # Month is 0-based.
+    url += '&a=%d&b=%d&c=%d' % (int(m) - 1, int(d), int(y))
+  return url
+
+# Returns rows of table.csv content (without header) in content order,
+# which is by date descending, or None if content is malformed.
+def parseRows(content):
+  lines = content.splitlines()
+  if len(lines) == 0 or lines[0] != HEADER:
+    return None
+  return lines[1:]
+
+def readRows(csv_file):
+  with open(csv_file, 'r') as fp:
+    rows = parseRows(fp.read())
+  assert rows is not None, 'bad yahoo file: %s' % csv_file
+  return rows
+
+# Writes rows to csv_file via a tmp file.
+def writeRows(csv_file, rows):
+  tmp_file = '%s.tmp' % csv_file
+  with open(tmp_file, 'w') as fp:
+    print >> fp, HEADER
+    for row in rows:
+      print >> fp, row
+  os.rename(tmp_file, csv_file)
+
+def getDate(row):
+  return row[:row.find(',')]
+
+# Returns adjclose/close of row, or None if close is zero or unparsable.
+def getRatio(row):
+  items = row.split(',')
+  try:
+    return float(items[6]) / float(items[4])
+  except (IndexError, ValueError, ZeroDivisionError):
+    return None
+
+# Returns whether row1 and row2 have the same known adjclose/close ratio.
+def sameRatio(row1, row2):
+  ratio1, ratio2 = getRatio(row1), getRatio(row2)
+  if ratio1 is None or ratio2 is None:
+    return False
+  return (abs(ratio1 - ratio2)
+          <= RATIO_TOLERANCE * max(abs(ratio1), abs(ratio2)))
+
+# Returns rows fetched from url, or None upon failure.
+def fetchRows(fetcher, url):
+  content = fetcher.get(url)
+  if content is None:
+    return None
+  rows = parseRows(content)
+  if rows is None:
+    logging.warning('bad content from %s' % url)
+  return rows
+
+def appendTicker(fetcher, base_url, ticker, download_file):
+  """ Updates download_file with rows after its last date.  Returns whether
+      it succeeded, or None if the entire history should be downloaded.
+  """
+  rows = readRows(download_file)
+  if len(rows) == 0:
+    return None
+  last_row = max(rows, key=getDate)
+  last_date = getDate(last_row)
+  new_rows = fetchRows(fetcher, getUrl(base_url, ticker, last_date))
+  if new_rows is None:
+    return False
+  overlap = [row for row in new_rows if getDate(row) == last_date]
+  if len(overlap) != 1 or not sameRatio(overlap[0], last_row):
+    logging.info('%s: adjclose/close ratio of %s changed' % (
+        ticker, last_date))
+    return None
+  new_rows = [row for row in new_rows if getDate(row) > last_date]
+  if len(new_rows) == 0:
+    return True
+  new_rows.sort(key=getDate, reverse=True)
+  writeRows(download_file, new_rows + rows)
+  return True
+
+# Downloads one ticker, returns whether it succeeded.
+def downloadTicker(fetcher, base_url, ticker, download_file, overwrite,
+                   append):
+  if os.path.isfile(download_file) and not overwrite:
+    if not append:
+      return True
+    result = appendTicker(fetcher, base_url, ticker, download_file)
+    if result is not None:
+      return result
+  rows = fetchRows(fetcher, getUrl(base_url, ticker))
+  if rows is None:
+    return False
+  writeRows(download_file, rows)
+  return True
+
+def download(ticker_file, download_dir, overwrite, append=False,
+             base_url=BASE_URL, workers=WORKERS, max_rate=MAX_RATE,
+             progress_file=None, failed_file=None):
+  """ Downloads tickers and returns those failed. """
+  tickers = util.readTickers(ticker_file)
+  if progress_file and os.path.isfile(progress_file):
+    done = set(util.readTickers(progress_file))
+    tickers = [ticker for ticker in tickers if ticker not in done]
+    logging.info('resuming with %d tickers, %d done before' % (
+        len(tickers), len(done)))
+  fetcher = Fetcher(max_rate)
+  progress_lock = threading.Lock()
+  progress_fp = open(progress_file, 'a') if progress_file else None
+
+  def downloadOne(ticker):
+    ok = downloadTicker(fetcher, base_url, ticker,
+                        '%s/%s.csv' % (download_dir, ticker),
+                        overwrite, append)
+    if ok and progress_fp is not None:
+      with progress_lock:
+        print >> progress_fp, ticker
+        progress_fp.flush()
+    return ok
+
+  pool = multiprocessing.pool.ThreadPool(max(1, workers))
+  failed = []
+  try:
+    results = pool.imap(downloadOne, tickers)
+    for ticker in tickers:
+      # Wait with timeout so that KeyboardInterrupt is not blocked.
+      while True:
+        try:
+          ok = results.next(1)
+          break
+        except multiprocessing.TimeoutError:
+          pass
+      if not ok:
+        failed.append(ticker)
+  finally:
+    pool.terminate()
+    pool.join()
+    if progress_fp is not None:
+      progress_fp.close()
+  # The pass completed, so progress is only kept for interruptions.
+  if progress_file:
+    os.remove(progress_file)
+  if failed_file:
+    with open(failed_file, 'w') as fp:
+      for ticker in failed:
+        print >> fp, ticker
+  if len(failed) > 0:
+    logging.warning('failed to download %d tickers: %s' % (
+        len(failed), ' '.join(failed)))
+  return failed
 
 def main():
   parser = argparse.ArgumentParser()
   parser.add_argument('--ticker_file', required=True)
   parser.add_argument('--download_dir', required=True)
   parser.add_argument('--overwrite', action='store_true')
+  parser.add_argument('--append', action='store_true',
+                      help='update existing files with new rows, see '
+                           'module doc')
+  parser.add_argument('--base_url', default=BASE_URL)
+  parser.add_argument('--workers', type=int, default=WORKERS)
+  parser.add_argument('--max_rate', type=float, default=MAX_RATE,
+                      help='max requests per second to a host, '
+                           '0 for no limit')
+  parser.add_argument('--progress_file',
+                      help='if specified, log finished tickers to this file '
+                           'and skip them when rerun after an '
+                           'interruption')
+  parser.add_argument('--failed_file',
+                      help='if specified, write tickers failed in this run '
+                           'to this file')
   args = parser.parse_args()
-  download(args.ticker_file, args.download_dir, args.overwrite)
+  util.configLogging()
+  download(args.ticker_file, args.download_dir, args.overwrite, args.append,
+           args.base_url, args.workers, args.max_rate, args.progress_file,
+           args.failed_file)
 
 if __name__ == '__main__':
   main()
-
@@ -43,11 +43,28 @@
     All flags are optional.  If not set, the corresponding filter will
     be disabled.  If none is set, --output_file should contain identical
     content to --input_file.
+
+    Several outputs can be filtered from the same input in one pass by
+    repeating --filters and --output_file (paired in order), where each
+    --filters is a '+'-separated list of the filters above, eg:
+      --filters=min_raw_price=10+max_holes=0.01+remove_neg_labels
+      --output_file=./train_meta
+      --filters=min_raw_price=10
+      --output_file=./predict_meta
+    Dirs and files needed by the filters are specified once by the flags
+    above.  Thresholds of flags are ignored when --filters is used.
+
+    Filters are evaluated as masks over all metadata rows.  Values are
+    looked up in panels of the dirs (see util.readPanel()), on the trading
+    day for price, volatility and volumed, or as of the trading day for
+    marketcap and holes.  Missing values (including missing tickers) are
+    rejected.  A row rejected by several filters is counted in skip_stats
+    only for the first of them in the order above.
 """
 
 import argparse
-import bisect
 import logging
+import numpy
 import util
 
 MIN_RAW_PRICE = float('-Inf')
@@ -56,6 +73,19 @@ MIN_VOLUMED = float('-Inf')
 MIN_MARKETCAP = float('-Inf')
 MAX_HOLES = float('Inf')
 
+# Filters on panel values in the order they are applied:
+# [filter, dir flag, default threshold, as_of].  Filters named min_* keep
+# values no less than the threshold, max_* no greater.
+PANEL_FILTERS = [
+    ['min_raw_price', 'raw_price_dir', MIN_RAW_PRICE, False],
+    ['max_volatility', 'volatility_dir', MAX_VOLATILITY, False],
+    ['min_volumed', 'volumed_dir', MIN_VOLUMED, False],
+    ['min_marketcap', 'marketcap_dir', MIN_MARKETCAP, True],
+    ['max_holes', 'hole_dir', MAX_HOLES, True],
+]
+# Filters without threshold, applied after panel filters.
+FLAG_FILTERS = ['membership', 'remove_neg_labels']
+
 def readMembership(membership_file):
   with open(membership_file, 'r') as fp:
     lines = fp.read().splitlines()
@@ -76,14 +106,131 @@ def readMembership(membership_file):
     membership[ticker] = value
   return membership
 
-def isMember(membership, ticker, date):
-  if ticker not in membership:
-    return False
-  periods = membership[ticker]
-  for start, end in periods:
-    if date >= start and date < end:
-      return True
-  return False
+# Returns bool array of whether tickers[i] is a member on dates[i].
+def getMemberMask(membership, tickers, dates):
+  mask = numpy.zeros(len(tickers), dtype=bool)
+  if len(tickers) == 0:
+    return mask
+  unique_tickers, inverse = numpy.unique(tickers, return_inverse=True)
+  # Rows grouped by ticker in the order of unique_tickers, so that rows of
+  # each ticker are found in one pass.
+  groups = numpy.split(numpy.argsort(inverse, kind='mergesort'),
+                       numpy.cumsum(numpy.bincount(inverse))[:-1])
+  for i in range(len(unique_tickers)):
+    periods = membership.get(unique_tickers[i])
+    if not periods:
+      continue
+    rows = groups[i]
+    starts = numpy.array([start for start, end in periods])
+    ends = numpy.array([end for start, end in periods])
+    index = numpy.searchsorted(starts, dates[rows], side='right') - 1
+    member = index >= 0
+    member[member] = dates[rows[member]] < ends[index[member]]
+    mask[rows] = member
+  return mask
+
+# Returns [lines, tickers, dates] of input_file, where tickers and dates are
+# arrays of the first two columns.
+def readMeta(input_file):
+  with open(input_file, 'r') as fp:
+    lines = fp.read().splitlines()
+  tickers, dates = [], []
+  for line in lines:
+    items = line.split('\t')
+    assert len(items) >= 2
+    tickers.append(items[0])
+    dates.append(items[1])
+  return [lines, numpy.array(tickers, dtype=str),
+          numpy.array(dates, dtype=str)]
+
+# Reads labels of a text or .npy label file (see util.readMatrix()).
+def readLabels(label_file, count):
+  labels = numpy.atleast_1d(util.readMatrix(label_file))
+  assert labels.shape[0] == count, (
+      'inconsisten line count between meta and label files')
+  return labels
+
+def parseFilters(filter_str):
+  """ Returns {filter: threshold} of filter_str (see module doc), where
+      threshold is True for filters in FLAG_FILTERS.
+  """
+  names = [item[0] for item in PANEL_FILTERS]
+  filters = dict()
+  for item in filter_str.split('+'):
+    item = item.strip()
+    if item == '':
+      continue
+    if item in FLAG_FILTERS:
+      filters[item] = True
+      continue
+    name, value = item.split('=')
+    assert name in names, 'unrecognized filter: %s' % item
+    filters[name] = float(value)
+  return filters
+
+def filterMetadatas(input_file, filters_list, dirs, membership_file,
+                    label_file, output_files):
+  """ Filters input_file by each {filter: threshold} of filters_list (see
+      parseFilters()) into output_files, in one pass.  dirs is
+      {dir flag: dir} of the panel filters used.  Returns skip_stats of
+      outputs.
+  """
+  lines, tickers, dates = readMeta(input_file)
+  # Values of panel filters and flag masks are shared between outputs.
+  values = dict()  # filter => values of rows
+  membership = None
+  labels = None
+  all_stats = []
+  for filters, output_file in zip(filters_list, output_files):
+    stats = {
+      'min_raw_price': 0,
+      'max_volatility': 0,
+      'min_volumed': 0,
+      'min_marketcap': 0,
+      'max_holes': 0,
+      'membership': 0,
+      'neg_label': 0,
+    }
+    keep = numpy.ones(len(lines), dtype=bool)
+    for name, dir_flag, default, as_of in PANEL_FILTERS:
+      if name not in filters:
+        continue
+      if name not in values:
+        assert dirs.get(dir_flag) is not None, (
+            'must also specify --%s since %s is used' % (dir_flag, name))
+        panel_dates, panel_tickers, panel_values = util.readPanel(
+            dirs[dir_flag], 'float64')
+        values[name] = util.lookupValues(
+            panel_dates, panel_tickers, panel_values, tickers, dates, as_of)
+      with numpy.errstate(invalid='ignore'):
+        if name.startswith('min_'):
+          passed = values[name] >= filters[name]
+        else:
+          passed = values[name] <= filters[name]
+      stats[name] = int((keep & ~passed).sum())
+      keep &= passed
+    if filters.get('membership'):
+      if membership is None:
+        assert membership_file is not None, (
+            'must also specify --membership_file since membership is used')
+        membership = getMemberMask(readMembership(membership_file), tickers,
+                                   dates)
+      stats['membership'] = int((keep & ~membership).sum())
+      keep &= membership
+    if filters.get('remove_neg_labels'):
+      if labels is None:
+        assert label_file is not None, (
+            'must also specify --label_file since remove_neg_labels is used')
+        labels = readLabels(label_file, len(lines))
+      passed = labels >= 0
+      stats['neg_label'] = int((keep & ~passed).sum())
+      keep &= passed
+    with open(output_file, 'w') as fp:
+      for i in numpy.flatnonzero(keep):
+        print >> fp, lines[i]
+    logging.info('skip_stats of %s: %s' % (output_file, stats))
+    all_stats.append(stats)
+  return all_stats
 
 def filterMetadata(input_file, min_raw_price, raw_price_dir,
                    max_volatility, volatility_dir,
@@ -91,106 +238,21 @@ def filterMetadata(input_file, min_raw_price, raw_price_dir,
                    marketcap_dir, max_holes, hole_dir,
                    membership_file, remove_neg_labels,
                    label_file, output_file):
-  stats = {
-    'min_raw_price': 0,
-    'max_volatility': 0,
-    'min_volumed': 0,
-    'min_marketcap': 0,
-    'max_holes': 0,
-    'membership': 0,
-    'neg_label': 0,
-  }
-
-  ifp = open(input_file, 'r')
+  thresholds = [min_raw_price, max_volatility, min_volumed, min_marketcap,
+                max_holes]
+  dirs = [raw_price_dir, volatility_dir, volumed_dir, marketcap_dir, hole_dir]
+  filters = dict()
+  for i in range(len(PANEL_FILTERS)):
+    if dirs[i] is not None:
+      filters[PANEL_FILTERS[i][0]] = thresholds[i]
+  if membership_file is not None:
+    filters['membership'] = True
   if remove_neg_labels:
-    lfp = open(label_file, 'r')
-  ofp = open(output_file, 'w')
-
-  prev_ticker = None
-  price = None  # for prev_ticker, date => price
-  volatility = None  # for prev ticker, date => volatility
-  volumed = None  # for prev ticker, date => volumed
-  marketcap = None  # for prev ticker, [dates, values]
-  hole = None  # for prev ticker, [dates, holes]
-  if membership_file is None:
-    membership = None
-  else:
-    membership = readMembership(membership_file)  # ticker => [[start, end] ...]
-
-  while True:
-    line = ifp.readline()
-    if remove_neg_labels:
-      lline = lfp.readline()
-    if line == '':
-      if remove_neg_labels:
-        assert lline == '', 'inconsisten line count between meta and label files'
-      break
-    assert line.endswith('\n')
-    items = line[:-1].split('\t')
-    assert len(items) >= 2
-    ticker, date = items[0], items[1]
-    if ticker != prev_ticker:
-      prev_ticker = ticker
-      if raw_price_dir is not None:
-        price = util.readKeyValueDict('%s/%s' % (raw_price_dir, ticker))
-      if volatility_dir is not None:
-        volatility = util.readKeyValueDict('%s/%s' % (volatility_dir, ticker))
-      if volumed_dir is not None:
-        volumed = util.readKeyValueDict('%s/%s' % (volumed_dir, ticker))
-      if marketcap_dir is not None:
-        tmp = util.readKeyValueList('%s/%s' % (marketcap_dir, ticker))
-        marketcap_dates = [t[0] for t in tmp]
-        marketcap_values = [t[1] for t in tmp]
-        marketcap = (marketcap_dates, marketcap_values)
-      if hole_dir is not None:
-        tmp = util.readKeyValueList('%s/%s' % (hole_dir, ticker))
-        hole_dates = [t[0] for t in tmp]
-        hole_values = [t[1] for t in tmp]
-        hole = (hole_dates, hole_values)
-    # Maybe check price.
-    if price is not None:
-      #assert date in price, 'missing price for %s on %s' % (ticker, date)
-      if date not in price or price[date] < min_raw_price:
-        stats['min_raw_price'] += 1
-        continue
-    # Maybe check volatility.
-    if volatility is not None:
-      #assert date in volatility, 'missing volatility for %s on %s' % (ticker, date)
-      if date not in volatility or volatility[date] > max_volatility:
-        stats['max_volatility'] += 1
-        continue
-    if volumed is not None:
-      if date not in volumed or volumed[date] < min_volumed:
-        stats['min_volumed'] += 1
-        continue
-    # Maybe check marketcap.
-    if marketcap is not None:
-      marketcap_dates, marketcap_values = marketcap
-      index = bisect.bisect_right(marketcap_dates, date) - 1
-      if index < 0 or marketcap_values[index] < min_marketcap:
-        stats['min_marketcap'] += 1
-        continue
-    # Maybe check holes.
-    if hole is not None:
-      hole_dates, hole_values = hole
-      index = bisect.bisect_right(hole_dates, date) - 1
-      if index < 0 or hole_values[index] > max_holes:
-        stats['max_holes'] += 1
-        continue
-    # Maybe check membership.
-    if membership is not None:
-      if not isMember(membership, ticker, date):
-        stats['membership'] += 1
-        continue
-    # Maybe check label.
-    if remove_neg_labels:
-      assert lline.endswith('\n')
-      label = float(lline[:-1])
-      if label < 0:
-        stats['neg_label'] += 1
-        continue
-    print >> ofp, line[:-1]
-  logging.info('skip_stats: %s' % stats)
+    filters['remove_neg_labels'] = True
+  return filterMetadatas(
+      input_file, [filters],
+      dict([[PANEL_FILTERS[i][1], dirs[i]] for i in range(len(dirs))]),
+      membership_file, label_file, [output_file])[0]
 
 def main():
   parser = argparse.ArgumentParser()
@@ -208,8 +270,22 @@ def main():
   parser.add_argument('--membership_file')
   parser.add_argument('--remove_neg_labels', action='store_true')
   parser.add_argument('--label_file')
-  parser.add_argument('--output_file', required=True)
+  parser.add_argument('--filters', action='append',
+                      help='filters of the corresponding --output_file, '
+                           'see module doc')
+  parser.add_argument('--output_file', action='append', required=True)
   args = parser.parse_args()
+  util.configLogging()
+  if args.filters is not None:
+    assert len(args.filters) == len(args.output_file), (
+        '--filters and --output_file must be repeated the same times')
+    filterMetadatas(args.input_file,
+                    [parseFilters(filters) for filters in args.filters],
+                    vars(args), args.membership_file, args.label_file,
+                    args.output_file)
+    return
+  assert len(args.output_file) == 1, (
+      'must specify --filters for each of multiple --output_file')
   if args.min_raw_price > MIN_RAW_PRICE:
     assert args.raw_price_dir is not None, (
         'must also specify --raw_price_dir since --min_raw_price is specified')
@@ -243,8 +319,7 @@ def main():
                  args.min_volumed, args.volumed_dir, args.min_marketcap,
                  args.marketcap_dir, args.max_holes, args.hole_dir,
                  args.membership_file, args.remove_neg_labels,
-                 args.label_file, args.output_file)
+                 args.label_file, args.output_file[0])
 
 if __name__ == '__main__':
   main()
-
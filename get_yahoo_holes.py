@@ -7,10 +7,10 @@
                            --output_dir=./holes
 """
 
-from collections import deque
 import argparse
 import bisect
 import os
+import util
 
 def getHoles(args):
   tickers = sorted([f[:f.rfind('.')] for f in os.listdir(args.raw_dir)
@@ -37,20 +37,16 @@ def getHoles(args):
     min_date = dates[-1]
     dates = set(dates)
 
+    # For each trading day (after the first day of the ticker),
+    # count the number of holes in the past [window] trading days
+    # and output count/window ratio.
+    days = trading_days[bisect.bisect_left(trading_days, min_date):]
+    holes = [0.0 if day in dates else 1.0 for day in days]
+    ratios = (util.rollingSum(holes, args.window)
+              / util.rollingCounts(len(days), args.window))
     with open('%s/%s' % (args.output_dir, ticker), 'w') as fp:
-      # For each trading day (after the first day of the ticker),
-      # count the number of holes in the past [window] trading days
-      # and output count/window ratio.
-      index = bisect.bisect_left(trading_days, min_date)
-      buffer = deque(maxlen=args.window)
-      while index < len(trading_days):
-        date = trading_days[index]
-        if date in dates:
-          buffer.append(1)
-        else:
-          buffer.append(0)
-        print >> fp, '%s\t%f' % (date, float(buffer.count(0))/len(buffer))
-        index += 1
+      for i in range(len(days)):
+        print >> fp, '%s\t%f' % (days[i], ratios[i])
 
 def main():
   parser = argparse.ArgumentParser()
@@ -1,70 +1,96 @@
 #!/usr/bin/python2.7
 
+""" Gets trading days from yahoo raw files.
+
+    A calendar day is a trading day if the ratio of tickers trading on it,
+    among those whose date range covers it, is at least --threshold.
+
+    Example usage:
+      ./get_yahoo_trading_days.py --raw_dir=./raw
+                                  --threshold=0.99
+                                  --output_file=./trading_days
+
+    --threshold and --output_file can be repeated to output trading days of
+    several thresholds (paired in order) from one pass over the raw files.
+
+    Counts are accumulated with a sweep line over day numbers: each date of
+    each ticker adds one to the trading count of the date, and each ticker
+    adds one to the total count at its first date and removes one after its
+    last date, so total counts are cumulative sums of these changes.
+"""
+
 import argparse
-import bisect
-import datetime
+import numpy
 import os
+import util
 
-def getTradingDays(args):
-  tickers = sorted([f[:f.rfind('.')] for f in os.listdir(args.raw_dir)
+# Returns [[dates] ...] of tickers in raw_dir, ascending without dups,
+# skipping years before min_year and tickers without dates.
+def readTickerDates(raw_dir, min_year):
+  tickers = sorted([f[:f.rfind('.')] for f in os.listdir(raw_dir)
                     if f.endswith('.csv')])
-
-  data_map = dict()  # ticker => {dates}
-  range_map = dict()  # ticker => (min_date, max_date)
-  min_date = '9999-99-99'
-  max_date = '0000-00-00'
-
+  ticker_dates = []
   for ticker in tickers:
-    with open('%s/%s.csv' % (args.raw_dir, ticker), 'r') as fp:
+    with open('%s/%s.csv' % (raw_dir, ticker), 'r') as fp:
       lines = fp.read().splitlines()
     assert len(lines) > 0
     assert lines[0] == 'Date,Open,High,Low,Close,Volume,Adj Close'
     dates = set()
     for i in range(1, len(lines)):
       date = lines[i][:lines[i].find(',')]
-      y, m, d = date.split('-')
-      if y < args.min_year:
+      if date[:4] < min_year:
         continue
       dates.add(date)
-      min_date = min(min_date, date)
-      max_date = max(max_date, date)
     if len(dates) == 0:
       continue
-    data_map[ticker] = dates
-    range_map[ticker] = (min(dates), max(dates))
+    ticker_dates.append(sorted(dates))
+  return ticker_dates
 
-  #print 'loaded %d tickers, min date: %s, max date: %s' % (
-  #    len(data_map), min_date, max_date)
+def countTradingDays(ticker_dates):
+  """ Returns [dates, trading_counts, total_counts] of all calendar days
+      between the min and max date of ticker_dates.
+  """
+  assert len(ticker_dates) > 0
+  days = [util.ymdsToDays(dates) for dates in ticker_dates]
+  min_day = min([d[0] for d in days])
+  max_day = max([d[-1] for d in days])
+  size = max_day - min_day + 1
+  trading_counts = numpy.bincount(numpy.concatenate(days) - min_day,
+                                  minlength=size)
+  changes = numpy.zeros(size + 1, dtype=int)
+  numpy.add.at(changes, [d[0] - min_day for d in days], 1)
+  numpy.add.at(changes, [d[-1] - min_day + 1 for d in days], -1)
+  total_counts = numpy.cumsum(changes[:-1])
+  dates = util.daysToYmds(numpy.arange(min_day, max_day + 1))
+  return dates, trading_counts, total_counts
 
-  with open(args.output_file, 'w') as fp:
-    min_date_obj = datetime.datetime.strptime(min_date, '%Y-%m-%d')
-    max_date_obj = datetime.datetime.strptime(max_date, '%Y-%m-%d')
-    assert min_date_obj <= max_date_obj
-    step = datetime.timedelta(1)
-    date_obj = min_date_obj
-    while date_obj <= max_date_obj:
-      date = date_obj.strftime('%Y-%m-%d')
-      trading_count = 0
-      total_count = 0
-      for ticker, dates in data_map.iteritems():
-        min_date, max_date = range_map[ticker]
-        if date < min_date or date > max_date:
-          continue
-        total_count += 1
-        if date in dates:
-          trading_count += 1
-      if float(trading_count)/total_count >= args.threshold:
-        print >> fp, date
-      date_obj += step
+# Returns [dates] of trading days for each threshold.
+def getTradingDays(raw_dir, min_year, thresholds):
+  dates, trading_counts, total_counts = countTradingDays(
+      readTickerDates(raw_dir, min_year))
+  # Days not covered by any ticker are not trading days.
+  ratios = (trading_counts.astype(float)
+            / numpy.maximum(total_counts, 1))
+  return [[dates[i] for i in numpy.flatnonzero(ratios >= threshold)]
+          for threshold in thresholds]
 
 def main():
   parser = argparse.ArgumentParser()
   parser.add_argument('--raw_dir', required=True)
   parser.add_argument('--min_year', default='2000')
-  parser.add_argument('--threshold', type=float, default=0.99)
-  parser.add_argument('--output_file', required=True)
-  getTradingDays(parser.parse_args())
+  parser.add_argument('--threshold', type=float, action='append',
+                      help='default 0.99')
+  parser.add_argument('--output_file', action='append', required=True)
+  args = parser.parse_args()
+  thresholds = args.threshold or [0.99]
+  assert len(thresholds) == len(args.output_file), (
+      '--threshold and --output_file must be paired')
+
+  trading_days = getTradingDays(args.raw_dir, args.min_year, thresholds)
+  for i in range(len(thresholds)):
+    with open(args.output_file[i], 'w') as fp:
+      for date in trading_days[i]:
+        print >> fp, date
 
 if __name__ == '__main__':
   main()
-
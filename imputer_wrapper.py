@@ -4,6 +4,17 @@ from sklearn.preprocessing import Imputer
 import logging
 import numpy
 
+# Number of rows to check at a time, bounding the size of nan masks.
+FILL_CHUNK_ROWS = 100000
+
+def fillZero(X):
+  """ Fills nan in X with 0 in place, keeping its dtype (eg, float32).
+  """
+  for start in range(0, X.shape[0], FILL_CHUNK_ROWS):
+    chunk = X[start:start+FILL_CHUNK_ROWS]
+    chunk[numpy.isnan(chunk)] = 0.0
+  return X
+
 class ImputerWrapper:
   """ A simple wrapper around Imputer and supports using zero to fill in missing values.
       If entire column is nan it gets filled with 0 to avoid Imputer removing the column.
@@ -16,16 +27,12 @@ class ImputerWrapper:
       self.imputer = Imputer(missing_values, strategy, axis, verbose, copy)
 
   def prepare(self, X):
-    for j in range(X.shape[1]):
-      all_nan = True
-      for i in range(X.shape[0]):
-        if not numpy.isnan(X[i][j]):
-          all_nan = False
-          break
-      if all_nan:
-        logging.info('column %d all nan, filling with 0' % j)
-        for i in range(X.shape[0]):
-          X[i][j] = 0.0
+    all_nan = numpy.ones(X.shape[1], dtype=bool)
+    for start in range(0, X.shape[0], FILL_CHUNK_ROWS):
+      all_nan &= numpy.isnan(X[start:start+FILL_CHUNK_ROWS]).all(axis=0)
+    for j in numpy.flatnonzero(all_nan):
+      logging.info('column %d all nan, filling with 0' % j)
+    X[:, all_nan] = 0.0
 
   def fit(self, X, y=None):
     if self.strategy == 'zero':
@@ -36,11 +43,7 @@ class ImputerWrapper:
 
   def fit_transform(self, X, y=None, **fit_params):
     if self.strategy == 'zero':
-      for i in range(X.shape[0]):
-        for j in range(X.shape[1]):
-          if numpy.isnan(X[i][j]):
-            X[i][j] = 0.0
-      return X
+      return fillZero(X)
     self.prepare(X)
     return self.imputer.fit_transform(X, y, **fit_params)
 
@@ -57,10 +60,6 @@ class ImputerWrapper:
 
   def transform(self, X):
     if self.strategy == 'zero':
-      for i in range(X.shape[0]):
-        for j in range(X.shape[1]):
-          if numpy.isnan(X[i][j]):
-            X[i][j] = 0.0
-      return X
+      return fillZero(X)
     return self.imputer.transform(X)
 
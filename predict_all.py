@@ -23,18 +23,16 @@ import os
 import pickle
 import util
 
-TMP_DATA_FILE = '/tmp/qd3_predict_all_tmp_data'
-
 def getName(ym, prefix, suffix):
   y, m = ym.split('-')
   return '%s%s%s%s' % (prefix, y, m, suffix)
 
-def prepareData(ym, data_file, label_file, meta_file, predict_meta_file,
-                tmp_data_file):
-  data_ifp = open(data_file, 'r')
-  label_ifp = open(label_file, 'r')
+def prepareData(meta_file, predict_meta_file):
+  """ Scans meta_file (filtered by predict_meta_file if not None) once and
+      returns {date: [meta, rows]}, where meta is [ticker, gain] of each row
+      (of data file) to be predicted on date.
+  """
   meta_ifp = open(meta_file, 'r')
-  data_ofp = open(tmp_data_file, 'w')
   if predict_meta_file is None:
     predict_meta_ifp = None
     predict_meta = None
@@ -42,18 +40,14 @@ def prepareData(ym, data_file, label_file, meta_file, predict_meta_file,
     predict_meta_ifp = open(predict_meta_file, 'r')
     predict_meta = predict_meta_ifp.readline()
 
-  meta = []
+  groups = dict()
+  row = -1
   while True:
     line = meta_ifp.readline()
     if line == '':
-      assert data_ifp.readline() == ''
-      assert label_ifp.readline() == ''
       break
     assert line[-1] == '\n'
-    data_line = data_ifp.readline()
-    label_line = label_ifp.readline()
-    assert data_line != ''
-    assert label_line != ''
+    row += 1
 
     if predict_meta is not None:
       if line != predict_meta:
@@ -61,30 +55,34 @@ def prepareData(ym, data_file, label_file, meta_file, predict_meta_file,
       predict_meta = predict_meta_ifp.readline()
 
     ticker, date, tmp, gain = line[:-1].split('\t')
-    if util.ymdToYm(date) != ym:
-      continue
-    assert data_line[-1] == '\n'
-    assert label_line[-1] == '\n'
-    label = float(label_line[:-1])
     gain = float(gain)
-    # This is not true when labels are cut at other places than 0.
-    # TODO: --label_file is not needed; remove.
-    #if label > 0.5: assert gain >= 0
-    #if label < 0.5: assert gain <= 0
-    print >> data_ofp, data_line[:-1]
+    meta, rows = groups.setdefault(util.ymdToYm(date), [[], []])
     meta.append([ticker, gain])
+    rows.append(row)
 
-  data_ifp.close()
-  label_ifp.close()
   meta_ifp.close()
-  data_ofp.close()
   if predict_meta_ifp is not None:
     predict_meta_ifp.close()
-  return meta
+  return groups
+
+def loadModel(model_file, imputer_file, cache):
+  """ Returns [model, imputer] unpickled from files, reusing the last ones
+      in cache (dict) if the files are the same.
+  """
+  files = [model_file, imputer_file]
+  if cache.get('files') != files:
+    with open(model_file, 'rb') as fp:
+      model = pickle.load(fp)
+    with open(imputer_file, 'rb') as fp:
+      imputer = pickle.load(fp)
+    cache['files'] = files
+    cache['model'] = [model, imputer]
+  return cache['model']
 
 def main():
   parser = argparse.ArgumentParser()
   parser.add_argument('--data_file', required=True)
+  # TODO: --label_file is not needed; remove.
   parser.add_argument('--label_file', required=True)
   parser.add_argument('--meta_file', required=True)
   # Similar to --train_meta_file in train_model.py
@@ -110,6 +108,12 @@ def main():
     dates.add(util.ymdToYm(date))
   dates = sorted(dates)
 
+  # Data is read once (npy files are memory-mapped) and rows are grouped by
+  # date in one pass of meta.
+  groups = prepareData(args.meta_file, args.predict_meta_file)
+  all_data = util.readMatrix(args.data_file, mmap_mode='r')
+  cache = dict()
+
   ofp = open(args.result_file, 'w')
 
   started = False  # check no 'hole' in simulation period
@@ -134,19 +138,16 @@ def main():
     started = True
     previous_files = [model_file, imputer_file]
 
-    meta = prepareData(date, args.data_file, args.label_file, args.meta_file,
-                       args.predict_meta_file, TMP_DATA_FILE)
-    data = numpy.loadtxt(TMP_DATA_FILE)
+    meta, rows = groups.get(date, [[], []])
+    # Copy rows into a writable array for in-place imputation (fancy
+    # indexing of a read-only memmap is not writable).
+    data = numpy.take(all_data, rows, axis=0)
     assert data.shape[0] == len(meta), 'inconsistent data size: %d vs %d' % (
         data.shape[0], len(meta))
 
-    with open(imputer_file, 'rb') as fp:
-      imputer = pickle.load(fp)
+    model, imputer = loadModel(model_file, imputer_file, cache)
     data = imputer.transform(data)
 
-    with open(model_file, 'rb') as fp:
-      model = pickle.load(fp)
-
     if 'predict_proba' in dir(model):
       prob = model.predict_proba(data)
       prob = [item[1] for item in prob]
@@ -163,8 +164,6 @@ def main():
       print >> ofp, '\t%s\t%f\t%f' % (ticker, gain, score)
 
   ofp.close()
-  if os.path.isfile(TMP_DATA_FILE):
-    os.remove(TMP_DATA_FILE)
 
 if __name__ == '__main__':
   main()
@@ -12,6 +12,10 @@
     with first column being date, and the rest being sorted indicators.
     Rows are sorted by date.
 
+    Tickers are processed by --workers processes.  Each ticker dir is
+    written to a tmp dir and renamed, so an interrupted run does not leave
+    partial ticker dirs (which would be skipped when rerun).
+
     The current output format is a compromise between readability and data
     size.  Dimensions like ARQ are pretty dense (a ticker tends to have the
     same set of indicators in every ARQ) so size wise this is good.  ND tends
@@ -23,8 +27,10 @@
 """
 
 import argparse
+import multiprocessing
 import os
 import shutil
+import util
 
 OUTPUT_DELIM = '\t'
 OUTPUT_SUFFIX = '.tsv'
@@ -32,74 +38,111 @@ OUTPUT_SUFFIX = '.tsv'
 NO_DIMENSION = 'ND'
 DATE_HEADER = 'date'
 NO_VALUE = ''
+# Prefix of tmp dirs of tickers being written.
+TMP_PREFIX = '.tmp-'
+
+def addRawLine(raw_dict, line):
+  """ Adds a raw line (eg, AA_ACCOCI_ARQ,2004-02-27,-569000000.0) to raw_dict:
+      dimension => { date => { indicator => value } }, and returns its ticker.
+  """
+  label, date, value = line.split(',')
+  items = label.split('_')
+  assert len(items) == 2 or len(items) == 3
+  indicator = items[1]
+  assert indicator != DATE_HEADER
+  if len(items) == 2:
+    dimension = NO_DIMENSION
+  else:
+    assert items[2] != NO_DIMENSION
+    dimension = items[2]
+  if dimension not in raw_dict:
+    raw_dict[dimension] = {date: {indicator: value}}
+  elif date not in raw_dict[dimension]:
+    raw_dict[dimension][date] = {indicator: value}
+  else:
+    assert indicator not in raw_dict[dimension][date]
+    raw_dict[dimension][date][indicator] = value
+  return items[0]
 
 def readRawDict(raw_file):
   with open(raw_file, 'r') as fp:
     lines = fp.read().splitlines()
-  # dimension => { date => { indicator => value } }
   raw_dict = dict()
   for line in lines:
-    label, date, value = line.split(',')
-    items = label.split('_')
-    assert len(items) == 2 or len(items) == 3
-    assert items[0] == raw_file[raw_file.rfind('/')+1:]
-    indicator = items[1]
-    assert indicator != DATE_HEADER
-    if len(items) == 2:
-      dimension = NO_DIMENSION
-    else:
-      assert items[2] != NO_DIMENSION
-      dimension = items[2]
-    if dimension not in raw_dict:
-      raw_dict[dimension] = {date: {indicator: value}}
-    elif date not in raw_dict[dimension]:
-      raw_dict[dimension][date] = {indicator: value}
-    else:
-      assert indicator not in raw_dict[dimension][date]
-      raw_dict[dimension][date][indicator] = value
+    ticker = addRawLine(raw_dict, line)
+    assert ticker == raw_file[raw_file.rfind('/')+1:]
   return raw_dict
 
-def processSf1Raw(raw_dir, processed_dir, overwrite=False):
-  raw_files = sorted(os.listdir(raw_dir))
-  for i in range(len(raw_files)):
-    ticker = raw_files[i]
-    output_dir = '%s/%s' % (processed_dir, ticker)
-    if os.path.isdir(output_dir):
-      if not overwrite:
-        continue
-      else:
-        shutil.rmtree(output_dir)
-    os.mkdir(output_dir)
-    raw_file = '%s/%s' % (raw_dir, ticker)
-    raw_dict = readRawDict(raw_file)
-    for dimension, date_dict in raw_dict.iteritems():
-      # Get sorted dates for this ticker dimension.
-      dates = sorted(date_dict.keys())
-      date_index = {dates[i]: i for i in range(len(dates))}
-      # Get sorted indicators for this ticker dimension.
-      indicators = set()
-      for indicator_dict in date_dict.itervalues():
-        indicators.update(indicator_dict.iterkeys())
-      indicators = sorted(indicators)
-      # Index for indicators start from 1 because the first column is date.
-      indicator_index = {indicators[i]: i+1 for i in range(len(indicators))}
-      # Prepare the header for tsv output.
-      header = [DATE_HEADER] + indicators
-      # Prepare the matrix for tsv output.
-      data = [[NO_VALUE for i in range(len(indicators)+1)]
-              for j in range(len(dates))]
-      for date, indicator_dict in date_dict.iteritems():
-        row = date_index[date]
-        # Fill in the first column (date).
-        data[row][0] = date
-        # Fill in the other columns (indicators).
-        for indicator, value in indicator_dict.iteritems():
-          data[row][indicator_index[indicator]] = value
-      # Write output.
-      with open('%s/%s%s' % (output_dir, dimension, OUTPUT_SUFFIX), 'w') as fp:
-        print >> fp, OUTPUT_DELIM.join(header)
-        for row in data:
-          print >> fp, OUTPUT_DELIM.join(row)
+# Writes raw_dict (see addRawLine()) into one tsv file per dimension under
+# output_dir.
+def writeProcessed(raw_dict, output_dir):
+  for dimension, date_dict in raw_dict.iteritems():
+    # Get sorted dates for this ticker dimension.
+    dates = sorted(date_dict.keys())
+    date_index = {dates[i]: i for i in range(len(dates))}
+    # Get sorted indicators for this ticker dimension.
+    indicators = set()
+    for indicator_dict in date_dict.itervalues():
+      indicators.update(indicator_dict.iterkeys())
+    indicators = sorted(indicators)
+    # Index for indicators start from 1 because the first column is date.
+    indicator_index = {indicators[i]: i+1 for i in range(len(indicators))}
+    # Prepare the header for tsv output.
+    header = [DATE_HEADER] + indicators
+    # Prepare the matrix for tsv output.
+    data = [[NO_VALUE for i in range(len(indicators)+1)]
+            for j in range(len(dates))]
+    for date, indicator_dict in date_dict.iteritems():
+      row = date_index[date]
+      # Fill in the first column (date).
+      data[row][0] = date
+      # Fill in the other columns (indicators).
+      for indicator, value in indicator_dict.iteritems():
+        data[row][indicator_index[indicator]] = value
+    # Write output.
+    with open('%s/%s%s' % (output_dir, dimension, OUTPUT_SUFFIX), 'w') as fp:
+      print >> fp, OUTPUT_DELIM.join(header)
+      for row in data:
+        print >> fp, OUTPUT_DELIM.join(row)
+
+# Writes raw_dict of ticker into processed_dir/<ticker>.  Output goes to a
+# hidden tmp dir which is renamed upon completion, so an interrupted run
+# never leaves a partial ticker dir behind.
+def writeTicker(raw_dict, processed_dir, ticker):
+  output_dir = '%s/%s' % (processed_dir, ticker)
+  tmp_dir = '%s/%s%s' % (processed_dir, TMP_PREFIX, ticker)
+  if os.path.isdir(tmp_dir):
+    shutil.rmtree(tmp_dir)
+  os.mkdir(tmp_dir)
+  writeProcessed(raw_dict, tmp_dir)
+  if os.path.isdir(output_dir):
+    shutil.rmtree(output_dir)
+  os.rename(tmp_dir, output_dir)
+
+def processTicker(job):
+  raw_dir, processed_dir, ticker = job
+  raw_dict = readRawDict('%s/%s' % (raw_dir, ticker))
+  writeTicker(raw_dict, processed_dir, ticker)
+  return ticker
+
+def processSf1Raw(raw_dir, processed_dir, overwrite=False,
+                  changed_ticker_file=None, workers=1):
+  # Remove tmp dirs left by an interrupted run.
+  for name in os.listdir(processed_dir):
+    if name.startswith(TMP_PREFIX):
+      shutil.rmtree('%s/%s' % (processed_dir, name))
+  raw_files = util.filterTickers(sorted(os.listdir(raw_dir)),
+                                 changed_ticker_file)
+  jobs = [[raw_dir, processed_dir, ticker] for ticker in raw_files
+          if overwrite or not os.path.isdir('%s/%s' % (processed_dir, ticker))]
+  if workers > 1:
+    pool = multiprocessing.Pool(workers)
+    pool.map(processTicker, jobs)
+    pool.close()
+    pool.join()
+  else:
+    for job in jobs:
+      processTicker(job)
 
 def main():
   parser = argparse.ArgumentParser()
@@ -109,8 +152,14 @@ def main():
                       help='output dir of level-1 feature files')
   parser.add_argument('--overwrite', action='store_true',
                       help='overwrite existing files in output dir')
+  parser.add_argument('--changed_ticker_file',
+                      help='if specified, only process tickers listed in '
+                           'this file (see run.py)')
+  parser.add_argument('--workers', type=int, default=1,
+                      help='number of processes for processing tickers')
   args = parser.parse_args()
-  processSf1Raw(args.raw_dir, args.processed_dir, args.overwrite)
+  processSf1Raw(args.raw_dir, args.processed_dir, args.overwrite,
+                args.changed_ticker_file, args.workers)
 
 if __name__ == '__main__':
   main()
@@ -5,6 +5,11 @@
     separated by tabs, with all dates being trading days
     and sorted in ascending order.
 
+    With --append, an existing projected file is appended with trading days
+    after its last date, if the raw data of that date is unchanged (in
+    particular adj_close, which changes upon splits and dividends);
+    otherwise it is rewritten.
+
     Example usage:
       ./project_yahoo.py --raw_dir=./raw
                          --trading_day_file=./trading_days
@@ -13,34 +18,68 @@
 
 import argparse
 import os
+import util
+
+# Returns the last date of projected_file if rows after it can be appended,
+# or None if the file should be rewritten.
+def getAppendDate(projected_file, data):
+  if not os.path.isfile(projected_file):
+    return None
+  last_line = util.readLastLine(projected_file)
+  if last_line is None:
+    return None
+  items = last_line.split('\t')
+  if data.get(items[0]) != items[1:]:
+    return None
+  return items[0]
+
+# Returns {date: [open, high, low, close, adj_close, volume]} of raw_file,
+# with values being raw strings.
+def readRawData(raw_file):
+  with open(raw_file, 'r') as fp:
+    lines = fp.read().splitlines()
+  assert len(lines) > 0
+  assert lines[0] == 'Date,Open,High,Low,Close,Volume,Adj Close'
+  data = dict()  # date => [open, high, low, close, adj_close, volume]
+  for i in range(1, len(lines)):
+    date, op, hi, lo, cl, vo, adjcl = lines[i].split(',')
+    assert date not in data
+    data[date] = [op, hi, lo, cl, adjcl, vo]
+  return data
+
+# Writes data of dates (trading days in data, ascending) to projected_file.
+def writeProjected(projected_file, dates, data, append):
+  last_date = getAppendDate(projected_file, data) if append else None
+  with open(projected_file, 'w' if last_date is None else 'a') as fp:
+    for date in dates:
+      if last_date is not None and date <= last_date:
+        continue
+      print >> fp, '%s\t%s' % (date, '\t'.join(data[date]))
 
 def projectYahoo(args):
   tickers = sorted([f[:f.rfind('.')] for f in os.listdir(args.raw_dir)
                     if f.endswith('.csv')])
+  tickers = util.filterTickers(tickers, args.changed_ticker_file)
   with open(args.trading_day_file, 'r') as fp:
     trading_days = fp.read().splitlines()
   trading_days.sort()
   for ticker in tickers:
-    with open('%s/%s.csv' % (args.raw_dir, ticker), 'r') as fp:
-      lines = fp.read().splitlines()
-    assert len(lines) > 0
-    assert lines[0] == 'Date,Open,High,Low,Close,Volume,Adj Close'
-    data = dict()  # date => [open, high, low, close, adj_close, volume]
-    for i in range(1, len(lines)):
-      date, op, hi, lo, cl, vo, adjcl = lines[i].split(',')
-      assert date not in data
-      data[date] = [op, hi, lo, cl, adjcl, vo]
-    with open('%s/%s' % (args.projected_dir, ticker), 'w') as fp:
-      for date in trading_days:
-        if date not in data:
-          continue
-        print >> fp, '%s\t%s' % (date, '\t'.join(data[date]))
+    data = readRawData('%s/%s.csv' % (args.raw_dir, ticker))
+    dates = [date for date in trading_days if date in data]
+    writeProjected('%s/%s' % (args.projected_dir, ticker), dates, data,
+                   args.append)
 
 def main():
   parser = argparse.ArgumentParser()
   parser.add_argument('--raw_dir', required=True)
   parser.add_argument('--trading_day_file', required=True)
   parser.add_argument('--projected_dir', required=True)
+  parser.add_argument('--changed_ticker_file',
+                      help='if specified, only process tickers listed in '
+                           'this file (see run.py)')
+  parser.add_argument('--append', action='store_true',
+                      help='append new dates to existing files, see '
+                           'module doc')
   projectYahoo(parser.parse_args())
 
 if __name__ == '__main__':
@@ -1,12 +1,24 @@
 #!/usr/bin/python2.7
 
 from config import *
+import compute_basic_features
+import compute_custom_feature
+import compute_custom_features
+import compute_hori_perc_features
+import compute_vert_gain_features
+import compute_vert_perc_2_features
+import compute_vert_perc_features
+import compute_window_features
+import get_sector_industry_feature
 import logging
 import os
 import util
 
 LOG_LEVEL = logging.INFO
 
+# Max number of independent steps to run concurrently.
+STEP_WORKERS = 4
+
 # Steps to execute on local machine, set to False to skip steps.
 DO_LOCAL = {
     'get_sf1_tickers': True,
@@ -19,7 +31,6 @@ DO_REMOTE = {
     'get_sf1_tickers': True,
     'get_eod_tickers': DO_EOD,
     'convert_sf1_raw': True,
-    'process_sf1_raw': True,
     'convert_eod_raw': DO_EOD,
     'process_eod_raw': DO_EOD,
     #'process_yahoo': True,
@@ -29,9 +40,11 @@ DO_REMOTE = {
     'filter_yahoo_dates': True,
     #'get_yahoo_holes': True,
 
-    'project_yahoo': True,
-    'adjust_yahoo': True,
-    'compute_rolling_window_volumed': True,
+    # Builds outputs of the price-derived steps below in one pass.
+    'build_yahoo_panel': True,
+    'project_yahoo': False,
+    'adjust_yahoo': False,
+    'compute_rolling_window_volumed': False,
     'compute_window_features': True,
 
     'compute_basic_features': True,
@@ -39,7 +52,8 @@ DO_REMOTE = {
     'compute_custom_features': True,
     'compute_custom_features_mrx': True,
 
-    'compute_yahoo_volumed_perc': True,
+    # Computed by compute_yahoo_rank_percs with volatility percs.
+    'compute_yahoo_volumed_perc': False,
 
     # Disabled vert perc and variants of hari perc features,
     # except for compute_hori_perc_features.
@@ -82,7 +96,7 @@ DO_REMOTE = {
     'get_membership': False,  # Files changed on 2015-10-01. Need to be fixed.
 
     'get_eod_gain_label': DO_EOD,
-    'get_yahoo_gain_label': True,
+    'get_yahoo_gain_label': False,  # Built by build_yahoo_panel.
     # Only yahoo offers market index history, so there is no eod version.
     #'process_market': True,
     #'get_market_adjprice': True,
@@ -113,9 +127,13 @@ DO_REMOTE = {
     'compute_yahoo_egain_feature': False,
 
     'compute_eod_volatility': DO_EOD,
-    'compute_yahoo_volatility': True,
+    'compute_yahoo_volatility': False,  # Built by build_yahoo_panel.
     'compute_eod_volatility_perc': DO_EOD,
-    'compute_yahoo_volatility_perc': True,
+    'compute_yahoo_volatility_perc': False,
+    'compute_yahoo_rank_percs': True,
+
+    # Enable together with use_feature_store in experiment configs.
+    'convert_feature_store': False,
 }
 
 if TEST:
@@ -145,100 +163,219 @@ def run(cmd, step=None):
 def markDone(step):
   util.markDone(step)
 
-############
-## Script ##
-############
-
-util.configLogging(LOG_LEVEL)
-
-# Prepare dirs.
-util.maybeMakeDirs([
-    SYMBOL_DIR,
-    TICKER_DIR,
-    YAHOO_SF1_DIR,
-    SF1_RAW_DIR,
-    SF1_PROCESSED_DIR,
-    EOD_RAW_DIR,
-    EOD_PROCESSED_DIR,
-    YAHOO_PROCESSED_DIR,
-    FEATURE_DIR,
-    FEATURE_INFO_DIR,
-    MISC_DIR,
-    EOD_PRICE_DIR,
-    EOD_ADJPRICE_DIR,
-    EOD_LOGPRICE_DIR,
-    EOD_LOGADJPRICE_DIR,
-    EOD_LOGADJVOLUME_DIR,
-    YAHOO_PRICE_DIR,
-    YAHOO_ADJPRICE_DIR,
-    YAHOO_LOGPRICE_DIR,
-    YAHOO_LOGADJPRICE_DIR,
-    YAHOO_LOGADJVOLUME_DIR,
-    YAHOO_HOLE_DIR,
-    YAHOO_PROJECTED_DIR,
-    YAHOO_ADJUSTED_DIR,
-    EOD_GAIN_DIR,
-    YAHOO_GAIN_DIR,
-    EOD_GAIN_LABEL_DIR,
-    YAHOO_GAIN_LABEL_DIR,
-    MARKET_PROCESSED_DIR,
-    MARKET_ADJPRICE_DIR,
-    MARKET_GAIN_DIR,
-    MARKET_PROJECTED_DIR,
-    EOD_EGAIN_DIR,
-    YAHOO_EGAIN_DIR,
-    EOD_EGAIN_LABEL_DIR,
-    YAHOO_EGAIN_LABEL_DIR,
-])
-
-if logDo('get_sf1_tickers'):
+# Returns arg restricting a step to tickers (see step()), or '' if tickers
+# is None (for all tickers).
+def getTickerArg(step, tickers):
+  if tickers is None:
+    return ''
+  ticker_file = '%s/CHANGED-%s' % (SYMBOL_DIR, step)
+  with open(ticker_file, 'w') as fp:
+    for ticker in tickers:
+      print >> fp, ticker
+  return '--changed_ticker_file=%s' % ticker_file
+
+# Runs an incremental step (see step()) and returns whether it ran.
+def runIncrementalStep(step, function, inputs, outputs, ticker_inputs,
+                       append_inputs):
+  if not DO.get(step, False):
+    logging.info('skipping step: %s' % step)
+    return False
+  previous = util.readManifest(step)
+  manifest = util.buildManifest(inputs, [inputs, outputs], previous)
+  tickers = None
+  if util.checkDone(step):
+    if previous is None:
+      # Done before manifests were recorded, assume up to date.
+      if not DRY_RUN:
+        util.writeManifest(step, manifest)
+      logging.info('skipping step: %s' % step)
+      return False
+    tickers = util.getChangedTickers(previous, manifest, ticker_inputs,
+                                     append_inputs)
+    if tickers is not None and len(tickers) == 0:
+      logging.info('skipping step: %s (inputs unchanged)' % step)
+      return False
+    if tickers is None:
+      logging.info('rerunning step: %s (inputs changed)' % step)
+    else:
+      logging.info('rerunning step: %s (%d tickers changed)' % (
+          step, len(tickers)))
+  else:
+    logging.info('running step: %s' % step)
+  function(tickers)
+  if not DRY_RUN:
+    util.writeManifest(step, manifest)
+  return True
+
+# Steps in serial order, each being [name, function, inputs, outputs],
+# see step().
+STEPS = []
+# Names of incremental steps, see step().
+INCREMENTAL_STEPS = set()
+# Names of steps reading outputs of each step, see util.getStepReaders().
+READERS = dict()
+
+# Clears DONE markers of full recompute steps reading outputs of the
+# specified step, which just ran, so that they rerun on its new outputs (and
+# in turn clear their readers).  Incremental steps find changed inputs by
+# themselves.
+def clearReaders(step):
+  for reader in READERS[step]:
+    if reader in INCREMENTAL_STEPS or not util.checkDone(reader):
+      continue
+    logging.info('clearing step: %s (%s ran)' % (reader, step))
+    if not DRY_RUN:
+      util.clearDone(reader)
+
+# Decorator registering a step that runs the decorated function if logDo()
+# allows, with paths of its inputs and outputs.
+#
+# If ticker_inputs (patterns of per-ticker input files like
+# '/dir/{ticker}.csv') is specified, the step is incremental: a manifest of
+# its input files (see util.buildManifest()) is recorded upon each run, and
+# the step is rerun even if done when its inputs change, calling the
+# decorated function with the changed tickers (see util.getChangedTickers())
+# or None for all tickers.  Appending to files of append_inputs (eg, new
+# trading days) does not change any ticker.
+#
+# Other steps are full recomputes, run when not done.  Notably these are
+# convert_sf1_raw (SF1 comes as one file of all tickers; it only skips
+# tickers already processed), get_yahoo_trading_days, get_yahoo_holes, and
+# steps computing features and labels.  Whenever a step runs, full recompute
+# steps reading its outputs are no longer done (see clearReaders()).
+def step(name, inputs, outputs, ticker_inputs=None, append_inputs=None):
+  def register(function):
+    def runStep():
+      if ticker_inputs:
+        if not runIncrementalStep(name, function, inputs, outputs,
+                                  ticker_inputs, append_inputs):
+          return False
+      elif logDo(name):
+        function()
+      else:
+        return False
+      clearReaders(name)
+    STEPS.append([name, runStep, inputs, outputs])
+    if ticker_inputs:
+      INCREMENTAL_STEPS.add(name)
+    return function
+  return register
+
+###########
+## Steps ##
+###########
+
+# Each step declares paths it reads and writes, see util.runSteps().  Steps
+# are defined in a valid serial order, and each step waits for earlier steps
+# that write what it reads, or read or write what it writes.  Steps under
+# FEATURE_DIR and FEATURE_INFO_DIR declare the features they read and write
+# rather than the whole dirs, so that steps of different features can run
+# concurrently.
+
+# Returns dirs of features.
+def getFeatureDirs(features):
+  return ['%s/%s' % (FEATURE_DIR, feature) for feature in features]
+
+# Returns info files of features.
+def getFeatureInfoFiles(features):
+  return ['%s/%s' % (FEATURE_INFO_DIR, feature) for feature in features]
+
+# Returns names of features of basic features.
+def getBasicFeatures(use_mrx):
+  return [feature for _, _, feature
+          in compute_basic_features.getFeatures(use_mrx)]
+
+# Returns [inputs, outputs] of custom features as feature names.
+def getCustomFeatures(use_mrx):
+  inputs, outputs = [], []
+  for target, formula in compute_custom_features.getItems(use_mrx):
+    inputs += compute_custom_feature.SYMBOL_PATTERN.findall(formula)
+    outputs.append(target)
+  return [sorted(set(inputs)), outputs]
+
+# Returns [inputs, outputs] of hori perc features as paths.
+def getHoriPercPaths(suffix, use_mrx=False):
+  features = compute_hori_perc_features.getFeatures(suffix, use_mrx)
+  return [getFeatureDirs([feature for feature, _ in features]),
+          getFeatureDirs([output for _, output in features])]
+
+@step('get_sf1_tickers',
+      [RAW_SF1_FILE, SF1_INFO_FILE],
+      [SF1_TICKER_FILE])
+def getSf1Tickers():
   cmd = '%s/get_sf1_tickers.py --sf1_file=%s --info_file=%s --ticker_file=%s' % (
       CODE_DIR, RAW_SF1_FILE, SF1_INFO_FILE, SF1_TICKER_FILE)
   run(cmd, 'get_sf1_tickers')
 
-if logDo('get_eod_tickers'):
+@step('get_eod_tickers',
+      [RAW_EOD_FILE],
+      [EOD_TICKER_FILE])
+def getEodTickers():
   cmd = '%s/get_eod_tickers.py --eod_file=%s --ticker_file=%s' % (
       CODE_DIR, RAW_EOD_FILE, EOD_TICKER_FILE)
   run(cmd, 'get_eod_tickers')
 
-if logDo('download_yahoo'):
-  cmd = '%s/download_yahoo.py --ticker_file=%s --download_dir=%s' % (
-      CODE_DIR, SF1_TICKER_FILE, YAHOO_SF1_DIR)
+@step('download_yahoo',
+      [SF1_TICKER_FILE],
+      [YAHOO_SF1_DIR])
+def downloadYahoo():
+  cmd = ('%s/download_yahoo.py --ticker_file=%s --download_dir=%s '
+         '--progress_file=%s/PROGRESS-download_yahoo '
+         '--failed_file=%s/FAILED-download_yahoo' % (
+      CODE_DIR, SF1_TICKER_FILE, YAHOO_SF1_DIR, SYMBOL_DIR, SYMBOL_DIR))
+  if YAHOO_APPEND:
+    cmd += ' --append'
   run(cmd, 'download_yahoo')
 
-if logDo('convert_sf1_raw'):
+# Converts sf1 directly into processed files in one pass (see
+# convert_sf1_raw.py), process_sf1_raw.py is not needed.
+@step('convert_sf1_raw',
+      [RAW_SF1_FILE, SF1_INDICATOR_FILE],
+      [SF1_PROCESSED_DIR])
+def convertSf1Raw():
   cmd = ('%s/convert_sf1_raw.py --sf1_file=%s --indicator_file=%s '
-         '--raw_dir=%s' % (
-             CODE_DIR, RAW_SF1_FILE, SF1_INDICATOR_FILE, SF1_RAW_DIR))
+         '--processed_dir=%s' % (
+             CODE_DIR, RAW_SF1_FILE, SF1_INDICATOR_FILE, SF1_PROCESSED_DIR))
   run(cmd, 'convert_sf1_raw')
 
-if logDo('process_sf1_raw'):
-  cmd = '%s/process_sf1_raw.py --raw_dir=%s --processed_dir=%s' % (
-      CODE_DIR, SF1_RAW_DIR, SF1_PROCESSED_DIR)
-  run(cmd, 'process_sf1_raw')
-
-if logDo('convert_eod_raw'):
+@step('convert_eod_raw',
+      [RAW_EOD_FILE],
+      [EOD_RAW_DIR])
+def convertEodRaw():
   cmd = '%s/convert_eod_raw.py --eod_file=%s --raw_dir=%s' % (
       CODE_DIR, RAW_EOD_FILE, EOD_RAW_DIR)
   run(cmd, 'convert_eod_raw')
 
-if logDo('process_eod_raw'):
+@step('process_eod_raw',
+      [EOD_RAW_DIR, SF1_TICKER_FILE],
+      [EOD_PROCESSED_DIR])
+def processEodRaw():
   cmd = ('%s/process_eod_raw.py --raw_dir=%s --ticker_file=%s '
          '--processed_dir=%s' % (
              CODE_DIR, EOD_RAW_DIR, SF1_TICKER_FILE, EOD_PROCESSED_DIR))
   run(cmd, 'process_eod_raw')
 
-if logDo('process_yahoo'):
+@step('process_yahoo',
+      [YAHOO_SF1_DIR],
+      [YAHOO_PROCESSED_DIR])
+def processYahoo():
   cmd = '%s/process_yahoo.py --raw_dir=%s --processed_dir=%s' % (
       CODE_DIR, YAHOO_SF1_DIR, YAHOO_PROCESSED_DIR)
   run(cmd, 'process_yahoo')
 
-if logDo('get_yahoo_trading_days'):
+@step('get_yahoo_trading_days',
+      [YAHOO_SF1_DIR],
+      [YAHOO_TRADING_DAY_FILE])
+def getYahooTradingDays():
   cmd = '%s/get_yahoo_trading_days.py --raw_dir=%s --output_file=%s' % (
       CODE_DIR, YAHOO_SF1_DIR, YAHOO_TRADING_DAY_FILE)
   run(cmd, 'get_yahoo_trading_days')
 
-if logDo('filter_yahoo_dates'):
+@step('filter_yahoo_dates',
+      [YAHOO_TRADING_DAY_FILE],
+      ['%s%d' % (YAHOO_DOW_PREFIX, i) for i in [1, 2, 3, 4, 5]]
+      + ['%s1' % YAHOO_DOM_PREFIX])
+def filterYahooDates():
   for i in [1, 2, 3, 4, 5]:
     cmd = ('%s/filter_dates.py --input_file=%s --nth_day_of_week=%d '
            '--output_file=%s%d' % (
@@ -249,24 +386,67 @@ if logDo('filter_yahoo_dates'):
       CODE_DIR, YAHOO_TRADING_DAY_FILE, YAHOO_DOM_PREFIX))
   run(cmd, 'filter_yahoo_dates')
 
-if logDo('get_yahoo_holes'):
+@step('get_yahoo_holes',
+      [YAHOO_SF1_DIR, YAHOO_TRADING_DAY_FILE],
+      [YAHOO_HOLE_DIR])
+def getYahooHoles():
   cmd = ('%s/get_yahoo_holes.py --raw_dir=%s --trading_day_file=%s '
          '--output_dir=%s' % (
       CODE_DIR, YAHOO_SF1_DIR, YAHOO_TRADING_DAY_FILE, YAHOO_HOLE_DIR))
   run(cmd, 'get_yahoo_holes')
 
-if logDo('project_yahoo'):
+@step('build_yahoo_panel',
+      [YAHOO_SF1_DIR, YAHOO_TRADING_DAY_FILE],
+      [YAHOO_PROJECTED_DIR, YAHOO_ADJUSTED_DIR, YAHOO_GAIN_LABEL_DIR]
+      + ['%s_%d' % (YAHOO_VOLATILITY_PREFIX, k) for k in VOLATILITY_K_LIST],
+      ['%s/{ticker}.csv' % YAHOO_SF1_DIR],
+      # New trading days only matter to tickers with new rows, which are
+      # changed anyway.  A ticker whose existing row turns into a trading
+      # day is caught up by --append upon its next change.
+      [YAHOO_TRADING_DAY_FILE] if YAHOO_APPEND else None)
+def buildYahooPanel(tickers):
+  cmd = ('%s/build_yahoo_panel.py --raw_dir=%s --trading_day_file=%s '
+         '--projected_dir=%s --adjusted_dir=%s --volumed_k=%d '
+         '--volatility_prefix=%s --volatility_k=%s --gain_label_k=%d '
+         '--gain_label_dir=%s %s' % (
+      CODE_DIR, YAHOO_SF1_DIR, YAHOO_TRADING_DAY_FILE, YAHOO_PROJECTED_DIR,
+      YAHOO_ADJUSTED_DIR, VOLUMED_K, YAHOO_VOLATILITY_PREFIX,
+      ','.join([str(k) for k in VOLATILITY_K_LIST]), PREDICTION_WINDOW,
+      YAHOO_GAIN_LABEL_DIR, getTickerArg('build_yahoo_panel', tickers)))
+  if YAHOO_APPEND:
+    cmd += ' --append'
+  run(cmd, 'build_yahoo_panel')
+
+@step('project_yahoo',
+      [YAHOO_SF1_DIR, YAHOO_TRADING_DAY_FILE],
+      [YAHOO_PROJECTED_DIR],
+      ['%s/{ticker}.csv' % YAHOO_SF1_DIR],
+      [YAHOO_TRADING_DAY_FILE] if YAHOO_APPEND else None)
+def projectYahoo(tickers):
   cmd = ('%s/project_yahoo.py --raw_dir=%s --trading_day_file=%s '
-         '--projected_dir=%s' % (
-      CODE_DIR, YAHOO_SF1_DIR, YAHOO_TRADING_DAY_FILE, YAHOO_PROJECTED_DIR))
+         '--projected_dir=%s %s' % (
+      CODE_DIR, YAHOO_SF1_DIR, YAHOO_TRADING_DAY_FILE, YAHOO_PROJECTED_DIR,
+      getTickerArg('project_yahoo', tickers)))
+  if YAHOO_APPEND:
+    cmd += ' --append'
   run(cmd, 'project_yahoo')
 
-if logDo('adjust_yahoo'):
-  cmd = '%s/adjust_yahoo.py --yahoo_dir=%s --output_dir=%s' % (
-      CODE_DIR, YAHOO_PROJECTED_DIR, YAHOO_ADJUSTED_DIR)
+@step('adjust_yahoo',
+      [YAHOO_PROJECTED_DIR],
+      [YAHOO_ADJUSTED_DIR],
+      ['%s/{ticker}' % YAHOO_PROJECTED_DIR])
+def adjustYahoo(tickers):
+  cmd = '%s/adjust_yahoo.py --yahoo_dir=%s --output_dir=%s %s' % (
+      CODE_DIR, YAHOO_PROJECTED_DIR, YAHOO_ADJUSTED_DIR,
+      getTickerArg('adjust_yahoo', tickers))
+  if YAHOO_APPEND:
+    cmd += ' --append'
   run(cmd, 'adjust_yahoo')
 
-if logDo('compute_rolling_window_volumed'):
+@step('compute_rolling_window_volumed',
+      ['%s/volumed' % YAHOO_ADJUSTED_DIR],
+      ['%s/volumed_mean_%d' % (YAHOO_ADJUSTED_DIR, VOLUMED_K)])
+def computeRollingWindowVolumed():
   output_dir = '%s/volumed_mean_%d' % (YAHOO_ADJUSTED_DIR, VOLUMED_K)
   util.maybeMakeDir(output_dir)
   cmd = ('%s/compute_rolling_window_feature.py --input_dir=%s/volumed '
@@ -274,41 +454,61 @@ if logDo('compute_rolling_window_volumed'):
       CODE_DIR, YAHOO_ADJUSTED_DIR, VOLUMED_K, output_dir))
   run(cmd, 'compute_rolling_window_volumed')
 
-if logDo('compute_window_features'):
+@step('compute_window_features',
+      ['%s/close' % YAHOO_ADJUSTED_DIR, '%s/volume' % YAHOO_ADJUSTED_DIR],
+      getFeatureDirs(compute_window_features.getFeatures()))
+def computeWindowFeatures():
   cmd = ('%s/compute_window_features.py --adjusted_dir=%s '
-         '--feature_base_dir=%s --computer=%s/compute_window_feature.py') % (
-      CODE_DIR, YAHOO_ADJUSTED_DIR, FEATURE_DIR, CODE_DIR)
+         '--feature_base_dir=%s') % (
+      CODE_DIR, YAHOO_ADJUSTED_DIR, FEATURE_DIR)
   run(cmd, 'compute_window_features')
 
-if logDo('compute_basic_features'):
+@step('compute_basic_features',
+      [SF1_PROCESSED_DIR, SF1_TICKER_FILE],
+      getFeatureDirs(getBasicFeatures(False))
+      + getFeatureInfoFiles(getBasicFeatures(False)))
+def computeBasicFeatures():
   cmd = ('%s/compute_basic_features.py --processed_dir=%s --ticker_file=%s '
-         '--feature_base_dir=%s --info_dir=%s '
-         '--computer=%s/compute_basic_feature.py') % (
+         '--feature_base_dir=%s --info_dir=%s') % (
       CODE_DIR, SF1_PROCESSED_DIR, SF1_TICKER_FILE,
-      FEATURE_DIR, FEATURE_INFO_DIR, CODE_DIR)
+      FEATURE_DIR, FEATURE_INFO_DIR)
   run(cmd, 'compute_basic_features')
 
-if logDo('compute_basic_features_mrx'):
+@step('compute_basic_features_mrx',
+      [SF1_PROCESSED_DIR, SF1_TICKER_FILE],
+      getFeatureDirs(getBasicFeatures(True))
+      + getFeatureInfoFiles(getBasicFeatures(True)))
+def computeBasicFeaturesMrx():
   cmd = ('%s/compute_basic_features.py --processed_dir=%s --ticker_file=%s '
-         '--feature_base_dir=%s --info_dir=%s '
-         '--computer=%s/compute_basic_feature.py --use_mrx') % (
+         '--feature_base_dir=%s --info_dir=%s --use_mrx') % (
       CODE_DIR, SF1_PROCESSED_DIR, SF1_TICKER_FILE,
-      FEATURE_DIR, FEATURE_INFO_DIR, CODE_DIR)
+      FEATURE_DIR, FEATURE_INFO_DIR)
   run(cmd, 'compute_basic_features_mrx')
 
-if logDo('compute_custom_features'):
+@step('compute_custom_features',
+      getFeatureDirs(getCustomFeatures(False)[0]) + [SF1_TICKER_FILE],
+      getFeatureDirs(getCustomFeatures(False)[1])
+      + getFeatureInfoFiles(getCustomFeatures(False)[1]))
+def computeCustomFeatures():
   cmd = ('%s/compute_custom_features.py --feature_base_dir=%s --ticker_file=%s '
-         '--info_dir=%s --computer=%s/compute_custom_feature.py') % (
-      CODE_DIR, FEATURE_DIR, SF1_TICKER_FILE, FEATURE_INFO_DIR, CODE_DIR)
+         '--info_dir=%s') % (
+      CODE_DIR, FEATURE_DIR, SF1_TICKER_FILE, FEATURE_INFO_DIR)
   run(cmd, 'compute_custom_features')
 
-if logDo('compute_custom_features_mrx'):
+@step('compute_custom_features_mrx',
+      getFeatureDirs(getCustomFeatures(True)[0]) + [SF1_TICKER_FILE],
+      getFeatureDirs(getCustomFeatures(True)[1])
+      + getFeatureInfoFiles(getCustomFeatures(True)[1]))
+def computeCustomFeaturesMrx():
   cmd = ('%s/compute_custom_features.py --feature_base_dir=%s --ticker_file=%s '
-         '--info_dir=%s --computer=%s/compute_custom_feature.py --use_mrx') % (
-      CODE_DIR, FEATURE_DIR, SF1_TICKER_FILE, FEATURE_INFO_DIR, CODE_DIR)
+         '--info_dir=%s --use_mrx') % (
+      CODE_DIR, FEATURE_DIR, SF1_TICKER_FILE, FEATURE_INFO_DIR)
   run(cmd, 'compute_custom_features_mrx')
 
-if logDo('compute_yahoo_volumed_perc'):
+@step('compute_yahoo_volumed_perc',
+      ['%s/volumed_mean_%d' % (YAHOO_ADJUSTED_DIR, VOLUMED_K)],
+      ['%s/volumed_mean_%d_perc' % (YAHOO_ADJUSTED_DIR, VOLUMED_K)])
+def computeYahooVolumedPerc():
   # TODO: move this to config.
   input_dir = '%s/volumed_mean_%d' % (YAHOO_ADJUSTED_DIR, VOLUMED_K)
   output_dir = '%s/volumed_mean_%d_perc' % (YAHOO_ADJUSTED_DIR, VOLUMED_K)
@@ -317,7 +517,14 @@ if logDo('compute_yahoo_volumed_perc'):
          '--output_dir=%s' % (CODE_DIR, input_dir, output_dir))
   run(cmd, 'compute_yahoo_volumed_perc')
 
-if logDo('compute_vert_perc_features'):
+@step('compute_vert_perc_features',
+      getFeatureDirs(compute_vert_perc_features.SF1_ITEMS)
+      + ['%s/%s' % (YAHOO_DIR, item)
+         for item in compute_vert_perc_features.PRICE_ITEMS]
+      + [SF1_TICKER_FILE],
+      getFeatureDirs(compute_vert_perc_features.getAllTargets())
+      + getFeatureInfoFiles(compute_vert_perc_features.getAllTargets()))
+def computeVertPercFeatures():
   cmd = ('%s/compute_vert_perc_features.py --sf1_input_dir=%s --price_input_dir=%s '
          '--feature_base_dir=%s --ticker_file=%s --info_dir=%s '
          '--computer=%s/compute_vert_perc_feature.py') % (
@@ -325,7 +532,14 @@ if logDo('compute_vert_perc_features'):
       FEATURE_INFO_DIR, CODE_DIR)
   run(cmd, 'compute_vert_perc_features')
 
-if logDo('compute_vert_perc_2_features'):
+@step('compute_vert_perc_2_features',
+      getFeatureDirs(compute_vert_perc_2_features.SF1_ITEMS)
+      + ['%s/%s' % (YAHOO_DIR, item)
+         for item in compute_vert_perc_2_features.PRICE_ITEMS]
+      + [SF1_TICKER_FILE],
+      getFeatureDirs(compute_vert_perc_2_features.getAllTargets())
+      + getFeatureInfoFiles(compute_vert_perc_2_features.getAllTargets()))
+def computeVertPerc2Features():
   cmd = ('%s/compute_vert_perc_2_features.py --sf1_input_dir=%s --price_input_dir=%s '
          '--feature_base_dir=%s --ticker_file=%s --info_dir=%s '
          '--computer=%s/compute_vert_perc_2_feature.py') % (
@@ -333,52 +547,76 @@ if logDo('compute_vert_perc_2_features'):
       FEATURE_INFO_DIR, CODE_DIR)
   run(cmd, 'compute_vert_perc_2_features')
 
-if logDo('compute_hori_perc_features'):
+@step('compute_hori_perc_features',
+      getHoriPercPaths('_hp')[0],
+      getHoriPercPaths('_hp')[1])
+def computeHoriPercFeatures():
   cmd = ('%s/compute_hori_perc_features.py --feature_base_dir=%s '
-         '--suffix=_hp --computer=%s/compute_hori_perc_feature.py') % (
-      CODE_DIR, FEATURE_DIR, CODE_DIR)
+         '--suffix=_hp') % (
+      CODE_DIR, FEATURE_DIR)
   run(cmd, 'compute_hori_perc_features')
 
-if logDo('compute_hori_perc_features_mrx'):
+@step('compute_hori_perc_features_mrx',
+      getHoriPercPaths('_hp', True)[0],
+      getHoriPercPaths('_hp', True)[1])
+def computeHoriPercFeaturesMrx():
   cmd = ('%s/compute_hori_perc_features.py --feature_base_dir=%s '
-         '--suffix=_hp --computer=%s/compute_hori_perc_feature.py --use_mrx') % (
-      CODE_DIR, FEATURE_DIR, CODE_DIR)
+         '--suffix=_hp --use_mrx') % (
+      CODE_DIR, FEATURE_DIR)
   run(cmd, 'compute_hori_perc_features_mrx')
 
-if logDo('compute_hori_rank_perc_features'):
+@step('compute_hori_rank_perc_features',
+      getHoriPercPaths('_hpr')[0],
+      getHoriPercPaths('_hpr')[1])
+def computeHoriRankPercFeatures():
   cmd = ('%s/compute_hori_perc_features.py --feature_base_dir=%s --rank '
-         '--suffix=_hpr --computer=%s/compute_hori_perc_feature.py') % (
-      CODE_DIR, FEATURE_DIR, CODE_DIR)
+         '--suffix=_hpr') % (
+      CODE_DIR, FEATURE_DIR)
   run(cmd, 'compute_hori_rank_perc_features')
 
-if logDo('get_sector_map'):
+@step('get_sector_map',
+      [SF1_TICKER_FILE, SF1_INFO_FILE],
+      [SECTOR_MAP_FILE, SECTOR_STATS_FILE])
+def getSectorMap():
   cmd = ('%s/get_sector_industry_map.py --ticker_file=%s --info_file=%s '
          '--sector --map_file=%s --stats_file=%s' % (
       CODE_DIR, SF1_TICKER_FILE, SF1_INFO_FILE,
       SECTOR_MAP_FILE, SECTOR_STATS_FILE))
   run(cmd, 'get_sector_map')
 
-if logDo('get_industry_map'):
+@step('get_industry_map',
+      [SF1_TICKER_FILE, SF1_INFO_FILE],
+      [INDUSTRY_MAP_FILE, INDUSTRY_STATS_FILE])
+def getIndustryMap():
   cmd = ('%s/get_sector_industry_map.py --ticker_file=%s --info_file=%s '
          '--industry --map_file=%s --stats_file=%s' % (
       CODE_DIR, SF1_TICKER_FILE, SF1_INFO_FILE,
       INDUSTRY_MAP_FILE, INDUSTRY_STATS_FILE))
   run(cmd, 'get_industry_map')
 
-if logDo('compute_hori_perc_features_sector'):
+@step('compute_hori_perc_features_sector',
+      getHoriPercPaths('_hp_sector')[0] + [SECTOR_MAP_FILE],
+      getHoriPercPaths('_hp_sector')[1])
+def computeHoriPercFeaturesSector():
   cmd = ('%s/compute_hori_perc_features.py --feature_base_dir=%s --suffix=_hp_sector '
-         '--group_map_file=%s --computer=%s/compute_hori_perc_feature.py') % (
-      CODE_DIR, FEATURE_DIR, SECTOR_MAP_FILE, CODE_DIR)
+         '--group_map_file=%s') % (
+      CODE_DIR, FEATURE_DIR, SECTOR_MAP_FILE)
   run(cmd, 'compute_hori_perc_features_sector')
 
-if logDo('compute_hori_rank_perc_features_sector'):
+@step('compute_hori_rank_perc_features_sector',
+      getHoriPercPaths('_hpr_sector')[0] + [SECTOR_MAP_FILE],
+      getHoriPercPaths('_hpr_sector')[1])
+def computeHoriRankPercFeaturesSector():
   cmd = ('%s/compute_hori_perc_features.py --feature_base_dir=%s '
-         '--group_map_file=%s --rank --suffix=_hpr_sector '
-         '--computer=%s/compute_hori_perc_feature.py') % (
-      CODE_DIR, FEATURE_DIR, SECTOR_MAP_FILE, CODE_DIR)
+         '--group_map_file=%s --rank --suffix=_hpr_sector') % (
+      CODE_DIR, FEATURE_DIR, SECTOR_MAP_FILE)
   run(cmd, 'compute_hori_rank_perc_features_sector')
 
-if logDo('compute_vert_gain_features'):
+@step('compute_vert_gain_features',
+      getFeatureDirs(compute_vert_gain_features.SF1_ITEMS) + [SF1_TICKER_FILE],
+      getFeatureDirs(compute_vert_gain_features.getAllTargets())
+      + getFeatureInfoFiles(compute_vert_gain_features.getAllTargets()))
+def computeVertGainFeatures():
   cmd = ('%s/compute_vert_gain_features.py --sf1_input_dir=%s '
          '--feature_base_dir=%s --ticker_file=%s --info_dir=%s '
          '--computer=%s/compute_vert_gain_feature.py') % (
@@ -386,84 +624,128 @@ if logDo('compute_vert_gain_features'):
       FEATURE_INFO_DIR, CODE_DIR)
   run(cmd, 'compute_vert_gain_features')
 
-if logDo('get_feature_stats'):
+@step('get_feature_stats',
+      [FEATURE_INFO_DIR],
+      [FEATURE_STATS_FILE])
+def getFeatureStats():
   cmd = '%s/get_feature_stats.py --info_dir=%s --stats_file=%s' % (
       CODE_DIR, FEATURE_INFO_DIR, FEATURE_STATS_FILE)
   run(cmd, 'get_feature_stats')
 
-if logDo('get_sector_feature'):
+@step('get_sector_feature',
+      [SECTOR_MAP_FILE],
+      # Dirs of names (eg, sector_<name>) are only known from the map.
+      getFeatureDirs(['%s*' % get_sector_industry_feature.SECTOR_PREFIX]))
+def getSectorFeature():
   cmd = ('%s/get_sector_industry_feature.py --map_file=%s --sector '
          '--output_base_dir=%s' % (
       CODE_DIR, SECTOR_MAP_FILE, FEATURE_DIR))
   run(cmd, 'get_sector_feature')
 
-if logDo('get_industry_feature'):
+@step('get_industry_feature',
+      [INDUSTRY_MAP_FILE],
+      # Dirs of names (eg, industry_<name>) are only known from the map.
+      getFeatureDirs(['%s*' % get_sector_industry_feature.INDUSTRY_PREFIX]))
+def getIndustryFeature():
   cmd = ('%s/get_sector_industry_feature.py --map_file=%s --industry '
          '--output_base_dir=%s' % (
       CODE_DIR, INDUSTRY_MAP_FILE, FEATURE_DIR))
   run(cmd, 'get_industry_feature')
 
-if logDo('get_eod_price'):
+@step('get_eod_price',
+      [EOD_PROCESSED_DIR],
+      [EOD_PRICE_DIR])
+def getEodPrice():
   cmd = ('%s/get_price_volume.py --processed_dir=%s --column=price '
          '--output_dir=%s' % (
       CODE_DIR, EOD_PROCESSED_DIR, EOD_PRICE_DIR))
   run(cmd, 'get_eod_price')
 
-if logDo('get_eod_adjprice'):
+@step('get_eod_adjprice',
+      [EOD_PROCESSED_DIR],
+      [EOD_ADJPRICE_DIR])
+def getEodAdjprice():
   cmd = ('%s/get_price_volume.py --processed_dir=%s --column=adjprice '
          '--output_dir=%s' % (
       CODE_DIR, EOD_PROCESSED_DIR, EOD_ADJPRICE_DIR))
   run(cmd, 'get_eod_adjprice')
 
-if logDo('get_eod_logprice'):
+@step('get_eod_logprice',
+      [EOD_PROCESSED_DIR],
+      [EOD_LOGPRICE_DIR])
+def getEodLogprice():
   cmd = ('%s/get_price_volume.py --processed_dir=%s --column=price '
          '--take_log --output_dir=%s' % (
       CODE_DIR, EOD_PROCESSED_DIR, EOD_LOGPRICE_DIR))
   run(cmd, 'get_eod_logprice')
 
-if logDo('get_eod_logadjprice'):
+@step('get_eod_logadjprice',
+      [EOD_PROCESSED_DIR],
+      [EOD_LOGADJPRICE_DIR])
+def getEodLogadjprice():
   cmd = ('%s/get_price_volume.py --processed_dir=%s --column=adjprice '
          '--take_log --output_dir=%s' % (
       CODE_DIR, EOD_PROCESSED_DIR, EOD_LOGADJPRICE_DIR))
   run(cmd, 'get_eod_logadjprice')
 
-if logDo('get_eod_logadjvolume'):
+@step('get_eod_logadjvolume',
+      [EOD_PROCESSED_DIR],
+      [EOD_LOGADJVOLUME_DIR])
+def getEodLogadjvolume():
   cmd = ('%s/get_price_volume.py --processed_dir=%s --column=adjvolume '
          '--take_log --output_dir=%s' % (
       CODE_DIR, EOD_PROCESSED_DIR, EOD_LOGADJVOLUME_DIR))
   run(cmd, 'get_eod_logadjvolume')
 
-if logDo('get_yahoo_price'):
+@step('get_yahoo_price',
+      [YAHOO_PROCESSED_DIR],
+      [YAHOO_PRICE_DIR])
+def getYahooPrice():
   cmd = ('%s/get_price_volume.py --processed_dir=%s --column=price '
          '--output_dir=%s' % (
       CODE_DIR, YAHOO_PROCESSED_DIR, YAHOO_PRICE_DIR))
   run(cmd, 'get_yahoo_price')
 
-if logDo('get_yahoo_adjprice'):
+@step('get_yahoo_adjprice',
+      [YAHOO_PROCESSED_DIR],
+      [YAHOO_ADJPRICE_DIR])
+def getYahooAdjprice():
   cmd = ('%s/get_price_volume.py --processed_dir=%s --column=adjprice '
          '--output_dir=%s' % (
       CODE_DIR, YAHOO_PROCESSED_DIR, YAHOO_ADJPRICE_DIR))
   run(cmd, 'get_yahoo_adjprice')
 
-if logDo('get_yahoo_logprice'):
+@step('get_yahoo_logprice',
+      [YAHOO_PROCESSED_DIR],
+      [YAHOO_LOGPRICE_DIR])
+def getYahooLogprice():
   cmd = ('%s/get_price_volume.py --processed_dir=%s --column=price '
          '--take_log --output_dir=%s' % (
       CODE_DIR, YAHOO_PROCESSED_DIR, YAHOO_LOGPRICE_DIR))
   run(cmd, 'get_yahoo_logprice')
 
-if logDo('get_yahoo_logadjprice'):
+@step('get_yahoo_logadjprice',
+      [YAHOO_PROCESSED_DIR],
+      [YAHOO_LOGADJPRICE_DIR])
+def getYahooLogadjprice():
   cmd = ('%s/get_price_volume.py --processed_dir=%s --column=adjprice '
          '--take_log --output_dir=%s' % (
       CODE_DIR, YAHOO_PROCESSED_DIR, YAHOO_LOGADJPRICE_DIR))
   run(cmd, 'get_yahoo_logadjprice')
 
-if logDo('get_yahoo_logadjvolume'):
+@step('get_yahoo_logadjvolume',
+      [YAHOO_PROCESSED_DIR],
+      [YAHOO_LOGADJVOLUME_DIR])
+def getYahooLogadjvolume():
   cmd = ('%s/get_price_volume.py --processed_dir=%s --column=adjvolume '
          '--take_log --output_dir=%s' % (
       CODE_DIR, YAHOO_PROCESSED_DIR, YAHOO_LOGADJVOLUME_DIR))
   run(cmd, 'get_yahoo_logadjvolume')
 
-if logDo('get_eod_gain_feature'):
+@step('get_eod_gain_feature',
+      [EOD_ADJPRICE_DIR],
+      [EOD_GAIN_DIR])
+def getEodGainFeature():
   for k in GAIN_K_LIST:
     gain_dir = '%s/%d' % (EOD_GAIN_DIR, k)
     util.maybeMakeDir(gain_dir)
@@ -472,7 +754,10 @@ if logDo('get_eod_gain_feature'):
     run(cmd)
   markDone('get_eod_gain_feature')
 
-if logDo('get_yahoo_gain_feature'):
+@step('get_yahoo_gain_feature',
+      [YAHOO_ADJPRICE_DIR],
+      [YAHOO_GAIN_DIR])
+def getYahooGainFeature():
   for k in GAIN_K_LIST:
     gain_dir = '%s/%d' % (YAHOO_GAIN_DIR, k)
     util.maybeMakeDir(gain_dir)
@@ -481,7 +766,10 @@ if logDo('get_yahoo_gain_feature'):
     run(cmd)
   markDone('get_yahoo_gain_feature')
 
-if logDo('get_membership'):
+@step('get_membership',
+      [RAW_MISC_DIR],
+      [MEMBERSHIP_FILE])
+def getMembership():
   cmd = ('%s/get_membership.py --boy_file=%s/%s-boy.tsv '
          '--change_file=%s/%s-changes.tsv --membership_file=%s' % (
       CODE_DIR, RAW_MISC_DIR, MEMBERSHIP, RAW_MISC_DIR, MEMBERSHIP,
@@ -489,34 +777,52 @@ if logDo('get_membership'):
   run(cmd)
   markDone('get_membership')
 
-if logDo('get_eod_gain_label'):
+@step('get_eod_gain_label',
+      [EOD_ADJPRICE_DIR],
+      [EOD_GAIN_LABEL_DIR])
+def getEodGainLabel():
   cmd = '%s/compute_gain.py --price_dir=%s --k=%d --fill --gain_dir=%s' % (
       CODE_DIR, EOD_ADJPRICE_DIR, PREDICTION_WINDOW, EOD_GAIN_LABEL_DIR)
   run(cmd, 'get_eod_gain_label')
 
-if logDo('get_yahoo_gain_label'):
+@step('get_yahoo_gain_label',
+      [YAHOO_PROJECTED_DIR],
+      [YAHOO_GAIN_LABEL_DIR])
+def getYahooGainLabel():
   cmd = '%s/compute_open_gain.py --yahoo_dir=%s --k=%d --fill --gain_dir=%s' % (
       CODE_DIR, YAHOO_PROJECTED_DIR, PREDICTION_WINDOW, YAHOO_GAIN_LABEL_DIR)
   run(cmd, 'get_yahoo_gain_label')
 
-if logDo('process_market'):
+@step('process_market',
+      [YAHOO_MARKET_DIR],
+      [MARKET_PROCESSED_DIR])
+def processMarket():
   cmd = '%s/process_yahoo.py --raw_dir=%s --processed_dir=%s' % (
       CODE_DIR, YAHOO_MARKET_DIR, MARKET_PROCESSED_DIR)
   run(cmd, 'process_market')
 
-if logDo('get_market_adjprice'):
+@step('get_market_adjprice',
+      [MARKET_PROCESSED_DIR],
+      [MARKET_ADJPRICE_DIR])
+def getMarketAdjprice():
   cmd = ('%s/get_price_volume.py --processed_dir=%s --column=adjprice '
          '--output_dir=%s' % (
       CODE_DIR, MARKET_PROCESSED_DIR, MARKET_ADJPRICE_DIR))
   run(cmd, 'get_market_adjprice')
 
-if logDo('project_market'):
+@step('project_market',
+      [YAHOO_MARKET_DIR, YAHOO_TRADING_DAY_FILE],
+      [MARKET_PROJECTED_DIR])
+def projectMarket():
   cmd = ('%s/project_yahoo.py --raw_dir=%s --trading_day_file=%s '
          '--projected_dir=%s' % (
       CODE_DIR, YAHOO_MARKET_DIR, YAHOO_TRADING_DAY_FILE, MARKET_PROJECTED_DIR))
   run(cmd, 'project_market')
 
-if logDo('get_market_gain'):
+@step('get_market_gain',
+      [MARKET_PROJECTED_DIR],
+      [MARKET_GAIN_DIR])
+def getMarketGain():
   # For market we only do one version of gain (without mininum raw price)
   # and it will be used for both features and labels.  GAIN_K_LIST specify
   # all the windows for features, and [PREDICTION_WINDOW] specify those
@@ -531,7 +837,10 @@ if logDo('get_market_gain'):
     run(cmd)
   markDone('get_market_gain')
 
-if logDo('get_eod_egain_feature'):
+@step('get_eod_egain_feature',
+      [EOD_GAIN_DIR, MARKET_GAIN_DIR],
+      [EOD_EGAIN_DIR])
+def getEodEgainFeature():
   for k in GAIN_K_LIST:
     gain_dir = '%s/%d' % (EOD_GAIN_DIR, k)
     for market in MARKETS:
@@ -543,7 +852,10 @@ if logDo('get_eod_egain_feature'):
       run(cmd)
   markDone('get_eod_egain_feature')
 
-if logDo('get_yahoo_egain_feature'):
+@step('get_yahoo_egain_feature',
+      [YAHOO_GAIN_DIR, MARKET_GAIN_DIR],
+      [YAHOO_EGAIN_DIR])
+def getYahooEgainFeature():
   for k in GAIN_K_LIST:
     gain_dir = '%s/%d' % (YAHOO_GAIN_DIR, k)
     for market in MARKETS:
@@ -555,7 +867,10 @@ if logDo('get_yahoo_egain_feature'):
       run(cmd)
   markDone('get_yahoo_egain_feature')
 
-if logDo('get_eod_egain_label'):
+@step('get_eod_egain_label',
+      [EOD_GAIN_LABEL_DIR, MARKET_GAIN_DIR],
+      [EOD_EGAIN_LABEL_DIR])
+def getEodEgainLabel():
   for market in MARKETS:
     market_file = '%s/%d/%s' % (MARKET_GAIN_DIR, PREDICTION_WINDOW, market)
     egain_dir = '%s/%s' % (EOD_EGAIN_LABEL_DIR, market)
@@ -566,7 +881,10 @@ if logDo('get_eod_egain_label'):
     run(cmd)
   markDone('get_eod_egain_label')
 
-if logDo('get_yahoo_egain_label'):
+@step('get_yahoo_egain_label',
+      [YAHOO_GAIN_LABEL_DIR, MARKET_GAIN_DIR],
+      [YAHOO_EGAIN_LABEL_DIR])
+def getYahooEgainLabel():
   for market in MARKETS:
     market_file = '%s/%d/%s' % (MARKET_GAIN_DIR, PREDICTION_WINDOW, market)
     egain_dir = '%s/%s' % (YAHOO_EGAIN_LABEL_DIR, market)
@@ -577,7 +895,10 @@ if logDo('get_yahoo_egain_label'):
     run(cmd)
   markDone('get_yahoo_egain_label')
 
-if logDo('compute_eod_logprice_feature'):
+@step('compute_eod_logprice_feature',
+      [EOD_LOGPRICE_DIR],
+      ['%s/eod-logprice-%d' % (FEATURE_DIR, k) for k in LOGPRICE_K_LIST])
+def computeEodLogpriceFeature():
   for k in LOGPRICE_K_LIST:
     output_dir = '%s/eod-logprice-%d' % (FEATURE_DIR, k)
     util.maybeMakeDir(output_dir)
@@ -587,7 +908,10 @@ if logDo('compute_eod_logprice_feature'):
     run(cmd)
   markDone('compute_eod_logprice_feature')
 
-if logDo('compute_yahoo_logprice_feature'):
+@step('compute_yahoo_logprice_feature',
+      [YAHOO_LOGPRICE_DIR],
+      ['%s/yahoo-logprice-%d' % (FEATURE_DIR, k) for k in LOGPRICE_K_LIST])
+def computeYahooLogpriceFeature():
   for k in LOGPRICE_K_LIST:
     output_dir = '%s/yahoo-logprice-%d' % (FEATURE_DIR, k)
     util.maybeMakeDir(output_dir)
@@ -597,7 +921,10 @@ if logDo('compute_yahoo_logprice_feature'):
     run(cmd)
   markDone('compute_yahoo_logprice_feature')
 
-if logDo('compute_eod_logadjprice_feature'):
+@step('compute_eod_logadjprice_feature',
+      [EOD_LOGADJPRICE_DIR],
+      ['%s/eod-logadjprice-%d' % (FEATURE_DIR, k) for k in LOGADJPRICE_K_LIST])
+def computeEodLogadjpriceFeature():
   for k in LOGADJPRICE_K_LIST:
     output_dir = '%s/eod-logadjprice-%d' % (FEATURE_DIR, k)
     util.maybeMakeDir(output_dir)
@@ -607,7 +934,11 @@ if logDo('compute_eod_logadjprice_feature'):
     run(cmd)
   markDone('compute_eod_logadjprice_feature')
 
-if logDo('compute_yahoo_logadjprice_feature'):
+@step('compute_yahoo_logadjprice_feature',
+      [YAHOO_LOGADJPRICE_DIR],
+      ['%s/yahoo-logadjprice-%d' % (FEATURE_DIR, k)
+       for k in LOGADJPRICE_K_LIST])
+def computeYahooLogadjpriceFeature():
   for k in LOGADJPRICE_K_LIST:
     output_dir = '%s/yahoo-logadjprice-%d' % (FEATURE_DIR, k)
     util.maybeMakeDir(output_dir)
@@ -617,7 +948,11 @@ if logDo('compute_yahoo_logadjprice_feature'):
     run(cmd)
   markDone('compute_yahoo_logadjprice_feature')
 
-if logDo('compute_eod_logadjvolume_feature'):
+@step('compute_eod_logadjvolume_feature',
+      [EOD_LOGADJVOLUME_DIR],
+      ['%s/eod-logadjvolume-%d' % (FEATURE_DIR, k)
+       for k in LOGADJVOLUME_K_LIST])
+def computeEodLogadjvolumeFeature():
   for k in LOGADJVOLUME_K_LIST:
     output_dir = '%s/eod-logadjvolume-%d' % (FEATURE_DIR, k)
     util.maybeMakeDir(output_dir)
@@ -627,7 +962,11 @@ if logDo('compute_eod_logadjvolume_feature'):
     run(cmd)
   markDone('compute_eod_logadjvolume_feature')
 
-if logDo('compute_yahoo_logadjvolume_feature'):
+@step('compute_yahoo_logadjvolume_feature',
+      [YAHOO_LOGADJVOLUME_DIR],
+      ['%s/yahoo-logadjvolume-%d' % (FEATURE_DIR, k)
+       for k in LOGADJVOLUME_K_LIST])
+def computeYahooLogadjvolumeFeature():
   for k in LOGADJVOLUME_K_LIST:
     output_dir = '%s/yahoo-logadjvolume-%d' % (FEATURE_DIR, k)
     util.maybeMakeDir(output_dir)
@@ -637,7 +976,10 @@ if logDo('compute_yahoo_logadjvolume_feature'):
     run(cmd)
   markDone('compute_yahoo_logadjvolume_feature')
 
-if logDo('compute_eod_adjprice_feature'):
+@step('compute_eod_adjprice_feature',
+      [EOD_ADJPRICE_DIR],
+      ['%s/eod-adjprice-%d' % (FEATURE_DIR, k) for k in ADJPRICE_K_LIST])
+def computeEodAdjpriceFeature():
   for k in ADJPRICE_K_LIST:
     output_dir = '%s/eod-adjprice-%d' % (FEATURE_DIR, k)
     util.maybeMakeDir(output_dir)
@@ -647,7 +989,10 @@ if logDo('compute_eod_adjprice_feature'):
     run(cmd)
   markDone('compute_eod_adjprice_feature')
 
-if logDo('compute_yahoo_adjprice_feature'):
+@step('compute_yahoo_adjprice_feature',
+      [YAHOO_ADJPRICE_DIR],
+      ['%s/yahoo-adjprice-%d' % (FEATURE_DIR, k) for k in ADJPRICE_K_LIST])
+def computeYahooAdjpriceFeature():
   for k in ADJPRICE_K_LIST:
     output_dir = '%s/yahoo-adjprice-%d' % (FEATURE_DIR, k)
     util.maybeMakeDir(output_dir)
@@ -657,7 +1002,10 @@ if logDo('compute_yahoo_adjprice_feature'):
     run(cmd)
   markDone('compute_yahoo_adjprice_feature')
 
-if logDo('compute_eod_price_feature'):
+@step('compute_eod_price_feature',
+      [EOD_PRICE_DIR],
+      ['%s/eod-price-%d' % (FEATURE_DIR, k) for k in PRICE_K_LIST])
+def computeEodPriceFeature():
   for k in PRICE_K_LIST:
     output_dir = '%s/eod-price-%d' % (FEATURE_DIR, k)
     util.maybeMakeDir(output_dir)
@@ -667,7 +1015,10 @@ if logDo('compute_eod_price_feature'):
     run(cmd)
   markDone('compute_eod_price_feature')
 
-if logDo('compute_yahoo_price_feature'):
+@step('compute_yahoo_price_feature',
+      [YAHOO_PRICE_DIR],
+      ['%s/yahoo-price-%d' % (FEATURE_DIR, k) for k in PRICE_K_LIST])
+def computeYahooPriceFeature():
   for k in PRICE_K_LIST:
     output_dir = '%s/yahoo-price-%d' % (FEATURE_DIR, k)
     util.maybeMakeDir(output_dir)
@@ -677,7 +1028,10 @@ if logDo('compute_yahoo_price_feature'):
     run(cmd)
   markDone('compute_yahoo_price_feature')
 
-if logDo('compute_eod_gain_feature'):
+@step('compute_eod_gain_feature',
+      [EOD_GAIN_DIR],
+      ['%s/eod-gain-%d' % (FEATURE_DIR, k) for k in GAIN_K_LIST])
+def computeEodGainFeature():
   for k in GAIN_K_LIST:
     input_dir = '%s/%d' % (EOD_GAIN_DIR, k)
     output_dir = '%s/eod-gain-%d' % (FEATURE_DIR, k)
@@ -688,7 +1042,10 @@ if logDo('compute_eod_gain_feature'):
     run(cmd)
   markDone('compute_eod_gain_feature')
 
-if logDo('compute_yahoo_gain_feature'):
+@step('compute_yahoo_gain_feature',
+      [YAHOO_GAIN_DIR],
+      ['%s/yahoo-gain-%d' % (FEATURE_DIR, k) for k in GAIN_K_LIST])
+def computeYahooGainFeature():
   for k in GAIN_K_LIST:
     input_dir = '%s/%d' % (YAHOO_GAIN_DIR, k)
     output_dir = '%s/yahoo-gain-%d' % (FEATURE_DIR, k)
@@ -699,7 +1056,11 @@ if logDo('compute_yahoo_gain_feature'):
     run(cmd)
   markDone('compute_yahoo_gain_feature')
 
-if logDo('compute_eod_egain_feature'):
+@step('compute_eod_egain_feature',
+      [EOD_EGAIN_DIR],
+      ['%s/eod-%s-egain-%d' % (FEATURE_DIR, market, k)
+       for k in GAIN_K_LIST for market in MARKETS])
+def computeEodEgainFeature():
   for k in GAIN_K_LIST:
     for market in MARKETS:
       input_dir = '%s/%d/%s' % (EOD_EGAIN_DIR, k, market)
@@ -711,7 +1072,11 @@ if logDo('compute_eod_egain_feature'):
       run(cmd)
   markDone('compute_eod_egain_feature')
 
-if logDo('compute_yahoo_egain_feature'):
+@step('compute_yahoo_egain_feature',
+      [YAHOO_EGAIN_DIR],
+      ['%s/yahoo-%s-egain-%d' % (FEATURE_DIR, market, k)
+       for k in GAIN_K_LIST for market in MARKETS])
+def computeYahooEgainFeature():
   for k in GAIN_K_LIST:
     for market in MARKETS:
       input_dir = '%s/%d/%s' % (YAHOO_EGAIN_DIR, k, market)
@@ -723,7 +1088,10 @@ if logDo('compute_yahoo_egain_feature'):
       run(cmd)
   markDone('compute_yahoo_egain_feature')
 
-if logDo('compute_eod_volatility'):
+@step('compute_eod_volatility',
+      [EOD_ADJPRICE_DIR],
+      ['%s_%d' % (EOD_VOLATILITY_PREFIX, k) for k in VOLATILITY_K_LIST])
+def computeEodVolatility():
   for k in VOLATILITY_K_LIST:
     volatility_dir = '%s_%d' % (EOD_VOLATILITY_PREFIX, k)
     util.maybeMakeDir(volatility_dir)
@@ -733,27 +1101,37 @@ if logDo('compute_eod_volatility'):
     run(cmd)
   markDone('compute_eod_volatility')
 
-if logDo('compute_yahoo_volatility'):
+@step('compute_yahoo_volatility',
+      ['%s/close' % YAHOO_ADJUSTED_DIR],
+      ['%s_%d' % (YAHOO_VOLATILITY_PREFIX, k) for k in VOLATILITY_K_LIST],
+      ['%s/close/{ticker}' % YAHOO_ADJUSTED_DIR])
+def computeYahooVolatility(tickers):
+  ticker_arg = getTickerArg('compute_yahoo_volatility', tickers)
   for k in VOLATILITY_K_LIST:
     volatility_dir = '%s_%d' % (YAHOO_VOLATILITY_PREFIX, k)
     util.maybeMakeDir(volatility_dir)
     cmd = ('%s/compute_volatility.py --price_dir=%s/close --k=%d '
-           '--volatility_dir=%s' % (
-        CODE_DIR, YAHOO_ADJUSTED_DIR, k, volatility_dir))
+           '--volatility_dir=%s %s' % (
+        CODE_DIR, YAHOO_ADJUSTED_DIR, k, volatility_dir, ticker_arg))
     run(cmd)
   markDone('compute_yahoo_volatility')
 
-if logDo('compute_eod_volatility_perc'):
+@step('compute_eod_volatility_perc',
+      ['%s_%d' % (EOD_VOLATILITY_PREFIX, k) for k in VOLATILITY_K_LIST],
+      ['%s_%d' % (EOD_VOLATILITY_PERC_PREFIX, k) for k in VOLATILITY_K_LIST])
+def computeEodVolatilityPerc():
+  cmd = '%s/compute_rank_perc.py' % CODE_DIR
   for k in VOLATILITY_K_LIST:
     input_dir = '%s_%d' % (EOD_VOLATILITY_PREFIX, k)
     output_dir = '%s_%d' % (EOD_VOLATILITY_PERC_PREFIX, k)
     util.maybeMakeDir(output_dir)
-    cmd = ('%s/compute_rank_perc.py --input_dir=%s '
-           '--output_dir=%s' % (CODE_DIR, input_dir, output_dir))
-    run(cmd)
-  markDone('compute_eod_volatility_perc')
+    cmd += ' --input_dir=%s --output_dir=%s' % (input_dir, output_dir)
+  run(cmd, 'compute_eod_volatility_perc')
 
-if logDo('compute_yahoo_volatility_perc'):
+@step('compute_yahoo_volatility_perc',
+      ['%s_%d' % (YAHOO_VOLATILITY_PREFIX, k) for k in VOLATILITY_K_LIST],
+      ['%s_%d' % (YAHOO_VOLATILITY_PERC_PREFIX, k) for k in VOLATILITY_K_LIST])
+def computeYahooVolatilityPerc():
   for k in VOLATILITY_K_LIST:
     input_dir = '%s_%d' % (YAHOO_VOLATILITY_PREFIX, k)
     output_dir = '%s_%d' % (YAHOO_VOLATILITY_PERC_PREFIX, k)
@@ -763,6 +1141,86 @@ if logDo('compute_yahoo_volatility_perc'):
     run(cmd)
   markDone('compute_yahoo_volatility_perc')
 
+# Same as compute_yahoo_volumed_perc and compute_yahoo_volatility_perc, but
+# computes all percs in one process.
+@step('compute_yahoo_rank_percs',
+      ['%s/volumed_mean_%d' % (YAHOO_ADJUSTED_DIR, VOLUMED_K)]
+      + ['%s_%d' % (YAHOO_VOLATILITY_PREFIX, k) for k in VOLATILITY_K_LIST],
+      ['%s/volumed_mean_%d_perc' % (YAHOO_ADJUSTED_DIR, VOLUMED_K)]
+      + ['%s_%d' % (YAHOO_VOLATILITY_PERC_PREFIX, k)
+         for k in VOLATILITY_K_LIST])
+def computeYahooRankPercs():
+  dirs = [['%s/volumed_mean_%d' % (YAHOO_ADJUSTED_DIR, VOLUMED_K),
+           '%s/volumed_mean_%d_perc' % (YAHOO_ADJUSTED_DIR, VOLUMED_K)]]
+  for k in VOLATILITY_K_LIST:
+    dirs.append(['%s_%d' % (YAHOO_VOLATILITY_PREFIX, k),
+                 '%s_%d' % (YAHOO_VOLATILITY_PERC_PREFIX, k)])
+  cmd = '%s/compute_rank_perc.py' % CODE_DIR
+  for input_dir, output_dir in dirs:
+    util.maybeMakeDir(output_dir)
+    cmd += ' --input_dir=%s --output_dir=%s' % (input_dir, output_dir)
+  run(cmd, 'compute_yahoo_rank_percs')
+
+@step('convert_feature_store',
+      [FEATURE_DIR],
+      [FEATURE_STORE_DIR])
+def convertFeatureStore():
+  cmd = '%s/convert_feature_store.py --feature_base_dir=%s --store_dir=%s' % (
+      CODE_DIR, FEATURE_DIR, FEATURE_STORE_DIR)
+  run(cmd, 'convert_feature_store')
+
+############
+## Script ##
+############
+
+util.configLogging(LOG_LEVEL)
+
+# Prepare dirs.
+util.maybeMakeDirs([
+    SYMBOL_DIR,
+    TICKER_DIR,
+    YAHOO_SF1_DIR,
+    SF1_PROCESSED_DIR,
+    EOD_RAW_DIR,
+    EOD_PROCESSED_DIR,
+    YAHOO_PROCESSED_DIR,
+    FEATURE_DIR,
+    FEATURE_INFO_DIR,
+    FEATURE_STORE_DIR,
+    MISC_DIR,
+    EOD_PRICE_DIR,
+    EOD_ADJPRICE_DIR,
+    EOD_LOGPRICE_DIR,
+    EOD_LOGADJPRICE_DIR,
+    EOD_LOGADJVOLUME_DIR,
+    YAHOO_PRICE_DIR,
+    YAHOO_ADJPRICE_DIR,
+    YAHOO_LOGPRICE_DIR,
+    YAHOO_LOGADJPRICE_DIR,
+    YAHOO_LOGADJVOLUME_DIR,
+    YAHOO_HOLE_DIR,
+    YAHOO_PROJECTED_DIR,
+    YAHOO_ADJUSTED_DIR,
+    EOD_GAIN_DIR,
+    YAHOO_GAIN_DIR,
+    EOD_GAIN_LABEL_DIR,
+    YAHOO_GAIN_LABEL_DIR,
+    MARKET_PROCESSED_DIR,
+    MARKET_ADJPRICE_DIR,
+    MARKET_GAIN_DIR,
+    MARKET_PROJECTED_DIR,
+    EOD_EGAIN_DIR,
+    YAHOO_EGAIN_DIR,
+    EOD_EGAIN_LABEL_DIR,
+    YAHOO_EGAIN_LABEL_DIR,
+])
+
+READERS.update(util.getStepReaders(STEPS))
+times = util.runSteps(STEPS, STEP_WORKERS)
+logging.info('wall time of steps run:')
+for name, seconds in sorted(times, key=lambda item: item[1], reverse=True):
+  logging.info('  %s: %.1f seconds' % (name, seconds))
+
 for experiment in EXPERIMENTS:
   config_file = '%s/%s.json' % (CONFIG_DIR, experiment)
   cmd = '%s/run_experiment_2.py --config=%s' % (CODE_DIR, config_file)
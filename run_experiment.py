@@ -28,6 +28,28 @@
     - use_weight (default False)
     - weight_power (default 1)
     - use_classification (default True), set to False to use regression
+    - use_feature_store (default False), set to True to read features from
+      FEATURE_STORE_DIR when available
+    - collect_workers (default 1), number of processes for collecting data
+    - data_format (default 'npy'), format of collected data/label/rlabel/weight
+      files, 'text' or 'npy'
+    - use_train_index (default True), set to False to have each model select
+      its training data into tmp files; otherwise all models are trained in
+      one process from the index
+    - train_workers (default 1), number of processes for training models from
+      the train index, use 0 to fit as many as cpus allow given n_jobs in
+      model_spec
+    - update_models (default False), set to True to update each model from the
+      previous one with only newly eligible rows instead of retraining it,
+      requires use_train_index, train_window -1 and a model_spec supporting
+      partial_fit or warm_start (eg, SGDClassifier, RandomForestClassifier)
+    - update_estimators (default 10), number of estimators added by each
+      warm_start update
+    - update_max_estimators (default 0), max number of estimators of a
+      warm_start ensemble, beyond which the oldest ones are replaced, use 0 for
+      n_estimators of model_spec
+    - update_checkpoint (default 12), every this many updates the model is
+      retrained fully and compared with the updated one, use 0 to disable
 
     TODO: start_date and end_date are hand picked for now but can be automated.
 """
@@ -40,6 +62,7 @@ import json
 import numpy
 import os
 import pickle
+import train_model
 import util
 
 CONFIG_SUFFIX = '.json'
@@ -71,6 +94,15 @@ DEFAULT_VALUES = {
     'use_weight': False,
     'weight_power': 1.0,
     'use_classification': True,
+    'use_feature_store': False,
+    'collect_workers': 1,
+    'data_format': 'npy',
+    'use_train_index': True,
+    'train_workers': 1,
+    'update_models': False,
+    'update_estimators': 10,
+    'update_max_estimators': 0,
+    'update_checkpoint': 12,
 }
 
 def getConfig(config_file):
@@ -133,6 +165,10 @@ def getTrainingMetaPath(data_dir):
 def getPredictionMetaPath(data_dir):
   return '%s/predict_meta' % data_dir
 
+# Dir of train index (see train_model.buildTrainIndex()).
+def getTrainIndexDir(data_dir):
+  return '%s/train_index' % data_dir
+
 # Path to training weights.
 def getWeightPath(data_dir):
   return '%s/weight' % data_dir
@@ -212,9 +248,15 @@ def collectData(experiment_dir, config_map):
             config_map['feature_window'], config_map['min_feature_perc'],
             data_file, label_file, rlabel_file, meta_file,
             config_map['weight_power'], weight_file))
+  cmd += ' --workers=%d --data_format=%s' % (
+      config_map['collect_workers'], config_map['data_format'])
+  if config_map['use_feature_store']:
+    cmd += ' --feature_store_dir=%s' % FEATURE_STORE_DIR
   util.run(cmd)
 
-def filterMetadata(experiment_dir, config, filter_str, label_file, filtered_path):
+# Returns filters of filter_metadata.py (see its --filters) for filter_str
+# of config, and adds flags of the dirs and files they use to dir_args.
+def getMetadataFilters(config, filter_str, dir_args):
   filters = [filter.strip() for filter in filter_str.split('+')]
   filter_args = []
   _, market = getSourceAndMarket(config['label'])
@@ -223,52 +265,63 @@ def filterMetadata(experiment_dir, config, filter_str, label_file, filtered_path
       continue
     key, value = filter.split('=')
     if key == 'min_raw_price':
-      filter_args.append('--min_raw_price=%s' % value)
+      filter_args.append('min_raw_price=%s' % value)
       if market == 'eod':
-        filter_args.append('--raw_price_dir=%s' % EOD_PRICE_DIR)
+        dir_args.add('--raw_price_dir=%s' % EOD_PRICE_DIR)
       else:
-        filter_args.append('--raw_price_dir=%s' % YAHOO_PRICE_DIR)
+        dir_args.add('--raw_price_dir=%s' % YAHOO_PRICE_DIR)
       continue
     if key == 'max_volatility_perc':
-      filter_args.append('--max_volatility=%s' % value)
+      filter_args.append('max_volatility=%s' % value)
       if market == 'eod':
-        filter_args.append('--volatility_dir=%s_%d' % (
+        dir_args.add('--volatility_dir=%s_%d' % (
             EOD_VOLATILITY_PERC_PREFIX, FILTER_VOLATILITY_K))
       else:
-        filter_args.append('--volatility_dir=%s_%d' % (
+        dir_args.add('--volatility_dir=%s_%d' % (
             YAHOO_VOLATILITY_PERC_PREFIX, FILTER_VOLATILITY_K))
       continue
     if key == 'min_marketcap':
-      filter_args.append('--min_marketcap=%s' % value)
-      filter_args.append('--marketcap_dir=%s/MARKETCAP-ND' % FEATURE_DIR)
+      filter_args.append('min_marketcap=%s' % value)
+      dir_args.add('--marketcap_dir=%s/MARKETCAP-ND' % FEATURE_DIR)
       continue
     if key == 'max_holes':
-      filter_args.append('--max_holes=%s' % value)
-      filter_args.append('--hole_dir=%s' % YAHOO_HOLE_DIR)
+      filter_args.append('max_holes=%s' % value)
+      dir_args.add('--hole_dir=%s' % YAHOO_HOLE_DIR)
       continue
     if key == 'membership':
       assert value == MEMBERSHIP
-      filter_args.append('--membership_file=%s' % MEMBERSHIP_FILE)
+      filter_args.append('membership')
+      dir_args.add('--membership_file=%s' % MEMBERSHIP_FILE)
       continue
     assert False, 'unrecognized filter arg: %s' % filter
+  return '+'.join(filter_args)
+
+def filterMetadata(experiment_dir, config, label_file, train_path,
+                   predict_path):
+  """ Filters metadata for training and prediction in one pass.  Negative
+      labels are also removed from training if label_file is set.
+  """
+  dir_args = set()
+  train_filters = getMetadataFilters(config, config['train_filter'], dir_args)
+  predict_filters = getMetadataFilters(config, config['predict_filter'],
+                                       dir_args)
+  if label_file is not None:
+    train_filters += '+remove_neg_labels'
+    dir_args.add('--label_file=%s' % label_file)
 
   data_dir = getDataDir(experiment_dir)
   meta_file = getMetaPath(data_dir)
-  label_args = ''
-  if label_file is not None:
-    label_args = '--remove_neg_labels --label_file=%s' % label_file
-
-  cmd = ('%s/filter_metadata.py --input_file=%s --output_file=%s %s %s' % (
-      CODE_DIR, meta_file, filtered_path, ' '.join(filter_args), label_args))
+  cmd = ('%s/filter_metadata.py --input_file=%s %s '
+         '--filters=%s --output_file=%s --filters=%s --output_file=%s' % (
+      CODE_DIR, meta_file, ' '.join(sorted(dir_args)), train_filters,
+      train_path, predict_filters, predict_path))
   util.run(cmd)
 
-def evaluateModel(model_file, imputer_file, data_file, label_file):
+def evaluateModel(model_file, imputer_file, X, y):
   with open(model_file, 'rb') as fp:
     model = pickle.load(fp)
   with open(imputer_file, 'rb') as fp:
     imputer = pickle.load(fp)
-  X = numpy.loadtxt(data_file)
-  y = numpy.loadtxt(label_file)
 
   X = imputer.transform(X)
 
@@ -296,6 +349,28 @@ def evaluateModel(model_file, imputer_file, data_file, label_file):
 
   return result
 
+# Runs train_model.py for each date with tmp files, yielding dates in order
+# right after each model is trained (so tmp files can be evaluated).
+def runTrainModel(dates, data_file, label_file, meta_file, weight_file,
+                  train_meta_file, model_dir, imputer_dir, config_map):
+  data_args = '--tmp_data_file=%s --tmp_label_file=%s' % (
+      TMP_DATA_FILE, TMP_LABEL_FILE)
+  if weight_file:
+    data_args += ' --weight_file=%s --tmp_weight_file=%s' % (
+        weight_file, TMP_WEIGHT_FILE)
+  for date in dates:
+    model_file = getModelPath(model_dir, date, config_map)
+    imputer_file = getImputerPath(imputer_dir, date, config_map)
+    cmd = ('%s/train_model.py --data_file=%s --label_file=%s --meta_file=%s %s '
+           '--yyyymm=%s --months=%d --model_def="%s" --perc=%f --model_file=%s '
+           '--train_meta_file=%s --imputer_strategy=%s --imputer_file=%s' % (
+              CODE_DIR, data_file, label_file, meta_file, data_args, date,
+              config_map['train_window'], config_map['model_spec'],
+              config_map['train_perc'], model_file, train_meta_file,
+              config_map['imputer_strategy'], imputer_file))
+    util.run(cmd)
+    yield date
+
 def trainModels(experiment_dir, config_map, train_meta_file):
   dates = []
   date = config_map['start_date']
@@ -324,10 +399,35 @@ def trainModels(experiment_dir, config_map, train_meta_file):
   util.maybeMakeDir(imputer_dir)
 
   stats_file = getStatsPath(experiment_dir, config_map)
-  weight_args = ''
+  weight_file = None
   if config_map['use_weight']:
-    weight_args = '--weight_file=%s --tmp_weight_file=%s' % (
-        getWeightPath(data_dir), TMP_WEIGHT_FILE)
+    weight_file = getWeightPath(data_dir)
+  index = None
+  if config_map['use_train_index']:
+    # Index eligible rows by date once and train all models in process,
+    # each reading its training period as a slice of the index.
+    index_dir = getTrainIndexDir(data_dir)
+    train_model.buildTrainIndex(data_file, label_file, meta_file, weight_file,
+                                train_meta_file, index_dir)
+    index = train_model.loadTrainIndex(index_dir)
+    jobs = [[date, config_map['train_window'], config_map['model_spec'],
+             config_map['train_perc'], config_map['imputer_strategy'],
+             getModelPath(model_dir, date, config_map),
+             getImputerPath(imputer_dir, date, config_map)]
+            for date in dates]
+    workers = train_model.getWorkers(config_map['model_spec'],
+                                     config_map['train_workers'])
+    trained_dates = train_model.trainModels(
+        index_dir, jobs, workers, config_map['update_models'],
+        config_map['update_estimators'], config_map['update_checkpoint'],
+        config_map['update_max_estimators'])
+  else:
+    assert not config_map['update_models'], (
+        'update_models requires use_train_index')
+    trained_dates = runTrainModel(dates, data_file, label_file, meta_file,
+                                  weight_file, train_meta_file, model_dir,
+                                  imputer_dir, config_map)
+
   with open(stats_file, 'w') as fp:
     # Keep in sync with evaluateModel().
     print >> fp, '\t'.join([
@@ -341,23 +441,21 @@ def trainModels(experiment_dir, config_map, train_meta_file):
         '100perc-precision',
         '100perc-recall',
     ])
-    for date in dates:
+    for date in trained_dates:
       model_file = getModelPath(model_dir, date, config_map)
       imputer_file = getImputerPath(imputer_dir, date, config_map)
-      cmd = ('%s/train_model.py --data_file=%s --label_file=%s --meta_file=%s %s '
-             '--yyyymm=%s --months=%d --model_def="%s" --perc=%f --model_file=%s '
-             '--train_meta_file=%s --tmp_data_file=%s --tmp_label_file=%s '
-             '--imputer_strategy=%s --imputer_file=%s' % (
-                CODE_DIR, data_file, label_file, meta_file, weight_args, date,
-                config_map['train_window'], config_map['model_spec'],
-                config_map['train_perc'], model_file, train_meta_file,
-                TMP_DATA_FILE, TMP_LABEL_FILE,
-                config_map['imputer_strategy'], imputer_file))
-      util.run(cmd)
       if not os.path.isfile(model_file):
         continue
       if config_map['use_classification']:
-        result = evaluateModel(model_file, imputer_file, TMP_DATA_FILE, TMP_LABEL_FILE)
+        if index is not None:
+          X, y, _ = train_model.selectIndexData(index, date,
+                                                config_map['train_window'])
+          # Copy since imputation is in place.
+          X = numpy.array(X)
+        else:
+          X = util.readMatrix(TMP_DATA_FILE)
+          y = util.readMatrix(TMP_LABEL_FILE)
+        result = evaluateModel(model_file, imputer_file, X, y)
         # Keep in sync with evaluateModel().
         values = [date, '%.4f' % result['f1'], '%.4f' % result['auc']]
         for perc in EVAL_PERCS:
@@ -439,16 +537,14 @@ def runExperiment(config_file):
   train_meta_file = getTrainingMetaPath(data_dir)
   predict_meta_file = getPredictionMetaPath(data_dir)
 
-  step = '%s_filter_train' % experiment
-  if not util.checkDone(step):
-    filterMetadata(experiment_dir, config_map,
-                   config_map['train_filter'], label_file, train_meta_file)
-    util.markDone(step)
-
-  step = '%s_filter_predict' % experiment
-  if not util.checkDone(step):
-    filterMetadata(experiment_dir, config_map,
-                   config_map['predict_filter'], None, predict_meta_file)
+  step = '%s_filter' % experiment
+  # Runs before both metadata were filtered in one step were marked
+  # separately.
+  if not util.checkDone(step) and not (
+      util.checkDone('%s_filter_train' % experiment) and
+      util.checkDone('%s_filter_predict' % experiment)):
+    filterMetadata(experiment_dir, config_map, label_file, train_meta_file,
+                   predict_meta_file)
     util.markDone(step)
 
   step = '%s_train_models' % experiment
@@ -0,0 +1,36 @@
+#!/usr/bin/python2.7
+
+import adjust_yahoo
+
+def readAdjusted(base_dir):
+  return [base_dir.join(label, 'A').read().splitlines()
+          for label in adjust_yahoo.LABELS]
+
+def test_writeAdjusted_append(tmpdir):
+  base_dir = tmpdir.mkdir('adjusted')
+  dates = ['2015-01-02', '2015-01-05']
+  series = [[1.0, 2.0] for label in adjust_yahoo.LABELS]
+  adjust_yahoo.writeAdjusted(str(base_dir), 'A', dates, series, True)
+  assert readAdjusted(base_dir) == [
+      ['2015-01-02\t1.000000', '2015-01-05\t2.000000']
+      for label in adjust_yahoo.LABELS]
+
+  # Only dates after the last one are appended (earlier rows are kept even
+  # if their values differ).
+  dates.append('2015-01-06')
+  series = [[9.0, 2.0, 3.0] for label in adjust_yahoo.LABELS]
+  adjust_yahoo.writeAdjusted(str(base_dir), 'A', dates, series, True)
+  expected = [['2015-01-02\t1.000000', '2015-01-05\t2.000000',
+               '2015-01-06\t3.000000'] for label in adjust_yahoo.LABELS]
+  assert readAdjusted(base_dir) == expected
+
+  # Nothing new to append.
+  adjust_yahoo.writeAdjusted(str(base_dir), 'A', dates, series, True)
+  assert readAdjusted(base_dir) == expected
+
+  # Adjusted close of the last date changed, so files are rewritten.
+  series = [[9.0, 2.0, 4.0] for label in adjust_yahoo.LABELS]
+  adjust_yahoo.writeAdjusted(str(base_dir), 'A', dates, series, True)
+  assert readAdjusted(base_dir) == [
+      ['2015-01-02\t9.000000', '2015-01-05\t2.000000', '2015-01-06\t4.000000']
+      for label in adjust_yahoo.LABELS]
@@ -0,0 +1,38 @@
+#!/usr/bin/python2.7
+
+import argparse
+import build_yahoo_panel
+
+def test_buildPanel(tmpdir):
+  raw_dir = tmpdir.mkdir('raw')
+  raw_dir.join('A.csv').write('\n'.join([
+      'Date,Open,High,Low,Close,Volume,Adj Close',
+      '2015-01-06,4,5,3,4,10,2',
+      '2015-01-05,3,4,2,3,10,1.5',
+      '2015-01-04,9,9,9,9,9,9',
+      '2015-01-02,2,3,1,2,20,1']) + '\n')
+  trading_day_file = tmpdir.join('trading_days')
+  trading_day_file.write('2015-01-02\n2015-01-05\n2015-01-06\n')
+  args = argparse.Namespace(
+      raw_dir=str(raw_dir), trading_day_file=str(trading_day_file),
+      projected_dir=str(tmpdir.join('projected')),
+      adjusted_dir=str(tmpdir.join('adjusted')), volumed_k=2,
+      volatility_prefix=str(tmpdir.join('volatility')), volatility_k='1,2',
+      gain_label_k=1, gain_label_dir=str(tmpdir.join('gain_label')),
+      changed_ticker_file=None, append=False)
+  build_yahoo_panel.buildPanel(args)
+
+  assert tmpdir.join('projected', 'A').read().splitlines() == [
+      '2015-01-02\t2\t3\t1\t2\t1\t20',
+      '2015-01-05\t3\t4\t2\t3\t1.5\t10',
+      '2015-01-06\t4\t5\t3\t4\t2\t10']
+  assert tmpdir.join('adjusted', 'open', 'A').read().splitlines() == [
+      '2015-01-02\t1.000000', '2015-01-05\t1.500000', '2015-01-06\t2.000000']
+  assert tmpdir.join('adjusted', 'volumed_mean_2', 'A').read().splitlines() == [
+      '2015-01-05\t17.500000', '2015-01-06\t17.500000']
+  assert tmpdir.join('volatility_1', 'A').read().splitlines() == [
+      '2015-01-02\t0.000000', '2015-01-05\t0.000000', '2015-01-06\t0.000000']
+  # Gain of 2015-01-02 is from open of 2015-01-05 to that of 2015-01-06.
+  assert tmpdir.join('gain_label', 'A').read().splitlines() == [
+      '2015-01-02\t%f' % (0.5 / 1.51), '2015-01-05\t0.000000',
+      '2015-01-06\t0.000000']
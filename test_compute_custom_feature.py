@@ -0,0 +1,48 @@
+#!/usr/bin/python2.7
+
+import compute_custom_feature
+import numpy
+
+def test_compileFormula():
+  target, symbols, formula = compute_custom_feature.findSymbols(
+      '{T} = ({A} - {B}) / {B} + -{A} ** 2 / 4')
+  assert target == 'T'
+  assert symbols == ['A', 'B']
+  evaluate = compute_custom_feature.compileFormula(formula, symbols)
+  result, zero = evaluate([numpy.array([1.0, 2.0, 3.0]),
+                           numpy.array([2.0, 0.0, -1.0])])
+  assert zero.tolist() == [False, True, False]
+  assert result[0] == -0.5 - 0.25
+  assert result[2] == -4.0 - 2.25
+  # Constant divisions are by float.
+  result, zero = compute_custom_feature.compileFormula('{A} / 2', ['A'])(
+      [numpy.array([1.0])])
+  assert result.tolist() == [0.5]
+  for formula in ['abs({A})', '{A} % 2', '{A}.real']:
+    try:
+      compute_custom_feature.compileFormula(formula, ['A'])
+      assert False, 'expected failure'
+    except AssertionError as e:
+      assert 'formula' in str(e)
+  # 0 to a negative power is a division by zero.
+  result, zero = compute_custom_feature.compileFormula('{A} ** -1', ['A'])(
+      [numpy.array([0.0, 2.0])])
+  assert zero.tolist() == [True, False] and result[1] == 0.5
+
+def test_computeCustomFeatures(tmpdir):
+  feature_dir = tmpdir.mkdir('features')
+  feature_dir.mkdir('A').join('X').write('2015-01-02\t1e300\n2015-01-05\t2\n')
+  feature_dir.mkdir('B').join('X').write('2015-01-02\t1e10\n2015-01-05\t0\n')
+  ticker_file = tmpdir.join('tickers')
+  ticker_file.write('X\nY\n')
+  info_dir = tmpdir.mkdir('info')
+  # Output of an earlier run for Y, which no longer has A.
+  feature_dir.mkdir('T').join('Y').write('2015-01-02\t1.000000\n')
+  compute_custom_feature.computeCustomFeatures(
+      str(feature_dir), ['{T} = {A} * {B}', '{U} = {T} + 1'],
+      str(ticker_file), str(info_dir))
+  # Overflow is missing in output.
+  assert feature_dir.join('T', 'X').read() == '2015-01-05\t0.000000\n'
+  assert feature_dir.join('U', 'X').read() == '2015-01-05\t1.000000\n'
+  assert not feature_dir.join('T', 'Y').check()
+  assert not feature_dir.join('U', 'Y').check()
@@ -0,0 +1,20 @@
+#!/usr/bin/python2.7
+
+import compute_hori_perc_feature
+
+def test_computePercFeature(tmpdir):
+  input_dir = tmpdir.mkdir('input')
+  input_dir.join('A').write('2015-01-05\t1.0\n2015-02-10\t4.0\n')
+  input_dir.join('B').write('2015-01-20\t2.0\n2015-01-30\t3.0\n')
+  input_dir.join('C').write('2015-03-01\t0.0\n')
+  input_dir.join('D').write('')
+  output_dir = tmpdir.mkdir('output')
+  compute_hori_perc_feature.computePercFeature(
+      str(input_dir), [['A', 'B', 'D'], ['C', 'X']], True, str(output_dir))
+  assert sorted([f.basename for f in output_dir.listdir()]) == ['A', 'B', 'C']
+  # B publishes twice in 2015-01, the latest value wins from 2015-02.
+  assert output_dir.join('A').read().splitlines() == [
+      '2015-02\t0.000000', '2015-03\t0.500000']
+  assert output_dir.join('B').read().splitlines() == [
+      '2015-02\t0.500000', '2015-03\t0.000000']
+  assert output_dir.join('C').read().splitlines() == ['2015-04\t0.500000']
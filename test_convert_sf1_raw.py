@@ -0,0 +1,33 @@
+#!/usr/bin/python2.7
+
+import convert_sf1_raw
+import process_sf1_raw
+
+def test_convertSf1Processed_resume(tmpdir):
+  indicator_file = tmpdir.join('indicators')
+  indicator_file.write('\n'.join([
+      convert_sf1_raw.INDICATOR_HEADER,
+      'EPS\tEPS\tARQ,ART\tIncome\tEarnings per share\t']) + '\n')
+  sf1_file = tmpdir.join('sf1')
+  sf1_file.write('A_EPS_ARQ,2015-03-31,1.5\nB_EPS_ARQ,2015-03-31,2.0\n'
+                 'A_EPS_ART,2015-03-31,6.0\n')
+  processed_dir = tmpdir.mkdir('processed')
+  # Leftovers of an interrupted run: a complete ticker dir and tmp dirs.
+  processed_dir.mkdir('B').join('stale').write('')
+  processed_dir.mkdir('%sA' % process_sf1_raw.TMP_PREFIX)
+  processed_dir.mkdir('%sxyz' % convert_sf1_raw.SPILL_PREFIX)
+
+  convert_sf1_raw.convertSf1Processed(str(sf1_file), str(indicator_file),
+                                      str(processed_dir))
+  assert sorted([path.basename for path in processed_dir.listdir()]) == [
+      'A', 'B']
+  assert sorted([path.basename for path in processed_dir.join('A').listdir()
+                 ]) == ['ARQ%s' % process_sf1_raw.OUTPUT_SUFFIX,
+                        'ART%s' % process_sf1_raw.OUTPUT_SUFFIX]
+  assert processed_dir.join('B', 'stale').check()
+
+  convert_sf1_raw.convertSf1Processed(str(sf1_file), str(indicator_file),
+                                      str(processed_dir), overwrite=True)
+  assert not processed_dir.join('B', 'stale').check()
+  assert processed_dir.join('B', 'ARQ%s' % process_sf1_raw.OUTPUT_SUFFIX
+                            ).check()
@@ -0,0 +1,149 @@
+#!/usr/bin/python2.7
+
+import BaseHTTPServer
+import download_yahoo
+import SocketServer
+import threading
+import urlparse
+
+# Serves table.csv content of ROWS (ticker => rows by date descending), with
+# optional start date (a, b, c) as yahoo does.
+ROWS = dict()
+REQUESTS = []
+# Number of 500 responses to return before serving.
+ERRORS = [0]
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET(self):
+    REQUESTS.append(self.path)
+    query = urlparse.parse_qs(urlparse.urlsplit(self.path).query)
+    ticker = query['s'][0]
+    if ERRORS[0] > 0:
+      ERRORS[0] -= 1
+      self.reply(500, 'error')
+      return
+    if ticker not in ROWS:
+      self.reply(404, 'not found')
+      return
+    rows = ROWS[ticker]
+    if 'a' in query:
+      start = '%s-%02d-%02d' % (query['c'][0], int(query['a'][0]) + 1,
+                                int(query['b'][0]))
+      rows = [row for row in rows if row >= start]
+    self.reply(200, '\n'.join([download_yahoo.HEADER] + rows) + '\n')
+
+  def reply(self, status, content):
+    self.send_response(status)
+    self.send_header('Content-Length', str(len(content)))
+    self.end_headers()
+    self.wfile.write(content)
+
+  def log_message(self, *args):
+    pass
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+def startServer():
+  server = Server(('127.0.0.1', 0), Handler)
+  thread = threading.Thread(target=server.serve_forever)
+  thread.daemon = True
+  thread.start()
+  return server, 'http://127.0.0.1:%d/table.csv?s=' % server.server_port
+
+def test_fetcher():
+  del REQUESTS[:]
+  ROWS['A'] = ['2015-01-02,1,2,0.5,1.5,100,1.5']
+  server, base_url = startServer()
+  try:
+    fetcher = download_yahoo.Fetcher(backoff=0)
+    ERRORS[0] = 2
+    assert download_yahoo.parseRows(fetcher.get(base_url + 'A')) == ROWS['A']
+    assert len(REQUESTS) == 3
+    ERRORS[0] = 3
+    assert fetcher.get(base_url + 'A') is None
+    # Not found is not retried.
+    assert fetcher.get(base_url + 'X') is None
+    assert len(REQUESTS) == 7
+  finally:
+    server.shutdown()
+
+def test_download(tmpdir):
+  del REQUESTS[:]
+  ROWS['A'] = ['2015-01-05,1,2,0.5,1.6,100,1.6',
+               '2015-01-02,1,2,0.5,1.5,100,1.5']
+  ROWS['B'] = ['2015-01-05,1,2,0.5,2.2,100,1.1',
+               '2015-01-02,1,2,0.5,2.0,100,1.0']
+  ticker_file = tmpdir.join('tickers')
+  ticker_file.write('A\nB\nX\n')
+  download_dir = tmpdir.mkdir('raw')
+  progress_file = tmpdir.join('progress')
+  failed_file = tmpdir.join('failed')
+  server, base_url = startServer()
+  try:
+    failed = download_yahoo.download(
+        str(ticker_file), str(download_dir), False, base_url=base_url,
+        workers=2, progress_file=str(progress_file),
+        failed_file=str(failed_file))
+    assert failed == ['X']
+    assert failed_file.read() == 'X\n'
+    # Progress is removed after a pass even if some tickers failed.
+    assert not progress_file.check()
+    assert (download_yahoo.readRows(str(download_dir.join('A.csv')))
+            == ROWS['A'])
+    assert sorted(download_dir.listdir()) == [
+        download_dir.join('A.csv'), download_dir.join('B.csv')]
+
+    # An append run after the failure still fetches succeeded tickers.
+    del REQUESTS[:]
+    ROWS['A'].insert(0, '2015-01-06,1,2,0.5,1.7,100,1.7')
+    assert download_yahoo.download(
+        str(ticker_file), str(download_dir), False, True, base_url=base_url,
+        progress_file=str(progress_file),
+        failed_file=str(failed_file)) == ['X']
+    assert sorted(set([request[request.find('s=') + 2:].split('&')[0]
+                       for request in REQUESTS])) == ['A', 'B', 'X']
+    assert (download_yahoo.readRows(str(download_dir.join('A.csv')))
+            == ROWS['A'])
+
+    # Finished tickers are skipped when resumed after an interruption.
+    del REQUESTS[:]
+    progress_file.write('A\nB\n')
+    ROWS['X'] = ['2015-01-05,1,2,0.5,1.0,100,1.0']
+    assert download_yahoo.download(
+        str(ticker_file), str(download_dir), False, True, base_url=base_url,
+        progress_file=str(progress_file),
+        failed_file=str(failed_file)) == []
+    assert len(REQUESTS) == 1
+    assert not progress_file.check()
+    assert failed_file.read() == ''
+
+    # New rows are appended unless the adjclose/close ratio changed.
+    ROWS['A'].insert(0, '2015-01-07,1,2,0.5,1.8,100,1.8')
+    ROWS['B'] = ['2015-01-06,1,2,0.5,2.4,100,2.4',
+                 '2015-01-05,1,2,0.5,2.2,100,2.2',
+                 '2015-01-02,1,2,0.5,2.0,100,2.0']
+    assert download_yahoo.download(
+        str(ticker_file), str(download_dir), False, True,
+        base_url=base_url) == []
+    for ticker in ['A', 'B']:
+      assert (download_yahoo.readRows(str(download_dir.join(
+          '%s.csv' % ticker))) == ROWS[ticker])
+
+    # A zero or unparsable close is taken as a changed ratio.
+    del REQUESTS[:]
+    ROWS['A'] = ['2015-01-08,1,2,0.5,1.9,100,1.9',
+                 '2015-01-07,1,2,0.5,0,100,0']
+    ROWS['B'] = ['2015-01-07,1,2,0.5,2.6,100,2.6',
+                 '2015-01-06,1,2,0.5,null,100,null']
+    assert download_yahoo.download(
+        str(ticker_file), str(download_dir), False, True,
+        base_url=base_url) == []
+    for ticker in ['A', 'B']:
+      assert (download_yahoo.readRows(str(download_dir.join(
+          '%s.csv' % ticker))) == ROWS[ticker])
+    assert len([request for request in REQUESTS if '&a=' not in request]) == 2
+  finally:
+    server.shutdown()
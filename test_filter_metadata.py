@@ -0,0 +1,75 @@
+#!/usr/bin/python2.7
+
+import filter_metadata
+import numpy
+import time
+import util
+
+def test_filterMetadatas(tmpdir):
+  meta_file = tmpdir.join('meta')
+  meta_file.write('A\t2015-01-02\tx\nA\t2015-01-05\ty\nB\t2015-01-05\tz\n'
+                  'C\t2015-01-05\tw\n')
+  label_file = tmpdir.join('label')
+  label_file.write('1\n-1\n0\n1\n')
+  price_dir = tmpdir.mkdir('price')
+  price_dir.join('A').write('2015-01-02\t12\n2015-01-05\t11\n')
+  price_dir.join('B').write('2015-01-05\t8\n')
+  price_dir.join('C').write('2015-01-02\t20\n')
+  hole_dir = tmpdir.mkdir('holes')
+  hole_dir.join('A').write('2015-01-01\t0.5\n2015-01-03\t0\n')
+  hole_dir.join('B').write('2015-01-01\t0\n')
+  membership_file = tmpdir.join('membership')
+  membership_file.write('A\t2015-01-03,2015-02-01\nB\t\n')
+  dirs = {'raw_price_dir': str(price_dir), 'hole_dir': str(hole_dir)}
+
+  train_file = tmpdir.join('train')
+  predict_file = tmpdir.join('predict')
+  all_file = tmpdir.join('all')
+  stats = filter_metadata.filterMetadatas(
+      str(meta_file),
+      [filter_metadata.parseFilters('min_raw_price=10+remove_neg_labels'),
+       filter_metadata.parseFilters('max_holes=0.1+membership'),
+       filter_metadata.parseFilters('')],
+      dirs, str(membership_file), str(label_file),
+      [str(train_file), str(predict_file), str(all_file)])
+  # C has no price on the date.
+  assert train_file.read() == 'A\t2015-01-02\tx\n'
+  assert stats[0]['min_raw_price'] == 2 and stats[0]['neg_label'] == 1
+  # Holes are looked up as of the date, C has none.
+  assert predict_file.read() == 'A\t2015-01-05\ty\n'
+  assert stats[1]['max_holes'] == 2 and stats[1]['membership'] == 1
+  assert all_file.read() == meta_file.read()
+
+  # Labels collected with --data_format=npy.
+  label_file = tmpdir.join('label.npy')
+  util.writeMatrix(numpy.array([1.0, -1.0, 0.0, 1.0]), str(label_file))
+  stats = filter_metadata.filterMetadatas(
+      str(meta_file), [filter_metadata.parseFilters('remove_neg_labels')],
+      dirs, None, str(label_file), [str(train_file)])
+  assert stats[0]['neg_label'] == 1
+  assert train_file.read() == ('A\t2015-01-02\tx\nB\t2015-01-05\tz\n'
+                               'C\t2015-01-05\tw\n')
+
+def getMemberMask(ticker_count, row_count):
+  tickers = numpy.repeat(
+      numpy.array(['T%05d' % i for i in range(ticker_count)]), row_count)
+  dates = numpy.tile(numpy.array(['2015-%02d-%02d' % (1 + i % 12, 1 + i % 28)
+                                  for i in range(row_count)]), ticker_count)
+  membership = dict([['T%05d' % i, [['2015-02-01', '2015-05-01'],
+                                    ['2015-07-10', '2016-01-01']]]
+                     for i in range(0, ticker_count, 2)])
+  start = time.time()
+  mask = filter_metadata.getMemberMask(membership, tickers, dates)
+  return mask, time.time() - start, membership, tickers, dates
+
+def test_getMemberMask():
+  mask, _, membership, tickers, dates = getMemberMask(20, 30)
+  expected = [any([start <= dates[i] < end
+                   for start, end in membership.get(tickers[i], [])])
+              for i in range(len(tickers))]
+  assert mask.tolist() == expected
+  # Rows of each ticker are found in one pass, so time grows about linearly
+  # with tickers (16x here, but 256x if quadratic).
+  small = min([getMemberMask(1000, 10)[1] for i in range(3)])
+  large = min([getMemberMask(16000, 10)[1] for i in range(2)])
+  assert large < 40 * small
@@ -0,0 +1,26 @@
+#!/usr/bin/python2.7
+
+import get_yahoo_trading_days
+
+def writeRaw(raw_dir, ticker, dates):
+  lines = ['Date,Open,High,Low,Close,Volume,Adj Close']
+  lines.extend(['%s,1,1,1,1,1,1' % date for date in reversed(dates)])
+  raw_dir.join('%s.csv' % ticker).write('\n'.join(lines) + '\n')
+
+def test_getTradingDays(tmpdir):
+  raw_dir = tmpdir.mkdir('raw')
+  writeRaw(raw_dir, 'A', ['1999-12-31', '2015-01-02', '2015-01-05'])
+  writeRaw(raw_dir, 'B', ['2015-01-02', '2015-01-03', '2015-01-04',
+                          '2015-01-06'])
+  writeRaw(raw_dir, 'C', ['1999-12-30'])
+
+  dates, trading_counts, total_counts = (
+      get_yahoo_trading_days.countTradingDays(
+          get_yahoo_trading_days.readTickerDates(str(raw_dir), '2000')))
+  assert dates == ['2015-01-0%d' % d for d in range(2, 7)]
+  assert list(trading_counts) == [2, 1, 1, 1, 1]
+  assert list(total_counts) == [2, 2, 2, 2, 1]
+
+  assert get_yahoo_trading_days.getTradingDays(
+      str(raw_dir), '2000', [0.9, 0.5]) == [
+          ['2015-01-02', '2015-01-06'], dates]
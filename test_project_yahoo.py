@@ -0,0 +1,31 @@
+#!/usr/bin/python2.7
+
+import project_yahoo
+
+def test_writeProjected_append(tmpdir):
+  projected_file = tmpdir.join('A')
+  data = {'2015-01-02': ['1', '2', '1', '2', '1', '10'],
+          '2015-01-05': ['2', '3', '2', '3', '1.5', '20']}
+  project_yahoo.writeProjected(str(projected_file), sorted(data), data, True)
+  lines = projected_file.read().splitlines()
+  assert lines == ['2015-01-02\t1\t2\t1\t2\t1\t10',
+                   '2015-01-05\t2\t3\t2\t3\t1.5\t20']
+
+  # Only dates after the last one are appended (earlier rows are kept even
+  # if their data differs).
+  data['2015-01-02'] = ['9', '9', '9', '9', '9', '9']
+  data['2015-01-06'] = ['3', '4', '3', '4', '2', '30']
+  project_yahoo.writeProjected(str(projected_file), sorted(data), data, True)
+  lines.append('2015-01-06\t3\t4\t3\t4\t2\t30')
+  assert projected_file.read().splitlines() == lines
+
+  # Nothing new to append.
+  project_yahoo.writeProjected(str(projected_file), sorted(data), data, True)
+  assert projected_file.read().splitlines() == lines
+
+  # Adjclose of the last date changed, so the file is rewritten.
+  data['2015-01-06'] = ['3', '4', '3', '4', '1', '30']
+  project_yahoo.writeProjected(str(projected_file), sorted(data), data, True)
+  assert projected_file.read().splitlines() == [
+      '2015-01-02\t9\t9\t9\t9\t9\t9', '2015-01-05\t2\t3\t2\t3\t1.5\t20',
+      '2015-01-06\t3\t4\t3\t4\t1\t30']
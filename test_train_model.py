@@ -0,0 +1,39 @@
+#!/usr/bin/python2.7
+
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+import numpy
+import train_model
+
+def getData(seed, rows=50):
+  random = numpy.random.RandomState(seed)
+  X = random.rand(rows, 3)
+  return X, (X[:, 0] > 0.5).astype(int)
+
+def test_updateModel():
+  model = RandomForestClassifier(n_estimators=10, random_state=0)
+  model.fit(*getData(0))
+  first = model.estimators_[0]
+  counts = []
+  for i in range(5):
+    X, y = getData(i + 1)
+    assert train_model.updateModel(model, X, y, None, 4, 16)
+    counts.append(len(model.estimators_))
+  # Grows by 4 per update up to 16, then the oldest are replaced.
+  assert counts == [14, 16, 16, 16, 16]
+  assert model.n_estimators == 16
+  assert first not in model.estimators_
+  model.predict_proba(X)
+
+  # Uncapped.
+  X, y = getData(9)
+  assert train_model.updateModel(model, X, y, None, 4, 0)
+  assert len(model.estimators_) == 20
+
+  # Boosting stages cannot be dropped.
+  model = GradientBoostingClassifier(n_estimators=10, random_state=0)
+  model.fit(*getData(0))
+  X, y = getData(1)
+  assert train_model.updateModel(model, X, y, None, 4, 16)
+  assert model.estimators_.shape[0] == 14
+  assert not train_model.updateModel(model, X, y, None, 4, 16)
+  assert model.estimators_.shape[0] == 14
@@ -1,8 +1,11 @@
 #!/usr/bin/python2.7
 
 import math
+import numpy
 import util
 
+nan = numpy.nan
+
 def checkFloatLists(expected, actual):
   assert len(actual) == len(expected), '%d vs %d' % (len(actual), len(expected))
   for i in range(len(expected)):
@@ -15,9 +18,309 @@ def test_normalize():
   checkFloatLists([-math.sqrt(2.0)/2, 0.0, math.sqrt(2.0)/2], util.normalize([1.0, 2.0, 3.0]))
   checkFloatLists([0.5, -0.5, 0.5, -0.5], util.normalize([10.0, -10.0, 10.0, -10.0]))
 
+def test_normalizeRows():
+  rows = [[1.0, 2.0, 3.0], [1.0, 1.0, 1.0], [10.0, -10.0, 4.0]]
+  norms = util.normalizeRows(rows)
+  for i in range(len(rows)):
+    checkFloatLists(util.normalize(rows[i]), norms[i])
+  assert util.normalizeRows([[1.0], [2.0]]).tolist() == [[0.0], [0.0]]
+
+def test_slidingWindows():
+  windows = util.slidingWindows(numpy.arange(5.0), 3)
+  assert windows.tolist() == [[0.0, 1.0, 2.0], [1.0, 2.0, 3.0], [2.0, 3.0, 4.0]]
+  assert not windows.flags.writeable
+  assert util.slidingWindows([1.0, 2.0], 3).shape == (0, 3)
+
+def test_rollingStats():
+  values = [3.0, 1.0, 4.0, 1.0, 5.0, 9.0, 2.0, 6.0, 5.0, 3.0]
+  for window in [1, 2, 3, 4, 20]:
+    windows = [values[max(0, i-window+1):i+1] for i in range(len(values))]
+    checkFloatLists([sum(w) for w in windows], util.rollingSum(values, window))
+    checkFloatLists([len(w) for w in windows],
+                    util.rollingCounts(len(values), window))
+    checkFloatLists([min(w) for w in windows], util.rollingMin(values, window))
+    checkFloatLists([max(w) for w in windows], util.rollingMax(values, window))
+    checkFloatLists([numpy.std(w) for w in windows],
+                    util.rollingStd(values, window))
+    checkFloatLists([numpy.median(w) for w in windows],
+                    util.rollingMedian(values, window))
+  assert util.rollingStd([1e9 + 0.1] * 5, 3).tolist() == [0.0] * 5
+  # Values of a wide range, eg, volumed rising from 1e5 to 1e10.
+  values = numpy.logspace(5, 10, 500) * (1 + 0.1 * numpy.sin(numpy.arange(500)))
+  for window in [5, 20]:
+    expected = [numpy.std(values[max(0, i-window+1):i+1])
+                for i in range(len(values))]
+    assert numpy.allclose(util.rollingStd(values, window), expected,
+                          rtol=1e-9, atol=0)
+  # Values jumping within a block.
+  values = numpy.concatenate([1e8 + numpy.arange(10.0) % 3, numpy.arange(10.0)])
+  for window in [3, 7]:
+    expected = [numpy.std(values[max(0, i-window+1):i+1])
+                for i in range(len(values))]
+    assert numpy.allclose(util.rollingStd(values, window), expected,
+                          rtol=1e-9, atol=1e-9)
+  checkFloatLists([0.0, 1.0, 0.0], util.rollingZscore([1.0, 3.0, 3.0], 2))
+  # Sums of 0/1 indicators are exact, eg, no -0.0 when printed.
+  holes = (numpy.random.RandomState(0).rand(2000) > 0.95).astype(float)
+  sums = util.rollingSum(holes, 250)
+  assert sums.tolist() == [holes[max(0, i-249):i+1].sum()
+                           for i in range(len(holes))]
+  assert '-' not in ''.join(['%f' % value for value in sums / 250])
+  checkFloatLists([1.0, 2.0, 3.5], util.rollingEwm([1.0, 3.0, 5.0], 3))
+  assert len(util.rollingMean([], 3)) == 0
+
 def test_getPreviousYmd():
   assert util.getPreviousYmd('2000-01-01', 0) == '2000-01-01'
   assert util.getPreviousYmd('2000-01-01', 1) == '1999-12-31'
   assert util.getPreviousYmd('2000-01-01', 365) == '1999-01-01'
   assert util.getPreviousYmd('2000-01-01', 366) == '1998-12-31'
 
+
+def test_ymdsToDays():
+  assert list(util.ymdsToDays(['1970-01-01', '1970-01-02', '1970-02'])) == [0, 1, 31]
+  assert list(util.ymdsToDays(['*'])) == [util.UNDATED_DAY]
+  assert util.daysToYmds(util.ymdsToDays(['1969-12-31', '2015-06-01'])) == ['1969-12-31', '2015-06-01']
+  assert util.daysToYmds(util.ymdsToDays(['*'])) == ['*']
+
+def test_featureStore(tmpdir):
+  store_file = str(tmpdir.join('feature.fs'))
+  writer = util.FeatureStoreWriter(store_file)
+  writer.write('B', ['2010-01-04', '2010-01-05', '2010-01-06'], [1.5, -2.0, 3.25])
+  writer.write('A', ['*'], [7.0])
+  writer.write('C', [], [])
+  writer.close()
+  store = util.FeatureStore(store_file)
+  assert store.getTickers() == ['A', 'B', 'C']
+  assert not store.hasTicker('D')
+  assert store.readKeyListValueList('A') == (['*'], [7.0])
+  assert store.readKeyListValueList('B') == (
+      ['2010-01-04', '2010-01-05', '2010-01-06'], [1.5, -2.0, 3.25])
+  assert store.readKeyListValueList('C') == ([], [])
+  assert store.source is None
+
+def test_isFeatureStoreCurrent(tmpdir):
+  feature_dir = tmpdir.mkdir('feature')
+  feature_dir.join('A').write('2015-01-02\t1.5\n')
+  store_file = str(tmpdir.join('feature.fs'))
+  writer = util.FeatureStoreWriter(store_file,
+                                   source=util.getFeatureSource(str(feature_dir)))
+  writer.write('A', ['2015-01-02'], [1.5])
+  writer.close()
+  assert util.isFeatureStoreCurrent(util.FeatureStore(store_file),
+                                    str(feature_dir))
+  # Stores without a feature dir are current.
+  assert util.isFeatureStoreCurrent(util.FeatureStore(store_file),
+                                    str(tmpdir.join('none')))
+  # Recomputing the feature makes the store out of date.
+  feature_dir.join('A').write('2015-01-02\t1.5\n2015-01-05\t2\n')
+  assert not util.isFeatureStoreCurrent(util.FeatureStore(store_file),
+                                        str(feature_dir))
+
+def test_npyWriter(tmpdir):
+  npy_file = str(tmpdir.join('data'))
+  writer = util.NpyWriter(npy_file, 3)
+  writer.write(numpy.array([[1.0, float('nan'), 3.0]]))
+  writer.write(numpy.zeros((0, 3)))
+  writer.write(numpy.array([[4.0, 5.0, 6.5], [7.0, 8.0, 9.0]]))
+  writer.close()
+  assert util.isNpyFile(npy_file)
+  data = util.readMatrix(npy_file, mmap_mode='r')
+  assert data.shape == (3, 3)
+  assert data.dtype == numpy.float32
+  assert numpy.isnan(data[0, 1])
+  assert data[1, 2] == 6.5
+  vector_file = str(tmpdir.join('label'))
+  writer = util.NpyWriter(vector_file, dtype='float64')
+  writer.write([0.0, 1.0])
+  writer.close()
+  assert list(util.readMatrix(vector_file)) == [0.0, 1.0]
+
+def test_readMatrix_text(tmpdir):
+  text_file = tmpdir.join('data')
+  text_file.write('1.000000 nan\n2.000000 3.000000\n')
+  assert not util.isNpyFile(str(text_file))
+  data = util.readMatrix(str(text_file))
+  assert data.shape == (2, 2)
+  assert numpy.isnan(data[0, 1])
+
+def test_selectMatrixRows(tmpdir):
+  text_file = tmpdir.join('text')
+  text_file.write('0\n1\n2\n3\n')
+  util.selectMatrixRows(str(text_file), [1, 3], str(tmpdir.join('text_out')))
+  assert tmpdir.join('text_out').read() == '1\n3\n'
+  npy_file = str(tmpdir.join('npy'))
+  util.writeMatrix(numpy.arange(8.0).reshape(4, 2), npy_file)
+  util.selectMatrixRows(npy_file, [1, 3], str(tmpdir.join('npy_out')))
+  assert util.readMatrix(str(tmpdir.join('npy_out'))).tolist() == [[2.0, 3.0], [6.0, 7.0]]
+
+def test_runSteps():
+  order = []
+  def makeStep(name, ran=True):
+    def function():
+      order.append(name)
+      if not ran:
+        return False
+    return function
+  steps = [
+      ['a', makeStep('a'), ['/raw'], ['/x/a']],
+      ['b', makeStep('b', False), ['/raw'], ['/y']],
+      ['c', makeStep('c'), ['/x'], ['/z']],
+      ['d', makeStep('d'), ['/y', '/z/d'], ['/w']],
+  ]
+  assert util.getStepDeps(steps) == [set(), set(), set([0]), set([1, 2])]
+  times = util.runSteps(steps, 2)
+  assert order.index('a') < order.index('c') < order.index('d')
+  assert order.index('b') < order.index('d')
+  assert sorted([name for name, seconds in times]) == ['a', 'c', 'd']
+
+  def fail():
+    assert False
+  order = []
+  steps[1][1] = fail
+  try:
+    util.runSteps(steps, 1)
+    assert False, 'expected failure'
+  except AssertionError as e:
+    assert 'failed steps: b' in str(e)
+  assert 'd' not in order
+
+def test_getStepDeps():
+  # Write after read: b writes what a reads.
+  assert util.getStepDeps([['a', None, ['/x'], ['/y']],
+                           ['b', None, ['/raw'], ['/x/b']]]) == [
+      set(), set([0])]
+  # Write after write: b writes under what a writes.
+  assert util.getStepDeps([['a', None, ['/raw'], ['/x']],
+                           ['b', None, ['/raw'], ['/x/b']]]) == [
+      set(), set([0])]
+  # Steps only reading the same paths are independent.
+  assert util.getStepDeps([['a', None, ['/raw'], ['/x']],
+                           ['b', None, ['/raw'], ['/y']]]) == [set(), set()]
+
+def test_getStepReaders():
+  # Only b reads what a writes, c writes it.
+  assert util.getStepReaders([['a', None, ['/raw'], ['/x']],
+                              ['b', None, ['/x/b'], ['/y']],
+                              ['c', None, ['/raw'], ['/x/c']],
+                              ['d', None, ['/y', '/x'], ['/z']]]) == {
+      'a': ['b', 'd'], 'b': ['d'], 'c': ['d'], 'd': []}
+
+def test_manifest(tmpdir):
+  raw_dir = tmpdir.mkdir('raw')
+  raw_dir.join('A.csv').write('a')
+  raw_dir.join('B.csv').write('b')
+  day_file = tmpdir.join('days')
+  day_file.write('2015-01-02')
+  inputs = [str(raw_dir), str(day_file)]
+  ticker_inputs = ['%s/{ticker}.csv' % raw_dir]
+  previous = util.buildManifest(inputs, [inputs, 1])
+  assert sorted(previous['files']) == sorted([
+      str(raw_dir.join('A.csv')), str(raw_dir.join('B.csv')), str(day_file)])
+
+  manifest = util.buildManifest(inputs, [inputs, 1], previous)
+  assert util.getChangedTickers(previous, manifest, ticker_inputs) == []
+  # Rewriting with the same content is not a change.
+  raw_dir.join('A.csv').write('a')
+  raw_dir.join('B.csv').write('bb')
+  raw_dir.join('C.csv').write('c')
+  manifest = util.buildManifest(inputs, [inputs, 1], previous)
+  assert util.getChangedTickers(previous, manifest, ticker_inputs) == [
+      'B', 'C']
+  # Changes of other files or params affect all tickers.
+  manifest = util.buildManifest(inputs, [inputs, 2], previous)
+  assert util.getChangedTickers(previous, manifest, ticker_inputs) is None
+  day_file.write('2015-01-05')
+  manifest = util.buildManifest(inputs, [inputs, 1], previous)
+  assert util.getChangedTickers(previous, manifest, ticker_inputs) is None
+  # Appending to append inputs does not change any ticker.
+  previous = util.buildManifest(inputs, [inputs, 1])
+  day_file.write('2015-01-05\n2015-01-06\n')
+  manifest = util.buildManifest(inputs, [inputs, 1], previous)
+  assert util.getChangedTickers(previous, manifest, ticker_inputs,
+                                [str(day_file)]) == []
+  assert util.getChangedTickers(previous, manifest, ticker_inputs) is None
+  previous = manifest
+  day_file.write('2015-01-03\n2015-01-05\n2015-01-06\n')
+  manifest = util.buildManifest(inputs, [inputs, 1], previous)
+  assert util.getChangedTickers(previous, manifest, ticker_inputs,
+                                [str(day_file)]) is None
+
+def test_readLastLine(tmpdir):
+  path = tmpdir.join('f')
+  path.write('')
+  assert util.readLastLine(str(path)) is None
+  path.write('a\tb')
+  assert util.readLastLine(str(path)) == 'a\tb'
+  path.write('a\nbb\nccc\n')
+  assert util.readLastLine(str(path)) == 'ccc'
+  assert util.readLastLine(str(path), block_size=2) == 'ccc'
+  assert util.readLastLine(str(path), block_size=4) == 'ccc'
+
+def test_readSf1Table(tmpdir):
+  sf1_file = tmpdir.join('ARQ.tsv')
+  sf1_file.write('date\tA\tB\n2001-03-31\t\t2.5\n2000-12-31\t1.0\t2.0\n')
+  assert util.readSf1Table(str(tmpdir.join('ART.tsv'))) is None
+  for i in range(2):
+    # The second read is from cache.
+    dates, indicators, values = util.readSf1Table(str(sf1_file))
+    assert tmpdir.join('ARQ.tsv.npz').check()
+    assert dates == ['2000-12-31', '2001-03-31']
+    assert indicators == ['A', 'B']
+    assert values[0].tolist() == [1.0, 2.0]
+    assert numpy.isnan(values[1, 0]) and values[1, 1] == 2.5
+  sf1_file.write('date\tC\n2002-03-31\t3.0\n')
+  assert util.readSf1Table(str(sf1_file))[1] == ['C']
+
+def checkPanel(expected, actual):
+  assert numpy.array_equal(numpy.isnan(expected), numpy.isnan(actual))
+  assert numpy.allclose(numpy.nan_to_num(expected), numpy.nan_to_num(actual))
+
+def test_readPanel(tmpdir):
+  feature_dir = tmpdir.mkdir('feature')
+  feature_dir.join('A').write('2015-01-02\t1.5\n2015-01-06\t2.5\n')
+  feature_dir.join('B').write('2015-01-05\t-1\n')
+  for i in range(2):
+    dates, tickers, values = util.readPanel(str(feature_dir))
+    assert dates == ['2015-01-02', '2015-01-05', '2015-01-06']
+    assert tickers == ['A', 'B']
+    assert values.dtype == numpy.float32
+    checkPanel([[1.5, nan], [nan, -1.0], [2.5, nan]], values)
+  assert isinstance(values, numpy.memmap)
+  assert tmpdir.join('feature.panel-float32.npy').check()
+  # Cache is rebuilt when the feature changes.
+  feature_dir.join('C').write('2015-01-01\t3\n')
+  dates, tickers, values = util.readPanel(str(feature_dir))
+  assert tickers == ['A', 'B', 'C'] and len(dates) == 4
+
+def test_panelLookups():
+  values = [[1.0, nan], [nan, 3.0], [2.0, nan], [nan, nan]]
+  checkPanel([[1.0, nan], [1.0, 3.0], [2.0, 3.0], [2.0, 3.0]],
+             util.forwardFill(numpy.array(values)))
+  dates = ['2015-01', '2015-02', '2015-03', '2015-04']
+  checkPanel([[nan, nan], [1.0, 3.0], [2.0, 3.0]],
+             util.asOfRows(dates, values, ['2014-12', '2015-02', '2015-09']))
+  checkPanel([[nan, 3.0], [nan, nan]],
+             util.exactRows(dates, values, ['2015-02', '2015-09']))
+  assert util.asOfRows([], numpy.zeros((0, 2)), ['2015-01']).shape == (1, 2)
+  query_tickers = ['B', 'A', 'A', 'C']
+  query_dates = ['2015-02', '2015-02', '2014-12', '2015-01']
+  checkPanel([3.0, nan, nan, nan],
+             util.lookupValues(dates, ['A', 'B'], values, query_tickers,
+                               query_dates))
+  checkPanel([3.0, 1.0, nan, nan],
+             util.lookupValues(dates, ['A', 'B'], values, query_tickers,
+                               query_dates, as_of=True))
+
+def test_crossSectionalPercs():
+  values = numpy.array([[3.0, 1.0, 2.0], [nan, 5.0, nan], [1.0, 1.0, nan]])
+  checkPanel([[2.0/3, 0.0, 1.0/3], [nan, 0.5, nan], [0.0, 0.5, nan]],
+             util.crossSectionalPercs(values, True))
+  checkPanel([[1.0, 0.0, 0.5], [nan, 0.5, nan], [0.5, 0.5, nan]],
+             util.crossSectionalPercs(values, False))
+
+def test_crossSectionalRanks():
+  values = numpy.array([[2.0, 1.0, 2.0, nan, 2.0], [nan, nan, nan, nan, 0.0]])
+  checkPanel([[1.0, 0.0, 2.0, nan, 3.0], [nan, nan, nan, nan, 0.0]],
+             util.crossSectionalRanks(values))
+  checkPanel([[2.0, 0.0, 2.0, nan, 2.0], [nan, nan, nan, nan, 0.0]],
+             util.crossSectionalRanks(values, True))
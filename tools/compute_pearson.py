@@ -28,12 +28,14 @@
     If --group_output_file is set, features are grouped by their
     prefix (before _) and Pearson coeff is computed within each group.
       <prefix> <feature1> <feature2> <pearson> <p-value>
+
+    --data_file can be either text or npy format (see collect_data.py).
 """
 
-from numpy import loadtxt
 from scipy.stats import pearsonr
 from sklearn.preprocessing import Imputer
 import argparse
+import numpy
 
 MIN_VALUE = float('-Inf')
 MAX_VALUE = float('Inf')
@@ -43,6 +45,8 @@ TMP_LABEL_FILE = '/tmp/pearson_label'
 
 MAX_GROUP_SIZE = 10
 
+NPY_MAGIC = '\x93NUMPY'
+
 def readKeyValueDict(kv_file):
   with open(kv_file, 'r') as fp:
     lines = fp.read().splitlines()
@@ -53,6 +57,11 @@ def readKeyValueDict(kv_file):
     kv[k] = float(v)
   return kv
 
+# Data file can be text or npy (see util.readMatrix in qd3).
+def isNpyFile(data_file):
+  with open(data_file, 'rb') as fp:
+    return fp.read(len(NPY_MAGIC)) == NPY_MAGIC
+
 def filter(args):
   counter = {
       'between_neg_pos': 0,
@@ -63,14 +72,19 @@ def filter(args):
       'selected': 0,
   }
 
+  # For npy data, selected rows are memory-mapped instead of copied
+  # through tmp files.
+  use_npy = isNpyFile(args.data_file)
   ifps = {
-      'data': open(args.data_file, 'r'),
       'meta': open(args.meta_file, 'r'),
   }
   ofps = {
-      'data': open(TMP_DATA_FILE, 'w'),
       'label': open(TMP_LABEL_FILE, 'w'),
   }
+  if not use_npy:
+    ifps['data'] = open(args.data_file, 'r')
+    ofps['data'] = open(TMP_DATA_FILE, 'w')
+  rows = []
 
   use_price = (args.min_price != MIN_VALUE or args.max_price != MAX_VALUE)
   use_volatility = (args.min_volatility != MIN_VALUE or args.max_volatility != MAX_VALUE)
@@ -79,16 +93,23 @@ def filter(args):
   prices = None
   volatilities = None
 
+  row = -1
   while True:
-    data_line = ifps['data'].readline()
     meta_line = ifps['meta'].readline()
-    if data_line == '':
-      assert meta_line == '', 'inconsistent line count between data/meta'
-      break
-    assert data_line.endswith('\n')
+    if use_npy:
+      if meta_line == '':
+        break
+      data_line = None
+    else:
+      data_line = ifps['data'].readline()
+      if data_line == '':
+        assert meta_line == '', 'inconsistent line count between data/meta'
+        break
+      assert data_line.endswith('\n')
+      data_line = data_line[:-1]
     assert meta_line.endswith('\n')
-    data_line = data_line[:-1]
     meta_line = meta_line[:-1]
+    row += 1
 
     ticker, date, _, gain = meta_line.split('\t')
     if ticker != prev_ticker:
@@ -127,7 +148,10 @@ def filter(args):
         continue
 
     counter['selected'] += 1
-    print >> ofps['data'], data_line
+    if use_npy:
+      rows.append(row)
+    else:
+      print >> ofps['data'], data_line
     print >> ofps['label'], '%f' % label
 
   for fp in ifps.itervalues():
@@ -136,6 +160,9 @@ def filter(args):
     fp.close()
 
   print counter
+  if use_npy:
+    return numpy.load(args.data_file, mmap_mode='r')[rows]
+  return numpy.loadtxt(TMP_DATA_FILE)
 
 def getGroups(features):
   groups = dict()  # prefix => [features]
@@ -152,14 +179,13 @@ def getGroups(features):
   return groups
 
 def computePearson(args):
-  filter(args)
+  X = filter(args)
 
   with open(args.feature_file, 'r') as fp:
     features = [line for line in fp.read().splitlines()
                 if not line.startswith('#')]
 
-  X = loadtxt(TMP_DATA_FILE)
-  y = loadtxt(TMP_LABEL_FILE)
+  y = numpy.loadtxt(TMP_LABEL_FILE)
 
   assert X.shape[0] == y.shape[0]
   assert X.shape[1] == len(features)
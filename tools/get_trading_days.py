@@ -2,61 +2,27 @@
 
 import argparse
 import bisect
-import datetime
 import os
+import sys
+
+# Counting is shared with get_yahoo_trading_days.py in the parent dir.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import get_yahoo_trading_days
 
 THRESHOLDS = [0.9, 0.95, 0.99]
 
 def getTradingDays(args):
-  tickers = sorted([f[:f.rfind('.')] for f in os.listdir(args.raw_dir)
-                    if f.endswith('.csv')])
-
-  data_map = dict()  # ticker => {dates}
-  range_map = dict()  # ticker => (min_date, max_date)
-  min_date = '9999-99-99'
-  max_date = '0000-00-00'
-
-  for ticker in tickers:
-    with open('%s/%s.csv' % (args.raw_dir, ticker), 'r') as fp:
-      lines = fp.read().splitlines()
-    assert len(lines) > 0
-    assert lines[0] == 'Date,Open,High,Low,Close,Volume,Adj Close'
-    dates = set()
-    for i in range(1, len(lines)):
-      date = lines[i][:lines[i].find(',')]
-      y, m, d = date.split('-')
-      if y < args.min_year:
-        continue
-      dates.add(date)
-      min_date = min(min_date, date)
-      max_date = max(max_date, date)
-    if len(dates) == 0:
-      continue
-    data_map[ticker] = dates
-    range_map[ticker] = (min(dates), max(dates))
-
+  ticker_dates = get_yahoo_trading_days.readTickerDates(args.raw_dir,
+                                                        args.min_year)
+  dates, trading_counts, total_counts = (
+      get_yahoo_trading_days.countTradingDays(ticker_dates))
   print 'loaded %d tickers, min date: %s, max date: %s' % (
-      len(data_map), min_date, max_date)
+      len(ticker_dates), dates[0], dates[-1])
 
   count_map = dict()  # date => (trading_count, total_count)
-  min_date_obj = datetime.datetime.strptime(min_date, '%Y-%m-%d')
-  max_date_obj = datetime.datetime.strptime(max_date, '%Y-%m-%d')
-  assert min_date_obj <= max_date_obj
-  step = datetime.timedelta(1)
-  date_obj = min_date_obj
-  while date_obj <= max_date_obj:
-    date = date_obj.strftime('%Y-%m-%d')
-    trading_count = 0
-    total_count = 0
-    for ticker, dates in data_map.iteritems():
-      min_date, max_date = range_map[ticker]
-      if date < min_date or date > max_date:
-        continue
-      total_count += 1
-      if date in dates:
-        trading_count += 1
-    count_map[date] = (trading_count, total_count)
-    date_obj += step
+  for i in range(len(dates)):
+    if total_counts[i] > 0:
+      count_map[dates[i]] = (int(trading_counts[i]), int(total_counts[i]))
 
   year_count_map = dict()  # year => [(date, trading_count, total_count, ratio)]
   for date, counts in count_map.iteritems():
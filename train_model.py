@@ -13,7 +13,10 @@
     data within [2009-12-13, 2010-12-13] for training.
 
     For simplicity, it dumps selected portions of features and labels
-    to temp files.  This can be improved.
+    to temp files (in the same text or npy format as the input files).
+    Alternatively, with --index_dir, eligible rows are indexed by date once
+    (see buildTrainIndex()) and each training period is read as a
+    memory-mapped slice of the index without tmp files.
 """
 
 from sklearn.ensemble import *
@@ -23,15 +26,30 @@ from sklearn.tree import *
 import argparse
 import imputer_wrapper
 import logging
+import multiprocessing
 import numpy
 import os
 import pickle
+import re
 import util
 
 MIN_SAMPLES = 10000
 
-def selectData(data_file, label_file, meta_file, weight_file, train_meta_file,
-               date, months, tmp_data_file, tmp_label_file, tmp_weight_file):
+# Files of a train index, see buildTrainIndex().
+INDEX_DATES = 'dates'
+INDEX_DATA = 'data'
+INDEX_LABEL = 'label'
+INDEX_WEIGHT = 'weight'
+INDEX_CHUNK_ROWS = 100000
+
+# Max mean absolute difference of predictions between an updated model and
+# the fully retrained one before warning, see checkParity().
+PARITY_TOLERANCE = 0.05
+
+def getTrainingPeriod(date, months):
+  """ Returns [first_ymd, last_ymd] of the training period (inclusive),
+      see module doc.
+  """
   if date.find('-') < 0:  # backward compatible
     assert len(date) == 6
     items = [date[:4], date[4:]]
@@ -56,16 +74,15 @@ def selectData(data_file, label_file, meta_file, weight_file, train_meta_file,
       first_ymd = '%s-%s' % (first_ym, d)
   logging.info('training period: %s - %s' % (first_ymd, last_ymd))
   assert first_ymd <= last_ymd
+  return first_ymd, last_ymd
 
-  data_ifp = open(data_file, 'r')
-  data_ofp = open(tmp_data_file, 'w')
-  label_ifp = open(label_file, 'r')
-  label_ofp = open(tmp_label_file, 'w')
-  if weight_file:
-    weight_ifp = open(weight_file, 'r')
-  if tmp_weight_file:
-    weight_ofp = open(tmp_weight_file, 'w')
-
+def selectRows(meta_file, train_meta_file, first_ymd='0000-00-00',
+               last_ymd='9999-99-99'):
+  """ Returns [rows, dates] of rows within [first_ymd, last_ymd] and
+      train_meta_file (if not None).
+  """
+  rows = []
+  dates = []
   meta_fp = open(meta_file, 'r')
   if train_meta_file is None:
     train_meta_fp = None
@@ -74,22 +91,12 @@ def selectData(data_file, label_file, meta_file, weight_file, train_meta_file,
     train_meta_fp = open(train_meta_file, 'r')
     train_meta = train_meta_fp.readline()
 
-  count = 0
+  row = -1
   while True:
     meta = meta_fp.readline()
     if meta == '':
-      assert data_ifp.readline() == ''
-      assert label_ifp.readline() == ''
-      if weight_file:
-        assert weight_ifp.readline() == ''
       break
-    data = data_ifp.readline()
-    label = label_ifp.readline()
-    assert data != ''
-    assert label != ''
-    if weight_file:
-      weight = weight_ifp.readline()
-      assert weight != ''
+    row += 1
 
     if train_meta is not None:
       if meta != train_meta:
@@ -100,41 +107,95 @@ def selectData(data_file, label_file, meta_file, weight_file, train_meta_file,
     ticker, date, tmp1, tmp2 = meta[:-1].split('\t')
     if date < first_ymd or date > last_ymd:
       continue
-    assert data[-1] == '\n'
-    assert label[-1] == '\n'
-    print >> data_ofp, data[:-1]
-    print >> label_ofp, label[:-1]
-    if tmp_weight_file:
-      assert weight[-1] == '\n'
-      print >> weight_ofp, weight[:-1]
-    count += 1
-    
-  logging.info('selected %d training samples' % count)
-  data_ifp.close()
-  data_ofp.close()
-  label_ifp.close()
-  label_ofp.close()
-  if weight_file:
-    weight_ifp.close()
-  if tmp_weight_file:
-    weight_ofp.close()
+    rows.append(row)
+    dates.append(date)
+
   meta_fp.close()
   if train_meta_fp is not None:
     train_meta_fp.close()
+  return rows, dates
+
+def selectData(data_file, label_file, meta_file, weight_file, train_meta_file,
+               date, months, tmp_data_file, tmp_label_file, tmp_weight_file):
+  first_ymd, last_ymd = getTrainingPeriod(date, months)
+  rows, dates = selectRows(meta_file, train_meta_file, first_ymd, last_ymd)
+  logging.info('selected %d training samples' % len(rows))
+
+  # Data/label/weight files can be text or npy (see util.readMatrix), and
+  # tmp files are written in the same format.
+  util.selectMatrixRows(data_file, rows, tmp_data_file)
+  util.selectMatrixRows(label_file, rows, tmp_label_file)
+  if tmp_weight_file:
+    util.selectMatrixRows(weight_file, rows, tmp_weight_file)
+
+def buildTrainIndex(data_file, label_file, meta_file, weight_file,
+                    train_meta_file, index_dir):
+  """ Builds a train index under index_dir: all rows of data/label/weight in
+      train_meta_file, sorted by date and written as npy files, plus their
+      dates.  The training period of any model is then a contiguous range of
+      rows (see selectIndexData()).  Rows of the same date keep their order.
+  """
+  util.maybeMakeDir(index_dir)
+  rows, dates = selectRows(meta_file, train_meta_file)
+  dates = numpy.array(dates, dtype=str)
+  order = numpy.argsort(dates, kind='mergesort')
+  rows = numpy.array(rows, dtype=numpy.int64)[order]
+  util.writeMatrix(dates[order], '%s/%s' % (index_dir, INDEX_DATES))
+  for name, matrix_file in [[INDEX_DATA, data_file],
+                            [INDEX_LABEL, label_file],
+                            [INDEX_WEIGHT, weight_file]]:
+    if not matrix_file:
+      continue
+    matrix = util.readMatrix(matrix_file, mmap_mode='r')
+    columns = None
+    if len(matrix.shape) > 1:
+      columns = matrix.shape[1]
+    writer = util.NpyWriter('%s/%s' % (index_dir, name), columns, matrix.dtype)
+    for i in range(0, rows.shape[0], INDEX_CHUNK_ROWS):
+      writer.write(matrix[rows[i:i+INDEX_CHUNK_ROWS]])
+    writer.close()
+  logging.info('indexed %d training samples' % rows.shape[0])
+
+def loadTrainIndex(index_dir):
+  """ Loads train index built by buildTrainIndex().  Matrices are memory-mapped
+      copy-on-write so in-place imputation does not touch the index files
+      (but does change them for this process, so copy slices that are
+      imputed if the index is reused).
+  """
+  index = {INDEX_DATES: util.readMatrix('%s/%s' % (index_dir, INDEX_DATES))}
+  for name in [INDEX_DATA, INDEX_LABEL, INDEX_WEIGHT]:
+    matrix_file = '%s/%s' % (index_dir, name)
+    if os.path.isfile(matrix_file):
+      index[name] = util.readMatrix(matrix_file, mmap_mode='c')
+  return index
+
+def selectIndexData(index, date, months):
+  """ Returns [X, y, w] of the training period as views into the train index
+      (w is None if the index has no weight).
+  """
+  first_ymd, last_ymd = getTrainingPeriod(date, months)
+  dates = index[INDEX_DATES]
+  start = numpy.searchsorted(dates, first_ymd, side='left')
+  end = numpy.searchsorted(dates, last_ymd, side='right')
+  logging.info('selected %d training samples' % (end - start))
+  w = None
+  if INDEX_WEIGHT in index:
+    w = index[INDEX_WEIGHT][start:end]
+  return index[INDEX_DATA][start:end], index[INDEX_LABEL][start:end], w
 
 def trainModel(data_file, label_file, weight_file, model_def, perc, imputer_strategy,
                model_file, imputer_file):
-  X = numpy.loadtxt(data_file)
-  y = numpy.loadtxt(label_file)
+  X = util.readMatrix(data_file)
+  y = util.readMatrix(label_file)
+  w = None
   if weight_file:
-    w = numpy.loadtxt(weight_file)
-  if X.shape[0] < MIN_SAMPLES:
-    logging.info('too few samples: required %d, got %d' % (MIN_SAMPLES, X.shape[0]))
-    return
-
-  imputer = imputer_wrapper.ImputerWrapper(strategy=imputer_strategy)
-  X = imputer.fit_transform(X)
+    w = util.readMatrix(weight_file)
+  fitModel(X, y, w, model_def, perc, imputer_strategy, model_file,
+           imputer_file)
 
+def sampleData(X, y, w, perc):
+  """ Returns [X, y, w] randomly sampled by perc (see --perc).
+  """
   if perc > 0 and perc != 1:
     logging.info('sampling %f data for training' % perc)
     if perc > 1:
@@ -147,20 +208,229 @@ def trainModel(data_file, label_file, weight_file, model_def, perc, imputer_stra
       index = numpy.random.permutation(X.shape[0])[:m]
       X = X[index, :]
       y = y[index]
-      if weight_file:
+      if w is not None:
         w = w[index]
+  return X, y, w
 
-  model = eval(model_def)
-  if weight_file:
-    model.fit(X, y, w)
-  else:
-    model.fit(X, y)
-
+def saveModel(model, imputer, model_file, imputer_file):
   with open(model_file, 'wb') as fp:
     pickle.dump(model, fp)
   with open(imputer_file, 'wb') as fp:
     pickle.dump(imputer, fp)
 
+def fitModel(X, y, w, model_def, perc, imputer_strategy, model_file,
+             imputer_file):
+  """ Fits model on X, y and optional weight w, and writes the model and
+      imputer.  X may be imputed in place.  Returns [model, imputer], or None
+      if there are too few samples.
+  """
+  if X.shape[0] < MIN_SAMPLES:
+    logging.info('too few samples: required %d, got %d' % (MIN_SAMPLES, X.shape[0]))
+    return None
+
+  imputer = imputer_wrapper.ImputerWrapper(strategy=imputer_strategy)
+  X = imputer.fit_transform(X)
+  X, y, w = sampleData(X, y, w, perc)
+
+  model = eval(model_def)
+  if w is not None:
+    model.fit(X, y, sample_weight=w)
+  else:
+    model.fit(X, y)
+
+  saveModel(model, imputer, model_file, imputer_file)
+  return model, imputer
+
+# Train index of the current process, set by initIndex().
+INDEX = dict()
+
+def initIndex(index_dir):
+  INDEX.clear()
+  INDEX.update(loadTrainIndex(index_dir))
+
+def getModelJobs(model_def):
+  """ Returns n_jobs of model_def, where -1 means all cpus.
+  """
+  match = re.search(r'n_jobs\s*=\s*(-?\d+)', model_def)
+  if match is None:
+    return 1
+  n_jobs = int(match.group(1))
+  if n_jobs < 0:
+    return multiprocessing.cpu_count()
+  return max(1, n_jobs)
+
+def getWorkers(model_def, workers):
+  """ Returns number of worker processes for training models with model_def.
+      If workers <= 0, use as many as cpus allow given n_jobs of the model.
+  """
+  n_jobs = getModelJobs(model_def)
+  cpus = multiprocessing.cpu_count()
+  if workers <= 0:
+    workers = max(1, cpus / n_jobs)
+  if workers * n_jobs > cpus:
+    logging.warning('%d workers x %d jobs exceed %d cpus' % (
+        workers, n_jobs, cpus))
+  return workers
+
+def trainIndexModel(job):
+  date, months, model_def, perc, imputer_strategy, model_file, imputer_file = (
+      job)
+  X, y, w = selectIndexData(INDEX, date, months)
+  # Copy the slice since the index is reused by later jobs and imputation
+  # is in place.
+  fitModel(numpy.array(X), y, w, model_def, perc, imputer_strategy,
+           model_file, imputer_file)
+  return date
+
+def trainModels(index_dir, jobs, workers=1, update=False, estimators=10,
+                checkpoint=0, max_estimators=0):
+  """ Walk-forward training: trains all models of jobs, each being
+      [date, months, model_def, perc, imputer_strategy, model_file,
+       imputer_file], from the train index in index_dir, which is loaded
+      once per process.  Models are trained in this process, or by a pool of
+      workers processes if workers > 1.  If update is True, models are
+      updated incrementally in this process instead (see updateModels()).
+      Yields dates of jobs in order as their models are trained.
+  """
+  if update:
+    initIndex(index_dir)
+    for date in updateModels(jobs, estimators, checkpoint, max_estimators):
+      yield date
+    return
+  if workers > 1:
+    pool = multiprocessing.Pool(workers, initIndex, [index_dir])
+    try:
+      for date in pool.imap(trainIndexModel, jobs):
+        yield date
+      pool.close()
+    finally:
+      # Stops workers also if the generator is closed or raises early.
+      pool.terminate()
+      pool.join()
+    return
+  initIndex(index_dir)
+  for job in jobs:
+    yield trainIndexModel(job)
+
+def getUpdateMethod(model):
+  """ Returns how model can be updated with new rows: 'partial_fit',
+      'warm_start' (ensembles only, adding estimators fit on new rows) or
+      None if not supported.
+  """
+  if hasattr(model, 'partial_fit'):
+    return 'partial_fit'
+  params = model.get_params()
+  if 'warm_start' in params and 'n_estimators' in params:
+    return 'warm_start'
+  return None
+
+def updateModel(model, X, y, w, estimators, max_estimators):
+  """ Updates model in place with new rows X, y and optional weight w.
+      Returns whether it was updated.  For warm_start, adds estimators fit on
+      the new rows, so the ensemble grows with each update until it has
+      max_estimators (if > 0).  After that the oldest estimators are dropped
+      to make room if they are independent (eg, forests), otherwise (eg,
+      boosting stages) the model is not updated and should be retrained.
+  """
+  method = getUpdateMethod(model)
+  assert method is not None, 'cannot update %s' % type(model).__name__
+  if method == 'partial_fit':
+    if w is not None:
+      model.partial_fit(X, y, sample_weight=w)
+    else:
+      model.partial_fit(X, y)
+    return True
+  n_estimators = model.n_estimators + estimators
+  if max_estimators > 0 and n_estimators > max_estimators:
+    if not isinstance(model.estimators_, list):
+      return False
+    keep = max(max_estimators - estimators, 0)
+    drop = len(model.estimators_) - keep
+    model.estimators_ = model.estimators_[drop:]
+    if hasattr(model, 'estimators_features_'):  # bagging
+      model.estimators_features_ = model.estimators_features_[drop:]
+    n_estimators = keep + estimators
+  model.set_params(warm_start=True, n_estimators=n_estimators)
+  if w is not None:
+    model.fit(X, y, sample_weight=w)
+  else:
+    model.fit(X, y)
+  return True
+
+def predictScores(model, X):
+  if hasattr(model, 'predict_proba'):
+    return model.predict_proba(X)[:, 1]
+  return model.predict(X)
+
+def checkParity(model, imputer, full_model, full_imputer, X, date):
+  """ Logs and returns the mean absolute difference between predictions of
+      the updated model and the fully retrained model on X.
+  """
+  scores = predictScores(model, imputer.transform(numpy.array(X)))
+  full_scores = predictScores(full_model,
+                              full_imputer.transform(numpy.array(X)))
+  diff = numpy.mean(numpy.abs(scores - full_scores))
+  if diff > PARITY_TOLERANCE:
+    logging.warning('%s: updated model differs from full retraining by %f'
+                    % (date, diff))
+  else:
+    logging.info('%s: updated model differs from full retraining by %f'
+                 % (date, diff))
+  return diff
+
+def updateModels(jobs, estimators, checkpoint, max_estimators=0):
+  """ Incremental walk-forward training from INDEX: the first model is fit on
+      its entire training period, and each later model is updated from the
+      previous one with only rows that became eligible since then, keeping
+      the imputer of the last full fit.  Every checkpoint updates (if > 0)
+      the model is also retrained fully for a parity check (see
+      checkParity()), and the fully retrained model is kept.  Warm_start
+      ensembles are capped at max_estimators, or n_estimators of the full fit
+      if 0, and retrained fully if they cannot be updated within the cap
+      (see updateModel()).  Jobs must have increasing dates and an expanding
+      window (months < 0), see trainModels().  Yields dates of jobs in order.
+  """
+  model, imputer, rows, updates, cap = None, None, 0, 0, 0
+  for job in jobs:
+    (date, months, model_def, perc, imputer_strategy, model_file,
+     imputer_file) = job
+    assert months < 0, 'updating models requires an expanding window'
+    assert perc <= 1, 'updating models does not support sampling by count'
+    X, y, w = selectIndexData(INDEX, date, months)
+    assert X.shape[0] >= rows, 'dates of jobs must be increasing'
+    if model is None:
+      result = fitModel(numpy.array(X), y, w, model_def, perc,
+                        imputer_strategy, model_file, imputer_file)
+      if result is not None:
+        model, imputer = result
+        rows = X.shape[0]
+        cap = max_estimators or model.get_params().get('n_estimators', 0)
+      yield date
+      continue
+
+    logging.info('updating model with %d new samples' % (X.shape[0] - rows))
+    if X.shape[0] > rows:
+      new_w = None
+      if w is not None:
+        new_w = w[rows:]
+      new_X, new_y, new_w = sampleData(
+          imputer.transform(numpy.array(X[rows:])), y[rows:], new_w, perc)
+      updated = updateModel(model, new_X, new_y, new_w, estimators, cap)
+    else:
+      updated = True
+    rows = X.shape[0]
+    updates += 1
+    if not updated or (checkpoint > 0 and updates % checkpoint == 0):
+      full_model, full_imputer = fitModel(
+          numpy.array(X), y, w, model_def, perc, imputer_strategy,
+          model_file, imputer_file)
+      if updated:
+        checkParity(model, imputer, full_model, full_imputer, X, date)
+      model, imputer = full_model, full_imputer
+    else:
+      saveModel(model, imputer, model_file, imputer_file)
+    yield date
+
 def deleteTmpFiles(tmp_data_file, tmp_label_file):
   if os.path.isfile(tmp_data_file):
     os.remove(tmp_data_file)
@@ -198,12 +468,19 @@ def main():
                       help='strategy for filling in missing values')
   parser.add_argument('--model_file', required=True)
   parser.add_argument('--imputer_file', required=True)
-  parser.add_argument('--tmp_data_file', required=True,
+  parser.add_argument('--index_dir',
+                      help='if specified, training data is selected from '
+                           'the train index in this dir (see '
+                           'buildTrainIndex()) instead of --data_file etc, '
+                           'and tmp files are not used')
+  parser.add_argument('--build_index', action='store_true',
+                      help='build the train index in --index_dir first')
+  parser.add_argument('--tmp_data_file',
                       help='location of tmp data file within specified '
                            'training period; this can be used later for '
                            'evaluation, or specify --delete_tmp_files '
                            'to delete it upon finish')
-  parser.add_argument('--tmp_label_file', required=True,
+  parser.add_argument('--tmp_label_file',
                       help='location of tmp label file within specified '
                            'training period; this can be used later for '
                            'evaluation, or specify --delete_tmp_files '
@@ -212,8 +489,6 @@ def main():
   parser.add_argument('--delete_tmp_files', action='store_true')
   args = parser.parse_args()
   util.configLogging()
-  if args.weight_file:
-    assert args.tmp_weight_file, 'must specify --tmp_weight_file since --weight_file is specified'
   # To be backward compatible.
   assert args.date or args.yyyymm, 'must specify --date or --yyyymm'
   assert args.date is None or args.yyyymm is None, 'must specify --date or --yyyymm'
@@ -221,6 +496,21 @@ def main():
     date = args.date
   else:
     date = args.yyyymm
+
+  if args.index_dir:
+    if args.build_index:
+      buildTrainIndex(args.data_file, args.label_file, args.meta_file,
+                      args.weight_file, args.train_meta_file, args.index_dir)
+    X, y, w = selectIndexData(loadTrainIndex(args.index_dir), date,
+                              args.months)
+    fitModel(X, y, w, args.model_def, args.perc, args.imputer_strategy,
+             args.model_file, args.imputer_file)
+    return
+
+  assert args.tmp_data_file and args.tmp_label_file, (
+      'must specify --tmp_data_file and --tmp_label_file')
+  if args.weight_file:
+    assert args.tmp_weight_file, 'must specify --tmp_weight_file since --weight_file is specified'
   selectData(args.data_file, args.label_file, args.meta_file, args.weight_file,
              args.train_meta_file, date, args.months,
              args.tmp_data_file, args.tmp_label_file, args.tmp_weight_file)
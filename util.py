@@ -1,8 +1,16 @@
 from config import SYMBOL_DIR
 import datetime
+import hashlib
+import json
 import logging
 import math
+import multiprocessing.pool
+import numpy
 import os
+import Queue
+import struct
+import time
+import traceback
 
 # Configures logging format.
 def configLogging(level=logging.INFO):
@@ -18,6 +26,11 @@ def markDone(step):
   with open('%s/DONE-%s' % (SYMBOL_DIR, step), 'w') as fp:
     pass
 
+# Marks the specified step as not done.
+def clearDone(step):
+  if checkDone(step):
+    os.remove('%s/DONE-%s' % (SYMBOL_DIR, step))
+
 # Runs command and maybe checks success.
 def run(cmd, check=True, dry_run=False, step=None):
   logging.info('running command: %s' % cmd)
@@ -35,7 +48,12 @@ def run(cmd, check=True, dry_run=False, step=None):
 # Checks and makes dir if not exist.
 def maybeMakeDir(dir):
   if not os.path.isdir(dir):
-    os.makedirs(dir)
+    try:
+      os.makedirs(dir)
+    except OSError:
+      # Dir may have been made concurrently (see runSteps()).
+      if not os.path.isdir(dir):
+        raise
 
 def maybeMakeDirs(dirs):
   for dir in dirs:
@@ -104,6 +122,180 @@ def normalize(values):
     norms[i] /= l2
   return norms
 
+# Same as normalize() on each row of a 2D array.
+def normalizeRows(matrix):
+  matrix = numpy.asarray(matrix, dtype=float)
+  assert matrix.ndim == 2 and matrix.shape[1] > 0
+  if matrix.shape[1] == 1:
+    return numpy.zeros(matrix.shape)
+  norms = matrix - matrix.mean(axis=1)[:, None]
+  l2 = numpy.sqrt((norms ** 2).sum(axis=1))
+  small = l2 < 1e-5
+  l2[small] = 1.0
+  norms /= l2[:, None]
+  norms[small] = 0.0
+  return norms
+
+# Returns a read-only 2D view of values, with view[i] being
+# values[i:i+size], without copying.
+def slidingWindows(values, size):
+  values = numpy.ascontiguousarray(values)
+  assert values.ndim == 1 and size > 0
+  count = max(0, values.shape[0] - size + 1)
+  stride = values.strides[0]
+  return numpy.lib.stride_tricks.as_strided(
+      values, shape=(count, size), strides=(stride, stride), writeable=False)
+
+###################
+## Rolling stats ##
+###################
+
+# Functions below compute a statistic of each trailing window of a 1D array:
+# element i of the result is computed over values[max(0, i-window+1):i+1],
+# ie, the first window-1 windows are partial.  Sums are differenced from
+# cumulative sums, and min/max and std are combined from per-block running
+# stats, so these are O(n) regardless of window; median is O(n * window).
+
+# Returns the number of values in each window.
+def rollingCounts(size, window):
+  assert window > 0
+  return numpy.minimum(numpy.arange(1, size + 1), window).astype(float)
+
+def rollingSum(values, window):
+  values = numpy.asarray(values, dtype=float)
+  assert values.ndim == 1 and window > 0
+  if values.shape[0] == 0:
+    return numpy.zeros(0)
+  # Values are centered to limit rounding errors of long cumulative sums,
+  # unless they are integers (eg, 0/1 indicators), whose sums are exact.
+  offset = 0.0
+  if not numpy.array_equal(values, numpy.floor(values)):
+    offset = values.mean()
+  sums = numpy.concatenate([[0.0], numpy.cumsum(values - offset)])
+  ends = numpy.arange(1, values.shape[0] + 1)
+  starts = numpy.maximum(ends - window, 0)
+  return sums[ends] - sums[starts] + offset * (ends - starts)
+
+def rollingMean(values, window):
+  values = numpy.asarray(values, dtype=float)
+  return rollingSum(values, window) / rollingCounts(values.shape[0], window)
+
+# Computes min or max of each window with the van Herk/Gil-Werman algorithm:
+# values are split into blocks of window size, and each window is covered by
+# a suffix of one block and a prefix of the next.
+def _rollingExtreme(values, window, function, pad):
+  values = numpy.asarray(values, dtype=float)
+  assert values.ndim == 1 and window > 0
+  size = values.shape[0]
+  blocks = (size + 2 * (window - 1)) // window
+  padded = numpy.empty(blocks * window)
+  padded.fill(pad)
+  padded[window-1:window-1+size] = values
+  padded = padded.reshape(blocks, window)
+  prefixes = function.accumulate(padded, axis=1).ravel()
+  suffixes = function.accumulate(padded[:, ::-1], axis=1)[:, ::-1].ravel()
+  ends = numpy.arange(window - 1, window - 1 + size)
+  return function(suffixes[ends - window + 1], prefixes[ends])
+
+def rollingMin(values, window):
+  return _rollingExtreme(values, window, numpy.minimum, numpy.inf)
+
+def rollingMax(values, window):
+  return _rollingExtreme(values, window, numpy.maximum, -numpy.inf)
+
+# Returns function(window values) of each window, where full windows are
+# computed at once on a sliding window view, in O(n * window).
+def _rollingApply(values, window, function):
+  values = numpy.asarray(values, dtype=float)
+  assert values.ndim == 1 and window > 0
+  results = numpy.empty(values.shape[0])
+  for i in range(min(window - 1, values.shape[0])):
+    results[i] = function(values[:i+1])
+  if values.shape[0] >= window:
+    results[window-1:] = function(slidingWindows(values, window), axis=1)
+  return results
+
+# Returns [counts, means, sums of squared deviations from the mean] of each
+# window.  Like _rollingExtreme(), each window is a suffix of one block and a
+# prefix of the next; the stats of each part are accumulated from values
+# centered on their block mean and the parts are combined with Chan's formula.
+# Windows that may have lost precision to cancellation (eg, after a jump of
+# values within the block) are recomputed from their values.
+def _rollingMoments(values, window):
+  values = numpy.asarray(values, dtype=float)
+  assert values.ndim == 1 and window > 0
+  size = values.shape[0]
+  blocks = (size + 2 * (window - 1)) // window
+  padded = numpy.zeros(blocks * window)
+  padded[window-1:window-1+size] = values
+  weights = numpy.zeros(blocks * window)
+  weights[window-1:window-1+size] = 1.0
+  padded = padded.reshape(blocks, window)
+  weights = weights.reshape(blocks, window)
+  centers = padded.sum(axis=1) / numpy.maximum(weights.sum(axis=1), 1)
+  centered = (padded - centers[:, None]) * weights
+  parts = [weights, centered, centered * centered]
+  prefixes = [numpy.cumsum(part, axis=1).ravel() for part in parts]
+  suffixes = [numpy.cumsum(part[:, ::-1], axis=1)[:, ::-1].ravel()
+              for part in parts]
+  centers = numpy.repeat(centers, window)
+  ends = numpy.arange(window - 1, window - 1 + size)
+  starts = ends - window + 1
+  counts1, sums1, squares1 = [suffix[starts] for suffix in suffixes]
+  counts2, sums2, squares2 = [prefix[ends] for prefix in prefixes]
+  # A window aligned with a block is covered by the prefix alone.
+  aligned = starts % window == 0
+  counts1[aligned], sums1[aligned], squares1[aligned] = 0.0, 0.0, 0.0
+  means1 = centers[starts] + sums1 / numpy.maximum(counts1, 1)
+  means2 = centers[ends] + sums2 / counts2
+  m2s1 = squares1 - sums1 * sums1 / numpy.maximum(counts1, 1)
+  m2s2 = squares2 - sums2 * sums2 / counts2
+  counts = counts1 + counts2
+  deltas = means2 - means1
+  means = means2 - deltas * counts1 / counts
+  m2s = m2s1 + m2s2 + deltas * deltas * counts1 * counts2 / counts
+  m2s = numpy.maximum(m2s, 0.0)
+  mins, maxs = rollingMin(values, window), rollingMax(values, window)
+  constant = mins == maxs
+  means[constant], m2s[constant] = mins[constant], 0.0
+  for i in numpy.nonzero((m2s * 1e6 < squares1 + squares2) & ~constant)[0]:
+    window_values = values[max(0, i - window + 1):i + 1]
+    means[i] = window_values.mean()
+    m2s[i] = numpy.square(window_values - means[i]).sum()
+  return counts, means, m2s
+
+# Population std (ie, divided by the number of values), see
+# _rollingMoments().
+def rollingStd(values, window):
+  counts, _, m2s = _rollingMoments(values, window)
+  return numpy.sqrt(m2s / counts)
+
+# Returns (value - mean) / std of each window, or 0 if std is 0.
+def rollingZscore(values, window):
+  values = numpy.asarray(values, dtype=float)
+  stds = rollingStd(values, window)
+  zscores = values - _rollingMoments(values, window)[1]
+  nonzero = stds > 0
+  zscores[nonzero] /= stds[nonzero]
+  zscores[~nonzero] = 0.0
+  return zscores
+
+def rollingMedian(values, window):
+  return _rollingApply(values, window, numpy.median)
+
+# Exponentially weighted mean with span of window, ie, smoothing factor
+# 2 / (window + 1), starting from the first value.
+def rollingEwm(values, window):
+  values = numpy.asarray(values, dtype=float)
+  assert values.ndim == 1 and window > 0
+  alpha = 2.0 / (window + 1)
+  means = numpy.empty(values.shape[0])
+  mean = None
+  for i in range(values.shape[0]):
+    mean = values[i] if mean is None else mean + alpha * (values[i] - mean)
+    means[i] = mean
+  return means
+
 ##############
 ## IO utils ##
 ##############
@@ -112,6 +304,32 @@ def readTickers(ticker_file):
   with open(ticker_file, 'r') as fp:
     return sorted(fp.read().splitlines())
 
+# Returns tickers listed in changed_ticker_file (see run.py), or all tickers
+# if it is not specified.
+def filterTickers(tickers, changed_ticker_file):
+  if not changed_ticker_file:
+    return tickers
+  changed = set(readTickers(changed_ticker_file))
+  return [ticker for ticker in tickers if ticker in changed]
+
+# Returns the last line of a file (without reading the whole file), or None
+# if the file is empty.
+def readLastLine(path, block_size=4096):
+  with open(path, 'rb') as fp:
+    fp.seek(0, os.SEEK_END)
+    pos = fp.tell()
+    data = ''
+    while pos > 0:
+      size = min(block_size, pos)
+      pos -= size
+      fp.seek(pos)
+      data = fp.read(size) + data
+      lines = data.rstrip('\n').split('\n')
+      # The last line is complete once a newline precedes it.
+      if len(lines) > 1 or pos == 0:
+        return lines[-1] if lines[-1] else None
+  return None
+
 # Reads yahoo projected data.  File format:
 #   date open high low close adjclose volume
 # separated by tabs.
@@ -192,6 +410,59 @@ def readSf1(sf1_file):
     lines = fp.read().splitlines()
   return parseSf1(lines)
 
+# Processed sf1 files can also be read as tables: [dates, indicators, values]
+# where dates are sorted, and values[i, j] is the value of indicators[j] on
+# dates[i] (nan if missing).  Tables are cached in <sf1_file>.npz, which is
+# reused as long as size and mtime of sf1_file are unchanged.
+SF1_TABLE_SUFFIX = '.npz'
+
+def parseSf1Table(lines):
+  assert len(lines) > 0
+  headers = lines[0].split('\t')
+  assert len(headers) > 0
+  assert all([header != '' for header in headers])
+  assert headers[0] == 'date', 'unknown key column: %s' % headers[0]
+  rows = sorted([line.split('\t') for line in lines[1:]])
+  dates = []
+  values = numpy.empty((len(rows), len(headers) - 1))
+  values.fill(numpy.nan)
+  for i in range(len(rows)):
+    items = rows[i]
+    assert len(items) == len(headers)
+    dates.append(items[0])
+    for j in range(1, len(headers)):
+      if items[j] != '':
+        values[i, j-1] = float(items[j])
+  return [dates, headers[1:], values]
+
+def getSf1Source(sf1_file):
+  stat = os.stat(sf1_file)
+  return numpy.array([stat.st_size, stat.st_mtime])
+
+# Returns table of sf1_file (see above), or None if it does not exist.
+def readSf1Table(sf1_file, cache=True):
+  if not os.path.isfile(sf1_file):
+    return None
+  source = getSf1Source(sf1_file)
+  cache_file = '%s%s' % (sf1_file, SF1_TABLE_SUFFIX)
+  if cache and os.path.isfile(cache_file):
+    with numpy.load(cache_file) as data:
+      if numpy.array_equal(data['source'], source):
+        return [data['dates'].tolist(), data['indicators'].tolist(),
+                data['values']]
+  with open(sf1_file, 'r') as fp:
+    table = parseSf1Table(fp.read().splitlines())
+  if cache:
+    # Processes may cache the same file concurrently, so tmp files are
+    # per process.
+    tmp_file = '%s.%d.tmp' % (cache_file, os.getpid())
+    with open(tmp_file, 'wb') as fp:
+      numpy.savez(fp, source=source, dates=numpy.array(table[0], dtype=str),
+                  indicators=numpy.array(table[1], dtype=str),
+                  values=table[2])
+    os.rename(tmp_file, cache_file)
+  return table
+
 def readSf1Column(sf1_file, header):
   if not os.path.isfile(sf1_file):
     return None
@@ -302,3 +573,637 @@ def readKeyListValueList(kv_file):
     vs.append(float(v))
   return ks, vs
 
+
+###################
+## Feature store ##
+###################
+
+# A feature store packs one feature (ie, one dir of per-ticker
+# <date>\t<value> files) into a single binary file.  File layout:
+#   FEATURE_STORE_MAGIC
+#   for each ticker: int32 day numbers (sorted, padded to 8 bytes),
+#                    followed by values (FEATURE_STORE_DTYPE by default)
+#   json index: {'dtype': ..., 'tickers': {ticker: [offset, count], ...},
+#                'source': ...}
+#   uint64 offset of the json index
+# Dates are stored as days since 1970-01-01 (numpy datetime64[D]), yyyy-mm
+# is stored as yyyy-mm-01, and undated features ('*', eg sector) are stored
+# with a single UNDATED_DAY.  Per-ticker arrays are memory-mapped on read.
+# source is the getFeatureSource() of the feature dir converted from, if any,
+# so that stores out of date with their dir can be detected.
+
+FEATURE_STORE_MAGIC = 'QD3FS001'
+FEATURE_STORE_SUFFIX = '.fs'
+FEATURE_STORE_DTYPE = 'float64'
+UNDATED_DAY = numpy.iinfo(numpy.int32).min
+
+def getFeatureStorePath(store_dir, feature):
+  return '%s/%s%s' % (store_dir, feature, FEATURE_STORE_SUFFIX)
+
+# Returns a hash of names, sizes and mtimes of files in feature_dir, which
+# changes when the feature is recomputed.
+def getFeatureSource(feature_dir):
+  md5 = hashlib.md5()
+  for name in sorted(os.listdir(feature_dir)):
+    stat = os.stat('%s/%s' % (feature_dir, name))
+    md5.update('%s\t%d\t%r\n' % (name, stat.st_size, stat.st_mtime))
+  return md5.hexdigest()
+
+# Returns whether store (FeatureStore) is up to date with feature_dir: it is
+# converted from the current content of feature_dir, or there is no
+# feature_dir (eg, the store is written by compute_window_feature.py).
+def isFeatureStoreCurrent(store, feature_dir):
+  if not os.path.isdir(feature_dir):
+    return True
+  return store.source == getFeatureSource(feature_dir)
+
+def ymdsToDays(ymds):
+  """ Converts a list of yyyy-mm-dd (or yyyy-mm) strings into an int32 array
+      of day numbers.  ['*'] is converted to [UNDATED_DAY].
+  """
+  if len(ymds) == 1 and ymds[0] == '*':
+    return numpy.array([UNDATED_DAY], dtype=numpy.int32)
+  return numpy.array(ymds, dtype='datetime64[D]').astype(numpy.int32)
+
+def daysToYmds(days):
+  if len(days) == 1 and days[0] == UNDATED_DAY:
+    return ['*']
+  return list(numpy.asarray(days, dtype=numpy.int32).astype(
+      'datetime64[D]').astype(str))
+
+class FeatureStoreWriter:
+  """ Writes a feature store ticker by ticker.  Output goes to a tmp file
+      which is renamed to store_file upon close().
+  """
+
+  def __init__(self, store_file, dtype=FEATURE_STORE_DTYPE, source=None):
+    self.store_file = store_file
+    self.tmp_file = '%s.tmp' % store_file
+    self.dtype = numpy.dtype(dtype)
+    self.source = source
+    self.tickers = dict()  # ticker => [offset, count]
+    self.fp = open(self.tmp_file, 'wb')
+    self.fp.write(FEATURE_STORE_MAGIC)
+    self.offset = len(FEATURE_STORE_MAGIC)
+
+  def writeBytes(self, data):
+    self.fp.write(data)
+    self.offset += len(data)
+    padding = -self.offset % 8
+    if padding > 0:
+      self.fp.write('\0' * padding)
+      self.offset += padding
+
+  # Writes values for ticker, with dates as a list of yyyy-mm-dd strings.
+  def write(self, ticker, dates, values):
+    self.writeDays(ticker, ymdsToDays(dates), values)
+
+  # Writes values for ticker, with dates as day numbers.
+  def writeDays(self, ticker, days, values):
+    assert ticker not in self.tickers, 'dup ticker %s in %s' % (
+        ticker, self.store_file)
+    days = numpy.asarray(days, dtype=numpy.int32)
+    values = numpy.asarray(values, dtype=self.dtype)
+    assert days.shape == values.shape, 'inconsistent size for %s: %s vs %s' % (
+        ticker, days.shape, values.shape)
+    assert numpy.all(days[1:] > days[:-1]), 'unsorted dates for %s' % ticker
+    self.tickers[ticker] = [self.offset, days.shape[0]]
+    self.writeBytes(days.tobytes())
+    self.writeBytes(values.tobytes())
+
+  def close(self):
+    index_offset = self.offset
+    self.fp.write(json.dumps({'dtype': self.dtype.name,
+                              'tickers': self.tickers,
+                              'source': self.source}))
+    self.fp.write(struct.pack('<Q', index_offset))
+    self.fp.close()
+    os.rename(self.tmp_file, self.store_file)
+
+class FeatureStore:
+  """ Reads a feature store written by FeatureStoreWriter.
+  """
+
+  def __init__(self, store_file):
+    self.store_file = store_file
+    with open(store_file, 'rb') as fp:
+      assert fp.read(len(FEATURE_STORE_MAGIC)) == FEATURE_STORE_MAGIC, (
+          'bad feature store: %s' % store_file)
+      fp.seek(-8, os.SEEK_END)
+      end = fp.tell()
+      index_offset = struct.unpack('<Q', fp.read(8))[0]
+      fp.seek(index_offset)
+      index = json.loads(fp.read(end - index_offset))
+    self.dtype = numpy.dtype(str(index['dtype']))
+    self.source = index.get('source')
+    self.tickers = dict()
+    for ticker, item in index['tickers'].iteritems():
+      self.tickers[str(ticker)] = item
+    self.buffer = numpy.memmap(store_file, dtype=numpy.uint8, mode='r')
+
+  def getTickers(self):
+    return sorted(self.tickers.keys())
+
+  def hasTicker(self, ticker):
+    return ticker in self.tickers
+
+  # Returns memory-mapped (days, values) arrays for ticker.
+  def read(self, ticker):
+    offset, count = self.tickers[ticker]
+    day_bytes = count * 4
+    value_offset = offset + day_bytes + (-(offset + day_bytes) % 8)
+    days = self.buffer[offset:offset+day_bytes].view(numpy.int32)
+    values = self.buffer[value_offset:value_offset+count*self.dtype.itemsize]
+    return days, values.view(self.dtype)
+
+  # Same as readKeyListValueList() for the ticker's feature file.
+  def readKeyListValueList(self, ticker):
+    days, values = self.read(ticker)
+    return daysToYmds(days), [float(value) for value in values]
+
+############
+## Panels ##
+############
+
+# A panel is a feature (ie, one dir of per-ticker <date>\t<value> files) as a
+# dense (dates x tickers) array, with NaN for missing values, where dates
+# are the sorted union of dates of all tickers.  Panels are cached next to
+# the feature dir in <dir>.panel-<dtype>.npy (values, memory-mapped on
+# read) and <dir>.panel-<dtype>.npz (dates, tickers and getFeatureSource()
+# of the dir, so the cache is rebuilt when the feature changes).
+
+PANEL_SUFFIX = '.panel'
+PANEL_DTYPE = 'float32'
+
+def getPanelPrefix(feature_dir, dtype=PANEL_DTYPE):
+  return '%s%s-%s' % (feature_dir.rstrip('/'), PANEL_SUFFIX,
+                      numpy.dtype(dtype).name)
+
+# Returns [dates, tickers, values] of feature_dir (see above).
+def buildPanel(feature_dir, dtype=PANEL_DTYPE):
+  tickers = sorted(os.listdir(feature_dir))
+  data = [readKeyListValueList('%s/%s' % (feature_dir, ticker))
+          for ticker in tickers]
+  dates = set()
+  for ticker_dates, ticker_values in data:
+    dates.update(ticker_dates)
+  dates = sorted(dates)
+  rows = dict([[dates[i], i] for i in range(len(dates))])
+  values = numpy.empty((len(dates), len(tickers)), dtype=dtype)
+  values.fill(numpy.nan)
+  for j in range(len(tickers)):
+    ticker_dates, ticker_values = data[j]
+    values[[rows[date] for date in ticker_dates], j] = ticker_values
+  return [dates, tickers, values]
+
+# Same as buildPanel() but reads from and writes to the panel cache if cache
+# is set.  Cached values are memory-mapped read-only.
+def readPanel(feature_dir, dtype=PANEL_DTYPE, cache=True):
+  if not cache:
+    return buildPanel(feature_dir, dtype)
+  prefix = getPanelPrefix(feature_dir, dtype)
+  source = getFeatureSource(feature_dir)
+  if os.path.isfile('%s.npz' % prefix) and os.path.isfile('%s.npy' % prefix):
+    with numpy.load('%s.npz' % prefix) as data:
+      if str(data['source']) == source:
+        dates = data['dates'].tolist()
+        tickers = data['tickers'].tolist()
+        values = numpy.load('%s.npy' % prefix, mmap_mode='r')
+        if values.shape == (len(dates), len(tickers)):
+          return [dates, tickers, values]
+  dates, tickers, values = buildPanel(feature_dir, dtype)
+  # Processes may cache the same panel concurrently, so tmp files are per
+  # process.  Values are written first, as the cache is checked by source.
+  tmp_prefix = '%s.%d.tmp' % (prefix, os.getpid())
+  writeMatrix(values, '%s.npy' % tmp_prefix)
+  os.rename('%s.npy' % tmp_prefix, '%s.npy' % prefix)
+  with open('%s.npz' % tmp_prefix, 'wb') as fp:
+    numpy.savez(fp, source=source, dates=numpy.array(dates, dtype=str),
+                tickers=numpy.array(tickers, dtype=str))
+  os.rename('%s.npz' % tmp_prefix, '%s.npz' % prefix)
+  return [dates, tickers, values]
+
+# Returns values with NaN replaced by the last non-NaN value above in the
+# same column (NaN before the first one).
+def forwardFill(values):
+  values = numpy.asarray(values)
+  rows = numpy.arange(values.shape[0])[:, None]
+  rows = numpy.where(numpy.isnan(values), 0, rows)
+  rows = numpy.maximum.accumulate(rows, axis=0)
+  return values[rows, numpy.arange(values.shape[1])]
+
+def asOfRows(dates, values, query_dates):
+  """ Returns rows of values as of query_dates, ie, the last non-NaN value
+      of each column on or before each query date (NaN if none).  Dates can
+      be any sorted keys, eg, yyyy-mm-dd or day numbers.
+  """
+  values = numpy.asarray(values)
+  result = numpy.empty((len(query_dates), values.shape[1]))
+  result.fill(numpy.nan)
+  if len(dates) == 0:
+    return result
+  rows = numpy.searchsorted(numpy.asarray(dates), numpy.asarray(query_dates),
+                            side='right') - 1
+  found = rows >= 0
+  result[found] = forwardFill(values)[rows[found]]
+  return result
+
+# Returns rows of values on query_dates, with NaN for missing dates.
+def exactRows(dates, values, query_dates):
+  dates = numpy.asarray(dates)
+  query_dates = numpy.asarray(query_dates)
+  values = numpy.asarray(values)
+  result = numpy.empty((query_dates.shape[0], values.shape[1]))
+  result.fill(numpy.nan)
+  if dates.shape[0] == 0:
+    return result
+  rows = numpy.searchsorted(dates, query_dates)
+  found = rows < dates.shape[0]
+  found[found] = dates[rows[found]] == query_dates[found]
+  result[found] = values[rows[found]]
+  return result
+
+def lookupValues(dates, tickers, values, query_tickers, query_dates,
+                 as_of=False):
+  """ Returns values of (query_tickers[i], query_dates[i]) pairs, with NaN
+      for missing tickers and dates.  Values are looked up on the dates, or
+      as of the dates (see asOfRows()) if as_of is set.  Tickers must be
+      sorted as returned by readPanel().
+  """
+  result = numpy.empty(len(query_dates))
+  result.fill(numpy.nan)
+  if len(dates) == 0 or len(tickers) == 0 or len(query_dates) == 0:
+    return result
+  dates = numpy.asarray(dates)
+  tickers = numpy.asarray(tickers)
+  query_dates = numpy.asarray(query_dates)
+  query_tickers = numpy.asarray(query_tickers)
+  values = numpy.asarray(values)
+  cols = numpy.searchsorted(tickers, query_tickers)
+  found = cols < tickers.shape[0]
+  found[found] = tickers[cols[found]] == query_tickers[found]
+  if as_of:
+    rows = numpy.searchsorted(dates, query_dates, side='right') - 1
+    found &= rows >= 0
+    # Only fill columns of queried tickers.
+    used = numpy.unique(cols[found])
+    filled = forwardFill(values[:, used])
+    result[found] = filled[rows[found], numpy.searchsorted(used, cols[found])]
+  else:
+    rows = numpy.searchsorted(dates, query_dates)
+    found &= rows < dates.shape[0]
+    found[found] = dates[rows[found]] == query_dates[found]
+    result[found] = values[rows[found], cols[found]]
+  return result
+
+def crossSectionalRanks(values, average_ties=False):
+  """ Returns 0-based ranks of values within each row (nan for nan values).
+      Ties are ranked in column order, or get the average of their ranks if
+      average_ties is set.
+  """
+  values = numpy.asarray(values, dtype=float)
+  # Stable sort, nan values go last.
+  order = numpy.argsort(values, axis=1, kind='mergesort')
+  rows = numpy.arange(values.shape[0])[:, None]
+  sorted_ranks = numpy.empty(values.shape)
+  sorted_ranks[:] = numpy.arange(values.shape[1])
+  if average_ties and values.size > 0:
+    sorted_values = values[rows, order]
+    # Flat indices of the first and last values of runs of equal values,
+    # where each row starts a new run.
+    starts = numpy.ones(values.shape, dtype=bool)
+    starts[:, 1:] = sorted_values[:, 1:] != sorted_values[:, :-1]
+    starts = starts.ravel()
+    first = numpy.flatnonzero(starts)
+    last = numpy.append(first[1:], starts.shape[0]) - 1
+    averages = ((first + last) / 2.0
+                - first // values.shape[1] * values.shape[1])
+    sorted_ranks = averages[numpy.cumsum(starts) - 1].reshape(values.shape)
+  ranks = numpy.empty(values.shape)
+  ranks[rows, order] = sorted_ranks
+  ranks[numpy.isnan(values)] = numpy.nan
+  return ranks
+
+def crossSectionalPercs(values, rank, eps=1e-5):
+  """ Returns percentiles of values within each row (nan for nan values):
+      0-based rank (see crossSectionalRanks()) divided by count if rank is
+      set, or (value - min) / (max - min), which is 0.5 if max - min < eps.
+      A row with a single value gets 0.5.
+  """
+  values = numpy.asarray(values, dtype=float)
+  present = ~numpy.isnan(values)
+  counts = present.sum(axis=1)
+  with numpy.errstate(divide='ignore', invalid='ignore'):
+    if rank:
+      percs = crossSectionalRanks(values) / counts[:, None]
+    else:
+      minv = numpy.nanmin(values, axis=1)[:, None]
+      span = numpy.nanmax(values, axis=1)[:, None] - minv
+      percs = (values - minv) / span
+      percs[numpy.broadcast_to(span < eps, percs.shape)] = 0.5
+  percs[counts == 1] = 0.5
+  percs[~present] = numpy.nan
+  return percs
+
+##################
+## Matrix utils ##
+##################
+
+# Data/label/rlabel/weight files of an experiment are either text (one row
+# per line, delimited by space) or .npy files.  readMatrix() detects the
+# format by the .npy magic string, so readers work with both.
+
+NPY_MAGIC = '\x93NUMPY'
+# Fixed size of the .npy header written by NpyWriter, so that it can be
+# rewritten in place once the number of rows is known.
+NPY_HEADER_SIZE = 128
+DATA_FORMATS = ['text', 'npy']
+DATA_DTYPE = 'float32'
+
+def isNpyFile(matrix_file):
+  with open(matrix_file, 'rb') as fp:
+    return fp.read(len(NPY_MAGIC)) == NPY_MAGIC
+
+def readMatrix(matrix_file, mmap_mode=None):
+  """ Reads a text or .npy matrix (or vector).  If mmap_mode is set (see
+      numpy.load), .npy files are memory-mapped instead of loaded into memory.
+  """
+  if isNpyFile(matrix_file):
+    return numpy.load(matrix_file, mmap_mode=mmap_mode)
+  return numpy.loadtxt(matrix_file)
+
+def writeMatrix(matrix, matrix_file):
+  with open(matrix_file, 'wb') as fp:
+    numpy.save(fp, matrix)
+
+class NpyWriter:
+  """ Writes a .npy file incrementally.  Rows are appended with write(),
+      and the header is filled in upon close().
+  """
+
+  def __init__(self, npy_file, columns=None, dtype=DATA_DTYPE):
+    self.npy_file = npy_file
+    self.columns = columns  # None for a vector
+    self.dtype = numpy.dtype(dtype)
+    self.rows = 0
+    self.fp = open(npy_file, 'wb')
+    self.fp.write(' ' * NPY_HEADER_SIZE)
+
+  def write(self, rows):
+    rows = numpy.asarray(rows, dtype=self.dtype)
+    if self.columns is None:
+      assert len(rows.shape) == 1, 'bad shape: %s' % (rows.shape,)
+    else:
+      assert len(rows.shape) == 2 and rows.shape[1] == self.columns, (
+          'bad shape: %s' % (rows.shape,))
+    self.fp.write(rows.tobytes())
+    self.rows += rows.shape[0]
+
+  def close(self):
+    if self.columns is None:
+      shape = '(%d,)' % self.rows
+    else:
+      shape = '(%d, %d)' % (self.rows, self.columns)
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': %s, }" % (
+        self.dtype.str, shape)
+    prefix = NPY_MAGIC + '\x01\x00' + struct.pack(
+        '<H', NPY_HEADER_SIZE - len(NPY_MAGIC) - 4)
+    header = header.ljust(NPY_HEADER_SIZE - len(prefix) - 1) + '\n'
+    assert len(prefix) + len(header) == NPY_HEADER_SIZE
+    self.fp.seek(0)
+    self.fp.write(prefix + header)
+    self.fp.close()
+
+def selectMatrixRows(matrix_file, rows, output_file):
+  """ Writes rows (sorted 0-based indices) of a text or .npy matrix (or
+      vector) to output_file in the same format.
+  """
+  if isNpyFile(matrix_file):
+    writeMatrix(readMatrix(matrix_file, mmap_mode='r')[rows], output_file)
+    return
+  rows = set(rows)
+  with open(matrix_file, 'r') as ifp:
+    with open(output_file, 'w') as ofp:
+      for i, line in enumerate(ifp):
+        if i in rows:
+          ofp.write(line)
+
+###############
+## Manifests ##
+###############
+
+HASH_CHUNK_SIZE = 1 << 20
+
+def getManifestPath(step):
+  return '%s/MANIFEST-%s' % (SYMBOL_DIR, step)
+
+# Returns manifest of the specified step, or None if there is none.
+def readManifest(step):
+  manifest_file = getManifestPath(step)
+  if not os.path.isfile(manifest_file):
+    return None
+  with open(manifest_file, 'r') as fp:
+    return json.load(fp)
+
+def writeManifest(step, manifest):
+  manifest_file = getManifestPath(step)
+  with open('%s.tmp' % manifest_file, 'w') as fp:
+    json.dump(manifest, fp)
+  os.rename('%s.tmp' % manifest_file, manifest_file)
+
+# Returns md5 of path, or of its first size bytes if size is specified.
+def hashFile(path, size=None):
+  md5 = hashlib.md5()
+  with open(path, 'rb') as fp:
+    while size is None or size > 0:
+      chunk_size = HASH_CHUNK_SIZE
+      if size is not None:
+        chunk_size = min(chunk_size, size)
+        size -= chunk_size
+      chunk = fp.read(chunk_size)
+      if not chunk:
+        break
+      md5.update(chunk)
+  return md5.hexdigest()
+
+# Yields files of paths, where each path is a file or a dir (recursively).
+def listFiles(paths):
+  for path in paths:
+    if os.path.isfile(path):
+      yield path
+    elif os.path.isdir(path):
+      for root, dirs, files in os.walk(path):
+        for f in sorted(files):
+          yield os.path.join(root, f)
+
+def buildManifest(inputs, params, previous=None):
+  """ Returns manifest {'params': params, 'files': {path: [size, mtime,
+      md5]}} of files of inputs (see listFiles()) and json-serializable
+      params.  md5 of files with the same size and mtime as in previous
+      manifest is reused instead of being recomputed.
+  """
+  previous_files = dict()
+  if previous is not None:
+    previous_files = previous['files']
+  files = dict()
+  for path in listFiles(inputs):
+    stat = os.stat(path)
+    previous_file = previous_files.get(path)
+    if (previous_file is not None and previous_file[0] == stat.st_size
+        and previous_file[1] == stat.st_mtime):
+      md5 = previous_file[2]
+    else:
+      md5 = hashFile(path)
+    files[path] = [stat.st_size, stat.st_mtime, md5]
+  # Round trip so that params compare equal to those read from file.
+  return {'params': json.loads(json.dumps(params)), 'files': files}
+
+# Returns ticker of path if it matches any pattern of ticker_inputs (eg,
+# '/dir/{ticker}.csv'), or None.
+def matchTicker(path, ticker_inputs):
+  for ticker_input in ticker_inputs:
+    prefix, suffix = ticker_input.split('{ticker}')
+    if (path.startswith(prefix) and path.endswith(suffix)
+        and len(path) > len(prefix) + len(suffix)):
+      ticker = path[len(prefix):len(path)-len(suffix)]
+      if ticker.find('/') < 0:
+        return ticker
+  return None
+
+# Returns whether path (of manifest) only had content appended since
+# previous manifest.
+def isAppended(path, previous, manifest):
+  if path not in previous['files'] or path not in manifest['files']:
+    return False
+  size, mtime, md5 = previous['files'][path]
+  return (manifest['files'][path][0] >= size
+          and hashFile(path, size) == md5)
+
+def getChangedTickers(previous, manifest, ticker_inputs, append_inputs=None):
+  """ Returns sorted tickers whose files (see matchTicker()) have been added,
+      removed or changed in content from previous to manifest.  Returns None
+      if params or any other file changed, in which case all tickers should
+      be recomputed.  Files in append_inputs (eg, trading days) are not
+      considered changed if content was only appended to them.
+  """
+  if previous['params'] != manifest['params']:
+    return None
+  previous_files = previous['files']
+  files = manifest['files']
+  tickers = set()
+  for path in set(previous_files.keys()) | set(files.keys()):
+    if (path in previous_files and path in files
+        and previous_files[path][2] == files[path][2]):
+      continue
+    if (append_inputs and pathsOverlap([path], append_inputs)
+        and isAppended(path, previous, manifest)):
+      logging.info('appended file: %s' % path)
+      continue
+    ticker = matchTicker(path, ticker_inputs)
+    if ticker is None:
+      logging.info('changed file: %s' % path)
+      return None
+    tickers.add(ticker)
+  return sorted(tickers)
+
+#####################
+## Step scheduling ##
+#####################
+
+def pathsOverlap(paths1, paths2):
+  """ Returns whether any path of paths1 is the same as, or is under or above,
+      any path of paths2.
+  """
+  for path1 in paths1:
+    for path2 in paths2:
+      if (path1 == path2 or path1.startswith(path2 + '/')
+          or path2.startswith(path1 + '/')):
+        return True
+  return False
+
+def getStepDeps(steps):
+  """ Returns dependencies of each step (see runSteps()) as a set of indices
+      of earlier steps that it must run after: those whose outputs overlap
+      its inputs (read after write), and those whose inputs or outputs
+      overlap its outputs (write after read, and write after write).
+  """
+  deps = []
+  for i in range(len(steps)):
+    inputs, outputs = steps[i][2], steps[i][3]
+    deps.append(set([j for j in range(i)
+                     if pathsOverlap(steps[j][3], inputs)
+                     or pathsOverlap(steps[j][2], outputs)
+                     or pathsOverlap(steps[j][3], outputs)]))
+  return deps
+
+def getStepReaders(steps):
+  """ Returns names of later steps that read outputs of each step (ie, depend
+      on it for read after write, see getStepDeps()), by step name.
+  """
+  deps = getStepDeps(steps)
+  readers = dict([[step[0], []] for step in steps])
+  for i in range(len(steps)):
+    for j in sorted(deps[i]):
+      if pathsOverlap(steps[j][3], steps[i][2]):
+        readers[steps[j][0]].append(steps[i][0])
+  return readers
+
+def runSteps(steps, workers=1):
+  """ Runs steps, each being [name, function, inputs, outputs], where inputs
+      and outputs are lists of paths (files or dirs) that function reads and
+      writes.  Steps are listed in a valid serial order; a step starts once
+      all earlier steps it depends on (see getStepDeps()) are finished, with
+      up to workers steps running concurrently.  If function returns False,
+      the step is considered skipped.  Logs wall time of each step run and
+      returns [[name, seconds] ...] of them in finishing order.  Upon
+      failure, no more steps are started and AssertionError is raised once
+      running steps are finished.
+  """
+  deps = getStepDeps(steps)
+  results = Queue.Queue()
+
+  def runStep(i):
+    start = time.time()
+    try:
+      ran = steps[i][1]()
+      error = None
+    except Exception:
+      ran = True
+      error = traceback.format_exc()
+    results.put([i, ran, time.time() - start, error])
+
+  pool = multiprocessing.pool.ThreadPool(workers)
+  pending = range(len(steps))
+  done = set()
+  running = set()
+  times = []
+  failed = []
+  while True:
+    if not failed:
+      for i in list(pending):
+        if deps[i] <= done:
+          pending.remove(i)
+          running.add(i)
+          pool.apply_async(runStep, [i])
+    if not running:
+      break
+    try:
+      # Waits with a timeout so that KeyboardInterrupt is not blocked.
+      i, ran, seconds, error = results.get(True, 1)
+    except Queue.Empty:
+      continue
+    running.remove(i)
+    name = steps[i][0]
+    if error is not None:
+      logging.error('step %s failed after %.1f seconds:\n%s' % (
+          name, seconds, error))
+      failed.append(name)
+      continue
+    done.add(i)
+    if ran is not False:
+      logging.info('step %s finished in %.1f seconds' % (name, seconds))
+      times.append([name, seconds])
+  pool.close()
+  pool.join()
+  assert not failed, 'failed steps: %s' % ', '.join(failed)
+  return times